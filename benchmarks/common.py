@@ -0,0 +1,128 @@
+"""
+Setup and measurements shared by the benchmarks: stub settings, the scratch environment and report helpers.
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STUBS_PATH = os.path.join(REPO_ROOT, "benchmarks", "stubs")
+TOKEN = "123456:BENCHMARK"
+
+
+
+def add_stub_arguments(parser: argparse.ArgumentParser) -> None:
+    """Options of the render workers and of the sleeping LivePortrait and voice conversion stubs."""
+    parser.add_argument("--workers", type=int, default=1, help="LivePortrait worker processes and render slots")
+    parser.add_argument("--load-seconds", type=float, default=1.0, help="Stub checkpoint loading time per worker")
+    parser.add_argument("--face-seconds", type=float, default=0.05, help="Stub face detection time")
+    parser.add_argument("--source-seconds", type=float, default=0.2, help="Stub reference image preparation time")
+    parser.add_argument("--motion-seconds", type=float, default=0.3, help="Stub motion extraction time")
+    parser.add_argument("--render-seconds", type=float, default=1.0, help="Stub rendering time per video")
+    parser.add_argument("--voice-seconds", type=float, default=0.3, help="Stub voice conversion time per video")
+
+
+def prepare_environment(args: argparse.Namespace, max_queued_renders: int) -> str:
+    """
+    Moves into a scratch directory, so storage, caches and logs of the run don't touch the repository,
+    and points the bot's settings at the stubs. Must run before any bot module is imported.
+
+    Args:
+        args: Parsed options, including the ones of `add_stub_arguments`
+        max_queued_renders: Lower bound of the render queue limit, so the load itself isn't rejected
+    Returns:
+        Path of the scratch directory
+    """
+    os.environ.update({
+        "TG_BOT_TOKEN": TOKEN,
+        "ADMIN_NICKNAME": "bench_admin",
+        "TALKERBOT_BENCH_LOAD_SECONDS": str(args.load_seconds),
+        "TALKERBOT_BENCH_FACE_SECONDS": str(args.face_seconds),
+        "TALKERBOT_BENCH_SOURCE_SECONDS": str(args.source_seconds),
+        "TALKERBOT_BENCH_MOTION_SECONDS": str(args.motion_seconds),
+        "TALKERBOT_BENCH_RENDER_SECONDS": str(args.render_seconds),
+    })
+    workdir = tempfile.mkdtemp(prefix="talkerbot-bench-")
+    os.symlink(os.path.join(REPO_ROOT, "resources"), os.path.join(workdir, "resources"))
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_ROOT)
+
+    import config
+    config.liveportrait_path = os.path.join(STUBS_PATH, "LivePortrait")
+    config.render_workers = config.render_slots = args.workers
+    config.max_queued_renders = max(config.max_queued_renders, max_queued_renders)
+    config.metrics_port = None
+    return workdir
+
+
+def percentiles(values: list) -> dict:
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, round(q * (len(ordered) - 1)))], 4)
+
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered), 4),
+        "p50": pick(0.5),
+        "p95": pick(0.95),
+        "p99": pick(0.99),
+        "max": round(ordered[-1], 4),
+    }
+
+
+def _rss_bytes(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def _children(pid: int) -> list:
+    children = []
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                children += [int(child) for child in f.read().split()]
+    except OSError:
+        pass
+    return children
+
+
+def process_tree_rss() -> int:
+    """Resident memory of this process and all its descendants (Linux only, 0 elsewhere)."""
+    total, pending = 0, [os.getpid()]
+    while pending:
+        pid = pending.pop()
+        total += _rss_bytes(pid)
+        pending += _children(pid)
+    return total
+
+
+async def sample_process(lags: list, peak_rss: list, stop: asyncio.Event, interval: float = 0.01) -> None:
+    """Measures how late the event loop wakes up from a short sleep, and memory of the process tree, until `stop` is set."""
+    ticks = 0
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, time.perf_counter() - started - interval))
+        ticks += 1
+        if ticks % 10 == 0:
+            peak_rss[0] = max(peak_rss[0], process_tree_rss())
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "-C", REPO_ROOT, "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -0,0 +1,47 @@
+"""
+Compares two benchmark reports written by `benchmarks.run`, level by level.
+
+    python -m benchmarks.compare before.json after.json
+"""
+import sys
+import json
+
+
+
+def _rows(level: dict) -> dict:
+    rows = {
+        "throughput_videos_per_minute": level["throughput_videos_per_minute"],
+        "flows_failed": level["flows_failed"],
+        "peak_rss_mb": round(level["peak_rss_bytes"] / 1024 ** 2, 1),
+        "event_loop_lag.p99": level["event_loop_lag"].get("p99"),
+    }
+    for group in ("latency", "stages"):
+        for name, stats in level[group].items():
+            for quantile in ("p50", "p95", "p99"):
+                if quantile in stats:
+                    rows[f"{group}.{name}.{quantile}"] = stats[quantile]
+    return rows
+
+
+def compare(before: dict, after: dict) -> None:
+    print(f"before: {before.get('commit')}  after: {after.get('commit')}")
+    after_levels = {level["concurrency"]: level for level in after["levels"]}
+    for old in before["levels"]:
+        new = after_levels.get(old["concurrency"])
+        if new is None:
+            continue
+        print(f"\nconcurrency {old['concurrency']}")
+        old_rows, new_rows = _rows(old), _rows(new)
+        for name in sorted(old_rows.keys() | new_rows.keys()):
+            old_value, new_value = old_rows.get(name), new_rows.get(name)
+            change = ""
+            if old_value and new_value is not None:
+                change = f"{(new_value - old_value) / old_value * 100:+.1f}%"
+            print(f"  {name:<45} {str(old_value):>12} {str(new_value):>12} {change:>9}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit("Usage: python -m benchmarks.compare BEFORE.json AFTER.json")
+    with open(sys.argv[1], encoding="utf-8") as before, open(sys.argv[2], encoding="utf-8") as after:
+        compare(json.load(before), json.load(after))
@@ -0,0 +1,255 @@
+import os
+import json
+import time
+import asyncio
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+
+
+def _parse_form(content_type: str, body: bytes) -> dict:
+    """Parses a Bot API request body, uploaded files are returned as bytes and other fields as str."""
+    if content_type.startswith("multipart/form-data"):
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + body
+        )
+        fields = {}
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            payload = part.get_payload(decode=True)
+            fields[name] = payload if part.get_filename() else payload.decode()
+        return fields
+    if content_type.startswith("application/json"):
+        return {key: value if isinstance(value, str) else json.dumps(value) for key, value in json.loads(body or b"{}").items()}
+    return dict(parse_qsl(body.decode()))
+
+
+
+class FakeBotApi:
+    """
+    In-memory stand-in for the Telegram Bot API, served over HTTP from a background thread.
+
+    Point a bot at it with `base_url=api.base_url` and `base_file_url=api.base_file_url`.
+    Updates queued with `push_update` are served to long polling getUpdates calls.
+    Files registered with `add_file` can be fetched through getFile and downloaded, uploaded
+    files get a file_id and can be sent again by it. Every call is recorded in `calls`
+    with its time, and coroutines can wait for a call with `wait_for`.
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.files = {}  # file_id -> path or bytes
+        self.calls = []  # (time, method, chat_id, uploaded bytes)
+        self.pushed = {}  # update_id -> time the update was queued
+        self.fetched = {}  # update_id -> time the bot first received it through getUpdates
+        self._updates = []  # not yet confirmed by a getUpdates offset
+        self._waiters = {}  # (chat_id, method) -> [(loop, future)]
+        self._lock = threading.Lock()
+        self._updates_ready = threading.Condition(self._lock)
+        self._closed = False
+        self._message_id = 0
+        self._file_id = 0
+        self._update_id = 0
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._thread = None
+
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+    @property
+    def base_url(self) -> str:
+        return f"{self.url}/bot"
+
+
+    @property
+    def base_file_url(self) -> str:
+        return f"{self.url}/file/bot"
+
+
+    def start(self) -> "FakeBotApi":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-bot-api", daemon=True)
+        self._thread.start()
+        return self
+
+
+    def stop(self) -> None:
+        with self._updates_ready:
+            self._closed = True
+            self._updates_ready.notify_all()  # releases pending long polls
+        self._server.shutdown()
+        self._server.server_close()
+
+
+    def add_file(self, file_id: str, path: str) -> None:
+        """Makes a local file downloadable under `file_id`, as if a user had sent it."""
+        self.files[file_id] = path
+
+
+    def push_update(self, update: dict) -> int:
+        """Queues an update for the bot, as if a user had sent it. Returns its update_id."""
+        with self._updates_ready:
+            self._update_id += 1
+            update_id = self._update_id
+            self._updates.append({"update_id": update_id, **update})
+            self.pushed[update_id] = time.perf_counter()
+            self._updates_ready.notify_all()
+        return update_id
+
+
+    def next_message_id(self) -> int:
+        with self._lock:
+            self._message_id += 1
+            return self._message_id
+
+
+    def wait_for(self, chat_id: int, *methods: str) -> asyncio.Future:
+        """Returns a future resolved with the call time of the next call of any of `methods` for `chat_id`."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            for method in methods:
+                self._waiters.setdefault((chat_id, method), []).append((loop, future))
+        return future
+
+
+    def count(self, method: str) -> int:
+        with self._lock:
+            return sum(1 for _, called, _, _ in self.calls if called == method)
+
+
+    def uploaded_bytes(self) -> int:
+        with self._lock:
+            return sum(size for *_, size in self.calls)
+
+
+    def _store_upload(self, content: bytes) -> str:
+        with self._lock:
+            self._file_id += 1
+            file_id = f"uploaded-{self._file_id}"
+        self.files[file_id] = content
+        return file_id
+
+
+    def _record(self, method: str, chat_id, uploaded: int) -> None:
+        now = time.perf_counter()
+        with self._lock:
+            self.calls.append((now, method, chat_id, uploaded))
+            waiters = self._waiters.pop((chat_id, method), [])
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(lambda f=future: f.done() or f.set_result(now))
+
+
+    def _message(self, chat_id: int, **content) -> dict:
+        return {
+            "message_id": self.next_message_id(),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            **content,
+        }
+
+
+    def _get_updates(self, fields: dict) -> list:
+        """Long polling: waits up to `timeout` seconds for updates from `offset` on."""
+        offset = int(fields.get("offset") or 0)
+        limit = int(fields.get("limit") or 100)
+        deadline = time.monotonic() + float(fields.get("timeout") or 0)
+        with self._updates_ready:
+            self._updates = [update for update in self._updates if update["update_id"] >= offset]
+            while not self._updates and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._updates_ready.wait(remaining)
+            updates = self._updates[:limit]
+            now = time.perf_counter()
+            for update in updates:
+                self.fetched.setdefault(update["update_id"], now)
+        return updates
+
+
+    def _media(self, fields: dict, name: str) -> tuple:
+        """Returns file_id of sent media and the number of bytes uploaded for it."""
+        media = fields.get(name)
+        if isinstance(media, bytes):
+            return self._store_upload(media), len(media)
+        return media, 0
+
+
+    def call(self, method: str, fields: dict):
+        """Handles one Bot API method, returns the `result` of the response."""
+        chat_id = int(fields["chat_id"]) if fields.get("chat_id") else None
+        uploaded = 0
+
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "TalkerBot", "username": "fake_talker_bot"}
+        elif method == "getUpdates":
+            result = self._get_updates(fields)
+        elif method == "getFile":
+            file_id = fields["file_id"]
+            content = self.files[file_id]
+            size = len(content) if isinstance(content, bytes) else os.path.getsize(content)
+            result = {"file_id": file_id, "file_unique_id": file_id, "file_size": size, "file_path": f"files/{file_id}"}
+        elif method == "sendMessage":
+            result = self._message(chat_id, text=fields.get("text", ""))
+        elif method == "sendVideoNote":
+            file_id, uploaded = self._media(fields, "video_note")
+            result = self._message(chat_id, video_note={"file_id": file_id, "file_unique_id": file_id, "length": 480, "duration": 1})
+        elif method == "sendVideo":
+            file_id, uploaded = self._media(fields, "video")
+            result = self._message(chat_id, video={"file_id": file_id, "file_unique_id": file_id, "width": 480, "height": 480, "duration": 1})
+        else:
+            result = True  # answerCallbackQuery, deleteWebhook and other calls without interesting results
+
+        self._record(method, chat_id, uploaded)
+        return result
+
+
+    def _handler_class(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _send(self, status: int, body: bytes, content_type: str = "application/json") -> None:
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+
+            def do_GET(self):
+                if self.path.startswith("/file/"):
+                    file_id = self.path.rsplit("/", 1)[-1]
+                    content = api.files.get(file_id)
+                    if content is None:
+                        self._send(404, b"")
+                        return
+                    if not isinstance(content, bytes):
+                        with open(content, "rb") as f:
+                            content = f.read()
+                    self._send(200, content, "application/octet-stream")
+                    return
+                self.do_POST()
+
+
+            def do_POST(self):
+                method = self.path.rsplit("/", 1)[-1]
+                length = int(self.headers.get("Content-Length") or 0)
+                fields = _parse_form(self.headers.get("Content-Type", ""), self.rfile.read(length))
+                try:
+                    response = {"ok": True, "result": api.call(method, fields)}
+                except Exception as e:
+                    response = {"ok": False, "error_code": 400, "description": f"Bad Request: {e}"}
+                self._send(200, json.dumps(response).encode())
+
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,349 @@
+"""
+Load test of the bot with many users sending scripted traffic at once.
+
+The bot runs as in production, polling getUpdates, but against the fake Bot API (`telegram_base_url` /
+`telegram_base_file_url` settings) with LivePortrait and voice conversion replaced by sleeping stubs.
+Allowlisted users join over a ramp-up window and each plays a number of flows picked from a traffic mix:
+
+    animate       photo, a driving video, waits for the animation, /done
+    set_voice     /set_voice and a click on a voice button
+    upload_voice  /upload_voice and a voice message
+
+    python -m benchmarks.load --users 200 --mix mixed --output load.json
+    python -m benchmarks.load --users 50 --mix animate=1,set_voice=3
+
+The report holds how long updates wait before a handler sees them, time to the first reply per step,
+animation delivery times and updates that were dropped, i.e. no command, conversation or state handler ran for them,
+or never answered.
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import platform
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from benchmarks.common import TOKEN, add_stub_arguments, prepare_environment, percentiles, process_tree_rss, sample_process, git_commit
+
+MIXES = {
+    "animate": {"animate": 1},
+    "settings": {"set_voice": 3, "upload_voice": 1},
+    "mixed": {"animate": 6, "set_voice": 3, "upload_voice": 1},
+}
+VOICE_BUTTONS = ["orig", "male", "female"]
+
+
+
+def parse_mix(value: str) -> dict:
+    """A named mix from MIXES or weights like `animate=3,set_voice=1`."""
+    if value in MIXES:
+        return MIXES[value]
+    mix = {}
+    for part in value.split(","):
+        flow, _, weight = part.partition("=")
+        if flow not in MIXES["mixed"]:
+            raise argparse.ArgumentTypeError(f"Unknown flow {flow!r}, expected one of {', '.join(MIXES['mixed'])}.")
+        mix[flow] = float(weight or 1)
+    return mix
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Load test of TalkerBot against a fake Bot API.")
+    parser.add_argument("--users", type=int, default=100, help="Number of simulated users")
+    parser.add_argument("--mix", type=parse_mix, default="mixed", help=f"Traffic mix: {', '.join(MIXES)} or flow=weight,...")
+    parser.add_argument("--flows-per-user", type=int, default=3, help="Flows each user plays one after another")
+    parser.add_argument("--ramp-seconds", type=float, default=10.0, help="Users start at random times within this window")
+    parser.add_argument("--think-time", type=float, default=0.5, help="Pause of a user between two messages")
+    parser.add_argument("--driving-videos", type=int, default=3, help="Distinct driving videos users pick from")
+    parser.add_argument("--video-seconds", type=float, default=3.0)
+    parser.add_argument("--video-size", type=int, default=720)
+    parser.add_argument("--video-fps", type=int, default=30)
+    parser.add_argument("--audio-seconds", type=float, default=5.0, help="Length of uploaded voice messages")
+    add_stub_arguments(parser)
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the traffic script")
+    parser.add_argument("--timeout", type=float, default=300, help="Seconds to wait for an answer before a flow fails")
+    parser.add_argument("--drain-seconds", type=float, default=10, help="Seconds to wait for leftover updates after the last flow")
+    parser.add_argument("--output", default="load.json", help="Where to write the JSON report")
+    parser.add_argument("--verbose", action="store_true", help="Keep the bot's info logs")
+    return parser.parse_args()
+
+
+
+class LoadTest:
+    """Scripted users pushing updates to the fake Bot API, while the bot polls it."""
+    def __init__(self, args: argparse.Namespace, media_dir: str):
+        from benchmarks.fake_bot_api import FakeBotApi
+
+        self.args = args
+        self.media_dir = media_dir
+        self.api = FakeBotApi().start()
+        self.rng = random.Random(args.seed)
+        self.received = {}  # update_id -> time the bot's pre-handlers saw it
+        self.handled = {}  # update_id -> time a command, conversation or state handler started on it
+        self.first_reply = defaultdict(list)
+        self.unanswered = defaultdict(int)
+        self.delivery = []
+        self.flows = defaultdict(lambda: {"completed": 0, "failed": 0})
+
+
+    def _prepare_media(self) -> None:
+        from benchmarks.media import make_photo, make_video, make_voice
+
+        for index in range(self.args.users):
+            path = make_photo(os.path.join(self.media_dir, f"photo-{index}.jpg"), seed=index)
+            self.api.add_file(f"photo-{index}", path)
+        for number in range(self.args.driving_videos):
+            path = os.path.join(self.media_dir, f"video-{number}.mp4")
+            make_video(path, self.args.video_seconds, self.args.video_size, self.args.video_fps, seed=number)
+            self.api.add_file(f"video-{number}", path)
+        path = make_voice(os.path.join(self.media_dir, "voice.ogg"), self.args.audio_seconds, seed=0)
+        self.api.add_file("voice", path)
+
+
+    def _message(self, user_id: int, username: str, **content) -> dict:
+        return {"message": {
+            "message_id": self.api.next_message_id(),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": username, "username": username},
+            **content,
+        }}
+
+
+    def _command(self, user_id: int, username: str, command: str) -> dict:
+        text = f"/{command}"
+        return self._message(user_id, username, text=text, entities=[{"type": "bot_command", "offset": 0, "length": len(text)}])
+
+
+    def _button(self, user_id: int, username: str, data: str) -> dict:
+        """A click on an inline keyboard button under the bot's last message."""
+        return {"callback_query": {
+            "id": str(self.api.next_message_id()),
+            "from": {"id": user_id, "is_bot": False, "first_name": username, "username": username},
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": self.api.next_message_id(),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": 1, "is_bot": True, "first_name": "TalkerBot", "username": "fake_talker_bot"},
+                "text": "choose",
+            },
+        }}
+
+
+    def _file(self, file_id: str) -> dict:
+        path = self.api.files[file_id]
+        return {"file_id": file_id, "file_unique_id": file_id, "file_size": os.path.getsize(path)}
+
+
+    async def _step(self, step: str, user_id: int, update: dict) -> bool:
+        """Sends an update and waits for the first reply to it. Returns False if none came in time."""
+        reply = self.api.wait_for(user_id, "sendMessage", "sendVideoNote", "sendVideo")
+        update_id = self.api.push_update(update)
+        try:
+            replied = await asyncio.wait_for(reply, self.args.timeout)
+        except asyncio.TimeoutError:
+            self.unanswered[step] += 1
+            return False
+        self.first_reply[step].append(replied - self.api.pushed[update_id])
+        return True
+
+
+    async def animate(self, user_id: int, username: str, index: int) -> bool:
+        photo = self._file(f"photo-{index}")
+        if not await self._step("photo", user_id, self._message(user_id, username, photo=[{**photo, "width": 720, "height": 960}])):
+            return False
+        await asyncio.sleep(self.args.think_time)
+
+        number = self.rng.randrange(self.args.driving_videos)
+        video = {
+            **self._file(f"video-{number}"), "mime_type": "video/mp4", "duration": round(self.args.video_seconds),
+            "width": self.args.video_size, "height": self.args.video_size,
+        }
+        delivered = self.api.wait_for(user_id, "sendVideoNote")
+        sent = time.perf_counter()
+        if not await self._step("video", user_id, self._message(user_id, username, video=video)):
+            return False
+        try:
+            self.delivery.append(await asyncio.wait_for(delivered, self.args.timeout) - sent)
+        except asyncio.TimeoutError:
+            self.unanswered["animation"] += 1
+            return False
+        await asyncio.sleep(self.args.think_time)
+        return await self._step("done", user_id, self._command(user_id, username, "done"))
+
+
+    async def set_voice(self, user_id: int, username: str, index: int) -> bool:
+        if not await self._step("set_voice", user_id, self._command(user_id, username, "set_voice")):
+            return False
+        await asyncio.sleep(self.args.think_time)
+        return await self._step("voice_button", user_id, self._button(user_id, username, self.rng.choice(VOICE_BUTTONS)))
+
+
+    async def upload_voice(self, user_id: int, username: str, index: int) -> bool:
+        if not await self._step("upload_voice", user_id, self._command(user_id, username, "upload_voice")):
+            return False
+        await asyncio.sleep(self.args.think_time)
+        voice = {**self._file("voice"), "duration": round(self.args.audio_seconds), "mime_type": "audio/ogg"}
+        return await self._step("voice_message", user_id, self._message(user_id, username, voice=voice))
+
+
+    async def user(self, index: int, start_delay: float, flows: list) -> None:
+        user_id, username = 1_000_000 + index, f"load_{index}"
+        await asyncio.sleep(start_delay)
+        for flow in flows:
+            completed = await getattr(self, flow)(user_id, username, index)
+            self.flows[flow]["completed" if completed else "failed"] += 1
+            await asyncio.sleep(self.args.think_time)
+
+
+    async def _drain(self) -> None:
+        """Gives the bot time to take in updates still queued after the last flow."""
+        deadline = time.perf_counter() + self.args.drain_seconds
+        while len(self.received) < len(self.api.pushed) and time.perf_counter() < deadline:
+            await asyncio.sleep(0.1)
+
+
+    async def _record_received(self, update, context) -> None:
+        self.received.setdefault(update.update_id, time.perf_counter())
+
+
+    def _record_handled(self, app) -> None:
+        """
+        Wraps the callbacks of the bot's handlers, so an update counts as handled only once one of them ran for it.
+        Pre-handlers see every update, also the ones a ConversationHandler drops.
+        """
+        from telegram.ext import ConversationHandler
+
+        def record(handler):
+            callback = handler.callback
+
+            async def recorded(update, context):
+                self.handled.setdefault(update.update_id, time.perf_counter())
+                return await callback(update, context)
+            handler.callback = recorded
+
+        for handler in app.handlers.get(0, []):
+            if isinstance(handler, ConversationHandler):
+                for state_handlers in [handler.entry_points, handler.fallbacks, *handler.states.values()]:
+                    for state_handler in state_handlers:
+                        record(state_handler)
+            else:
+                record(handler)
+
+
+    async def run(self) -> dict:
+        import config
+        config.telegram_base_url = self.api.base_url
+        config.telegram_base_file_url = self.api.base_file_url
+
+        from telegram import Update
+        from telegram.ext import TypeHandler
+        from bot.bot_manager import BotManager
+        from bot.telegram_bot import TalkerBot
+        from benchmarks.stubs.voice import install_voice_stub
+        from utils.face_detector import FaceDetector
+        from utils.render_worker import RenderWorkerPool
+
+        await asyncio.to_thread(self._prepare_media)
+        app = TalkerBot(TOKEN).app
+        app.add_handler(TypeHandler(Update, self._record_received), group=-2)
+        self._record_handled(app)
+        manager = BotManager()
+        for index in range(self.args.users):
+            manager.add_user(f"load_{index}")
+        workers = RenderWorkerPool()
+        workers.start()
+        FaceDetector().start()
+        install_voice_stub(self.args.voice_seconds)
+
+        flows, weights = list(self.args.mix), list(self.args.mix.values())
+        script = [
+            (self.rng.uniform(0, self.args.ramp_seconds), self.rng.choices(flows, weights, k=self.args.flows_per_user))
+            for _ in range(self.args.users)
+        ]
+
+        await app.initialize()
+        await app.updater.start_polling(poll_interval=0)
+        await app.start()
+        lags, peak_rss, stop = [], [process_tree_rss()], asyncio.Event()
+        sampler = asyncio.create_task(sample_process(lags, peak_rss, stop))
+        try:
+            started = time.perf_counter()
+            await asyncio.gather(*(self.user(index, delay, user_flows) for index, (delay, user_flows) in enumerate(script)))
+            wall = time.perf_counter() - started
+            await self._drain()
+        finally:
+            stop.set()
+            await sampler
+            await app.updater.stop()
+            await app.stop()
+            await app.shutdown()
+            workers.shutdown()
+            FaceDetector().shutdown()
+            manager.close()
+            self.api.stop()
+        return self.report(wall, lags, peak_rss[0])
+
+
+    def report(self, wall: float, lags: list, peak_rss: int) -> dict:
+        pushed, fetched = self.api.pushed, self.api.fetched
+        calls = defaultdict(int)
+        for _, method, _, _ in self.api.calls:
+            calls[method] += 1
+        return {
+            "wall_seconds": round(wall, 3),
+            "flows": dict(self.flows),
+            "updates": {
+                "pushed": len(pushed),
+                "fetched": len(fetched),
+                "received": len(self.received),
+                "handled": len(self.handled),
+                "dropped": len(pushed.keys() - self.handled.keys()),
+                "unanswered": dict(self.unanswered),
+            },
+            # Time at the Bot API until getUpdates returned the update, and until a handler started on it
+            "fetch_wait": percentiles([fetched[update_id] - pushed[update_id] for update_id in fetched]),
+            "queue_wait": percentiles([self.handled[update_id] - pushed[update_id] for update_id in self.handled if update_id in pushed]),
+            "time_to_first_reply": {step: percentiles(values) for step, values in sorted(self.first_reply.items())},
+            "delivery": percentiles(self.delivery),
+            "event_loop_lag": percentiles(lags),
+            "peak_rss_bytes": peak_rss,
+            "bot_api": {"calls": dict(calls), "uploaded_bytes": self.api.uploaded_bytes()},
+        }
+
+
+def main() -> None:
+    args = parse_args()
+    output = os.path.abspath(args.output)
+    started_at = datetime.now(timezone.utc).isoformat()
+    workdir = prepare_environment(args, args.users)
+    if not args.verbose:
+        logging.disable(logging.INFO)
+
+    media_dir = os.path.join(workdir, "media")
+    os.makedirs(media_dir)
+    results = asyncio.run(LoadTest(args, media_dir).run())
+
+    report = {
+        "commit": git_commit(),
+        "started_at": started_at,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "settings": {key: value for key, value in vars(args).items() if key != "output"},
+        **results,
+    }
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps({key: report[key] for key in ("flows", "updates", "queue_wait")}, indent=2))
+    print(f"Report written to {output}, scratch files are in {workdir}.")
+
+
+if __name__ == "__main__":
+    main()
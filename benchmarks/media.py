@@ -0,0 +1,48 @@
+import subprocess
+
+from PIL import Image, ImageDraw
+
+
+
+def make_photo(path: str, seed: int, size: tuple = (720, 960)) -> str:
+    """Writes a JPEG with a face-like drawing, its colors depend on `seed` so every photo has its own hash."""
+    background = ((seed * 37) % 256, (seed * 91) % 256, (seed * 53) % 256)
+    image = Image.new("RGB", size, background)
+    draw = ImageDraw.Draw(image)
+    width, height = size
+    draw.ellipse((width * 0.3, height * 0.2, width * 0.7, height * 0.6), fill=(224, 172, 105))
+    draw.ellipse((width * 0.4, height * 0.33, width * 0.45, height * 0.37), fill=(0, 0, 0))
+    draw.ellipse((width * 0.55, height * 0.33, width * 0.6, height * 0.37), fill=(0, 0, 0))
+    draw.arc((width * 0.42, height * 0.4, width * 0.58, height * 0.52), 20, 160, fill=(120, 0, 0), width=6)
+    image.save(path, "JPEG", quality=90)
+    return path
+
+
+def make_video(path: str, seconds: float, size: int, fps: int, seed: int) -> str:
+    """Writes an H.264 video with a test pattern and a tone, like a phone video of `size` x `size` pixels."""
+    subprocess.run(
+        [
+            "ffmpeg", "-y", "-v", "error",
+            "-f", "lavfi", "-i", f"testsrc2=size={size}x{size}:rate={fps}:duration={seconds}",
+            "-f", "lavfi", "-i", f"sine=frequency={220 + seed * 40}:duration={seconds}",
+            "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p",
+            "-c:a", "aac", "-shortest",
+            path,
+        ],
+        check=True,
+    )
+    return path
+
+
+def make_voice(path: str, seconds: float, seed: int) -> str:
+    """Writes an Opus voice message with a tone, like the ones Telegram records."""
+    subprocess.run(
+        [
+            "ffmpeg", "-y", "-v", "error",
+            "-f", "lavfi", "-i", f"sine=frequency={180 + seed * 10}:duration={seconds}",
+            "-c:a", "libopus", "-ac", "1",
+            path,
+        ],
+        check=True,
+    )
+    return path
@@ -0,0 +1,243 @@
+"""
+Offline end-to-end benchmark of the bot.
+
+Runs the real handlers, render scheduler, caches, ffmpeg stages and LivePortrait worker processes
+against a fake Bot API. LivePortrait and the voice conversion model are replaced by stubs that sleep
+for configurable times. At every concurrency level, that many simulated users each send a photo,
+driving videos and /done at the same time.
+
+    python -m benchmarks.run --concurrency 1 4 16 --output benchmark.json
+
+Needs ffmpeg and the bot's Python dependencies, but no Telegram account, GPU or model checkpoints.
+The report holds throughput, latency percentiles per stage, event loop lag and peak memory of
+the bot with its workers, so results of two commits can be compared with `benchmarks.compare`.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+import argparse
+import platform
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from benchmarks.common import TOKEN, add_stub_arguments, prepare_environment, percentiles, process_tree_rss, sample_process, git_commit
+
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark of TalkerBot.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="Numbers of simultaneous users")
+    parser.add_argument("--videos-per-user", type=int, default=1, help="Driving videos each user sends after the photo")
+    parser.add_argument("--unique-videos", action="store_true", help="Give every user own videos instead of shared ones")
+    parser.add_argument("--video-seconds", type=float, default=3.0)
+    parser.add_argument("--video-size", type=int, default=720)
+    parser.add_argument("--video-fps", type=int, default=30)
+    parser.add_argument("--voice", choices=["orig", "male", "female"], default="male", help="Voice setting of the users")
+    add_stub_arguments(parser)
+    parser.add_argument("--think-time", type=float, default=0.1, help="Pause of a user between photo and video")
+    parser.add_argument("--timeout", type=float, default=600, help="Seconds to wait for an answer before a flow fails")
+    parser.add_argument("--output", default="benchmark.json", help="Where to write the JSON report")
+    parser.add_argument("--verbose", action="store_true", help="Keep the bot's info logs")
+    return parser.parse_args()
+
+
+
+class Benchmark:
+    """Simulated users talking to the bot through the fake Bot API."""
+    def __init__(self, args: argparse.Namespace, media_dir: str):
+        from benchmarks.fake_bot_api import FakeBotApi
+
+        self.args = args
+        self.media_dir = media_dir
+        self.api = FakeBotApi()
+        self.stages = defaultdict(list)
+        self._update_id = 0
+
+
+    def _next_update_id(self) -> int:
+        self._update_id += 1
+        return self._update_id
+
+
+    def _update(self, user_id: int, username: str, **content):
+        from telegram import Update
+
+        update_id = self._next_update_id()
+        data = {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": username, "username": username},
+                **content,
+            },
+        }
+        return Update.de_json(data, self.app.bot)
+
+
+    def _photo(self, level: int, index: int) -> dict:
+        from benchmarks.media import make_photo
+
+        file_id = f"photo-{level}-{index}"
+        path = make_photo(os.path.join(self.media_dir, f"{file_id}.jpg"), seed=level * 1000 + index)
+        self.api.add_file(file_id, path)
+        return {"photo": [{"file_id": file_id, "file_unique_id": file_id, "width": 720, "height": 960, "file_size": os.path.getsize(path)}]}
+
+
+    def _video(self, level: int, index: int, number: int) -> dict:
+        from benchmarks.media import make_video
+
+        file_id = f"video-{level}-{index}-{number}" if self.args.unique_videos else f"video-{number}"
+        path = os.path.join(self.media_dir, f"{file_id}.mp4")
+        if not os.path.exists(path):
+            make_video(path, self.args.video_seconds, self.args.video_size, self.args.video_fps, seed=number)
+            self.api.add_file(file_id, path)
+        return {"video": {
+            "file_id": file_id, "file_unique_id": file_id, "mime_type": "video/mp4",
+            "width": self.args.video_size, "height": self.args.video_size,
+            "duration": round(self.args.video_seconds), "file_size": os.path.getsize(path),
+        }}
+
+
+    async def _send(self, update) -> None:
+        await self.app.update_queue.put(update)
+
+
+    async def _wait(self, future: asyncio.Future) -> float:
+        return await asyncio.wait_for(future, self.args.timeout)
+
+
+    async def user_flow(self, level: int, index: int, latencies: dict) -> bool:
+        """One user sends a photo, driving videos one after another and /done. Returns False on a timeout."""
+        user_id = 100_000 * (level + 1) + index
+        username = f"bench_{level}_{index}"
+        self.manager.add_user(username)
+        self.manager.set_user_voice(username, self.args.voice)
+        photo = await asyncio.to_thread(self._photo, level, index)
+        videos = [await asyncio.to_thread(self._video, level, index, number) for number in range(self.args.videos_per_user)]
+
+        try:
+            reply = self.api.wait_for(user_id, "sendMessage")
+            sent = time.perf_counter()
+            await self._send(self._update(user_id, username, **photo))
+            latencies["photo_reply"].append(await self._wait(reply) - sent)
+            await asyncio.sleep(self.args.think_time)
+
+            for video in videos:
+                reply = self.api.wait_for(user_id, "sendMessage")
+                delivered = self.api.wait_for(user_id, "sendVideoNote")
+                sent = time.perf_counter()
+                await self._send(self._update(user_id, username, **video))
+                latencies["first_reply"].append(await self._wait(reply) - sent)
+                latencies["delivery"].append(await self._wait(delivered) - sent)
+
+            done = {"text": "/done", "entities": [{"type": "bot_command", "offset": 0, "length": 5}]}
+            await self._send(self._update(user_id, username, **done))
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+    async def run_level(self, level: int, concurrency: int) -> dict:
+        self.stages = defaultdict(list)
+        latencies = defaultdict(list)
+        lags, peak_rss, stop = [], [process_tree_rss()], asyncio.Event()
+        calls_before = len(self.api.calls)
+        uploaded_before = self.api.uploaded_bytes()
+
+        sampler = asyncio.create_task(sample_process(lags, peak_rss, stop))
+        started = time.perf_counter()
+        results = await asyncio.gather(*(self.user_flow(level, index, latencies) for index in range(concurrency)))
+        wall = time.perf_counter() - started
+        stop.set()
+        await sampler
+
+        calls = defaultdict(int)
+        for _, method, _, _ in self.api.calls[calls_before:]:
+            calls[method] += 1
+        delivered = len(latencies["delivery"])
+        return {
+            "concurrency": concurrency,
+            "flows_completed": sum(results),
+            "flows_failed": len(results) - sum(results),
+            "videos_delivered": delivered,
+            "wall_seconds": round(wall, 3),
+            "throughput_videos_per_minute": round(delivered / wall * 60, 2),
+            "latency": {name: percentiles(values) for name, values in latencies.items()},
+            "stages": {stage: percentiles(values) for stage, values in sorted(self.stages.items())},
+            "event_loop_lag": percentiles(lags),
+            "peak_rss_bytes": peak_rss[0],
+            "bot_api": {"calls": dict(calls), "uploaded_bytes": self.api.uploaded_bytes() - uploaded_before},
+        }
+
+
+    async def run(self) -> list:
+        from bot.bot_manager import BotManager
+        from bot.telegram_bot import TalkerBot
+        from benchmarks.stubs.voice import install_voice_stub
+        from utils.metrics import STAGE_SECONDS
+        from utils.face_detector import FaceDetector
+        from utils.render_worker import RenderWorkerPool
+
+        self.api.start()
+        self.app = TalkerBot(TOKEN, base_url=self.api.base_url, base_file_url=self.api.base_file_url).app
+        self.manager = BotManager()
+        workers = RenderWorkerPool()
+        workers.start()
+        FaceDetector().start()
+        install_voice_stub(self.args.voice_seconds)
+        STAGE_SECONDS.add_listener(lambda value, stage, **labels: self.stages[stage].append(value))
+
+        await self.app.initialize()
+        await self.app.start()
+        try:
+            if not self.args.unique_videos:
+                for number in range(self.args.videos_per_user):
+                    await asyncio.to_thread(self._video, 0, 0, number)
+            # Warm up workers and stock voices, the first flow isn't part of the report
+            await self.user_flow(-1, 0, defaultdict(list))
+            levels = []
+            for level, concurrency in enumerate(self.args.concurrency):
+                levels.append(await self.run_level(level, concurrency))
+                print(f"concurrency={concurrency}: {json.dumps(levels[-1]['latency'].get('delivery', {}))}", flush=True)
+            return levels
+        finally:
+            await self.app.stop()
+            await self.app.shutdown()
+            workers.shutdown()
+            FaceDetector().shutdown()
+            self.manager.close()
+            self.api.stop()
+
+
+def main() -> None:
+    args = parse_args()
+    output = os.path.abspath(args.output)
+    started_at = datetime.now(timezone.utc).isoformat()
+    workdir = prepare_environment(args, max(args.concurrency) * args.videos_per_user)
+    if not args.verbose:
+        logging.disable(logging.INFO)
+
+    media_dir = os.path.join(workdir, "media")
+    os.makedirs(media_dir)
+    levels = asyncio.run(Benchmark(args, media_dir).run())
+
+    report = {
+        "commit": git_commit(),
+        "started_at": started_at,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "settings": {key: value for key, value in vars(args).items() if key != "output"},
+        "levels": levels,
+    }
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {output}, scratch files are in {workdir}.")
+
+
+if __name__ == "__main__":
+    main()
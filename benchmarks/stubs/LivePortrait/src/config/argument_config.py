@@ -0,0 +1,12 @@
+from dataclasses import dataclass
+
+
+@dataclass
+class ArgumentConfig:
+    """Arguments of LivePortrait inference the bot passes, see LivePortrait/src/config/argument_config.py"""
+    source: str = ""
+    driving: str = ""
+    output_dir: str = "animations/"
+    flag_crop_driving_video: bool = False
+    device_id: int = 0
+    flag_force_cpu: bool = False
@@ -0,0 +1,9 @@
+from dataclasses import dataclass
+
+
+@dataclass
+class CropConfig:
+    device_id: int = 0
+    flag_force_cpu: bool = False
+    insightface_root: str = ""
+    det_thresh: float = 0.1
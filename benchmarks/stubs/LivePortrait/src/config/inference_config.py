@@ -0,0 +1,8 @@
+from dataclasses import dataclass
+
+
+@dataclass
+class InferenceConfig:
+    device_id: int = 0
+    flag_force_cpu: bool = False
+    flag_crop_driving_video: bool = False
@@ -0,0 +1,67 @@
+"""
+Stand-in for LivePortraitPipeline used by benchmarks, it sleeps instead of running the models.
+
+Timings are read from environment variables, so the bot's worker processes pick them up:
+    TALKERBOT_BENCH_LOAD_SECONDS    loading checkpoints, once per worker
+    TALKERBOT_BENCH_FACE_SECONDS    face detection
+    TALKERBOT_BENCH_SOURCE_SECONDS  source image preparation, skipped when memoized by the worker
+    TALKERBOT_BENCH_MOTION_SECONDS  motion extraction, skipped when rendering from a motion template
+    TALKERBOT_BENCH_RENDER_SECONDS  rendering the animation
+"""
+import os
+import time
+import pickle
+import shutil
+
+from src.utils.face_analysis_diy import FaceAnalysisDIY
+
+
+def _sleep(name: str, default: float) -> None:
+    time.sleep(float(os.environ.get(name, default)))
+
+
+
+class Cropper:
+    def __init__(self):
+        self.face_analysis_wrapper = FaceAnalysisDIY()
+
+
+    def crop_source_image(self, img_rgb, crop_cfg) -> dict:
+        _sleep("TALKERBOT_BENCH_SOURCE_SECONDS", 0.2)
+        return {'img_crop_256x256': None, 'lmk_crop': None, 'M_c2o': None}
+
+
+
+class LivePortraitPipeline:
+    def __init__(self, inference_cfg, crop_cfg):
+        _sleep("TALKERBOT_BENCH_LOAD_SECONDS", 1.0)
+        self.inference_cfg = inference_cfg
+        self.crop_cfg = crop_cfg
+        self.cropper = Cropper()
+
+
+    def execute(self, args) -> tuple:
+        """Writes the driving video as the animation, like LivePortrait names and places its output."""
+        with open(args.source, 'rb') as f:
+            self.cropper.crop_source_image(memoryview(f.read()), self.crop_cfg)
+
+        driving_name = os.path.splitext(os.path.basename(args.driving))[0]
+        if args.driving.endswith('.pkl'):
+            with open(args.driving, 'rb') as f:
+                video = pickle.load(f)['video']
+        else:
+            _sleep("TALKERBOT_BENCH_MOTION_SECONDS", 0.3)
+            with open(args.driving, 'rb') as f:
+                video = f.read()
+            with open(os.path.join(os.path.dirname(args.driving), driving_name + '.pkl'), 'wb') as f:
+                pickle.dump({'video': video}, f)
+        _sleep("TALKERBOT_BENCH_RENDER_SECONDS", 1.0)
+
+        os.makedirs(args.output_dir, exist_ok=True)
+        source_name = os.path.splitext(os.path.basename(args.source))[0]
+        animation_path = os.path.join(args.output_dir, f"{source_name}--{driving_name}.mp4")
+        with open(animation_path, 'wb') as f:
+            f.write(video)
+        concat_path = os.path.join(args.output_dir, f"{source_name}--{driving_name}_concat.mp4")
+        shutil.copyfile(animation_path, concat_path)
+        return animation_path, concat_path
@@ -0,0 +1,29 @@
+"""Stand-in for LivePortrait's FaceAnalysisDIY, it sleeps instead of running the detector and returns a fixed box."""
+import os
+import time
+
+
+
+class _Face:
+    def __init__(self, bbox: list):
+        self.bbox = bbox
+
+
+
+class FaceAnalysisDIY:
+    def __init__(self, name: str = "buffalo_l", root: str = "", providers: list = None):
+        self.name = name
+
+
+    def prepare(self, ctx_id: int = 0, det_size: tuple = (512, 512), det_thresh: float = 0.1) -> None:
+        pass
+
+
+    def warmup(self) -> None:
+        pass
+
+
+    def get(self, img_bgr, **kwargs) -> list:
+        time.sleep(float(os.environ.get("TALKERBOT_BENCH_FACE_SECONDS", 0.05)))
+        height, width = img_bgr.shape[:2]
+        return [_Face([width * 0.3, height * 0.2, width * 0.7, height * 0.6])]
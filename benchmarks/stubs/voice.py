@@ -0,0 +1,36 @@
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from utils.voice_engine import VoiceConverter
+
+
+
+def install_voice_stub(convert_seconds: float, features_seconds: float = 0.1,
+                       input_sample_rate: int = 16000, output_sample_rate: int = 24000) -> None:
+    """
+    Replaces the FreeVC model of VoiceConverter with sleeps, the converter's threading and caching stay real.
+    Converted audio is the source resampled to the output rate.
+    """
+    audio_config = SimpleNamespace(input_sample_rate=input_sample_rate, output_sample_rate=output_sample_rate)
+    tts = SimpleNamespace(voice_converter=SimpleNamespace(vc_model=SimpleNamespace(config=SimpleNamespace(audio=audio_config))))
+
+    def speaker_features(target) -> np.ndarray:
+        time.sleep(features_seconds)
+        return np.zeros(256, dtype=np.float32)
+
+    def convert(source, target) -> np.ndarray:
+        if isinstance(target, str):
+            converter._voice_features(target)
+        time.sleep(convert_seconds)
+        source = np.asarray(source, dtype=np.float32)
+        if not len(source):
+            return source
+        length = round(len(source) * output_sample_rate / input_sample_rate)
+        return np.interp(np.linspace(0, len(source) - 1, length), np.arange(len(source)), source).astype(np.float32)
+
+    converter = VoiceConverter()
+    converter._load = lambda: tts
+    converter._speaker_features = speaker_features
+    converter._convert = convert
@@ -1,52 +1,65 @@
-import os
-import json
-import sqlite3
+from dataclasses import dataclass, replace
 
+from bot.catalog import MessageCatalog
+from bot.file_ids import FileIdRegistry
+from bot.storage import SCHEMA, FileIdRepository, RenderJobRepository, UserRepository
 from config import db_path, messages_path, supported_languages, ADMIN_NICKNAME
+from utils.database import Database
 from utils.logging_config import setup_logging
 from utils.singleton import singleton
 
 
 
+@dataclass(frozen=True)
+class UserProfile:
+    username: str
+    language: str = 'en'
+    voice: str = 'orig'
+    is_admin: bool = False
+
+
+
 @singleton
 class BotManager:
     def __init__(self, db_path: str = db_path, messages_file: str = messages_path):
         self.default_admin = ADMIN_NICKNAME.replace("@", "")
         self._init_db(db_path)
+        self._load_profiles()
         self.supported_languages = supported_languages
-        self.messages = self._load_messages(messages_file)
+        self.messages = MessageCatalog(messages_file)
         self.logger = setup_logging('BotManager')
 
 
     def _init_db(self, db_path: str):
-        """Initialize SQLite database with the users table."""
-        os.makedirs(os.path.dirname(db_path), exist_ok=True)
-        self.conn = sqlite3.connect(db_path)
-        self.cursor = self.conn.cursor()
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                username TEXT PRIMARY KEY,
-                language TEXT NOT NULL DEFAULT 'en',
-                voice TEXT NOT NULL DEFAULT 'orig',
-                is_admin INTEGER DEFAULT 0
-            )
-        """)
-
-        self.cursor.execute("SELECT username FROM users WHERE username = ?", (self.default_admin,))
-        if self.cursor.fetchone() is None:  # Only add if not already present
-            self.cursor.execute("INSERT INTO users (username, language, voice, is_admin) VALUES (?, ?, ?, ?)", (self.default_admin, 'en', 'orig', 1))
-
-        self.conn.commit()
+        """Open SQLite database with the users, file_ids and render jobs tables, add the default admin if missing."""
+        self.db = Database(db_path, schema=SCHEMA)
+        self.users = UserRepository(self.db)
+        self.users.add_if_missing(self.default_admin, is_admin=1).result()
+        self.file_ids = FileIdRegistry(FileIdRepository(self.db))
+        self.render_jobs = RenderJobRepository(self.db)
 
-    
-    def _load_messages(self, messages_file: str) -> dict[str, dict[str, str]]:
-        """Load messages from external JSON file."""
-        if not os.path.exists(messages_file):
-            raise FileNotFoundError(f"Messages file '{messages_file}' not found.")
-        with open(messages_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
 
+    def _load_profiles(self):
+        """Load all allowed users into memory, reads are served from there and writes go through to the database."""
+        self.profiles = {
+            username: UserProfile(username, language, voice, is_admin == 1)
+            for username, language, voice, is_admin in self.users.load_all()
+        }
+
+
+    def get_user_profile(self, username: str) -> UserProfile:
+        """
+        Get everything handlers need to know about a user in one lookup.
+        Args:
+            username: Telegram username.
+        Returns:
+            UserProfile: Profile of an allowed user, None if the user is not in the allowlist.
+        """
+        if not username:
+            return None
+        return self.profiles.get(username.replace("@", ""))
 
+    
     def set_user_language(self, username: str, lang: str) -> bool:
         """
         Set user's language preference.
@@ -59,10 +72,9 @@ class BotManager:
         if lang not in self.supported_languages:
             return False
         
-        self.cursor.execute("""
-            UPDATE users SET language = ? WHERE username = ?
-        """, (lang, username))
-        self.conn.commit()
+        self.users.set_language(username, lang)
+        if username in self.profiles:
+            self.profiles[username] = replace(self.profiles[username], language=lang)
         return True
 
 
@@ -74,11 +86,8 @@ class BotManager:
         Returns:
             str: Language key ('en', 'ru', 'de').
         """
-        self.cursor.execute("""
-            SELECT language FROM users WHERE username = ?
-        """, (username,))
-        result = self.cursor.fetchone()
-        return result[0] if result else 'en'
+        profile = self.get_user_profile(username)
+        return profile.language if profile else 'en'
     
 
     def set_user_voice(self, username: str, voice: str) -> bool:
@@ -90,10 +99,9 @@ class BotManager:
         Returns:
             bool: True if successful, False if language is unsupported.
         """
-        self.cursor.execute("""
-            UPDATE users SET voice = ? WHERE username = ?
-        """, (voice, username))
-        self.conn.commit()
+        self.users.set_voice(username, voice)
+        if username in self.profiles:
+            self.profiles[username] = replace(self.profiles[username], voice=voice)
         return True
 
 
@@ -105,25 +113,21 @@ class BotManager:
         Returns:
             str: Voice key ('orig', 'male', 'female', 'custom').
         """
-        self.cursor.execute("""
-            SELECT voice FROM users WHERE username = ?
-        """, (username,))
-        result = self.cursor.fetchone()
-        return result[0] if result else 'orig'
+        profile = self.get_user_profile(username)
+        return profile.voice if profile else 'orig'
 
 
-    def get_message(self, message_key: str, lang: str = "en") -> str:
+    def get_message(self, message_key: str, lang: str = "en", **kwargs) -> str:
         """
         Get a message in specified language.
         Args:
             message_key: Key for the message ('welcome').
             lang: Language key.
+            kwargs: Values of the message placeholders.
         Returns:
             str: Message in requested language.
         """
-        if message_key not in self.messages:
-            return f"Message '{message_key}' not found."
-        return self.messages[message_key][lang]
+        return self.messages.get(message_key, lang, **kwargs)
 
 
     def get_supported_languages(self) -> set:
@@ -133,36 +137,35 @@ class BotManager:
 
     def is_admin(self, username: str) -> bool:
         """Check if a user is an admin."""
-        username = username.replace("@", "")
-        self.cursor.execute("SELECT is_admin FROM users WHERE username = ?", (username,))
-        result = self.cursor.fetchone()
-        return result is not None and result[0] == 1
+        profile = self.get_user_profile(username)
+        return profile is not None and profile.is_admin
     
 
     def is_allowed_user(self, username: str) -> bool:
         """Check if a user is allowed to use the bot."""
-        username = username.replace("@", "")
-        self.cursor.execute("SELECT username FROM users WHERE username = ?", (username,))
-        result = self.cursor.fetchone() is not None
-        return result
+        return self.get_user_profile(username) is not None
     
 
     def add_user(self, username: str, is_admin: int = 0) -> None:
         """Add a user to the allowed list (or update, admin only)."""
         username = username.replace("@", "")
-        self.cursor.execute("INSERT OR REPLACE INTO users (username, language, voice, is_admin) VALUES (?, ?, ?, ?)", (username, 'en', 'orig', is_admin))
-        self.conn.commit()
+        self.users.upsert(username, 'en', 'orig', is_admin)
+        self.profiles.pop(username, None)
+        self.profiles[username] = UserProfile(username, 'en', 'orig', is_admin == 1)
 
 
     def remove_user(self, username: str) -> None:
         """Remove a user from the allowed list (admin only)."""
         username = username.replace("@", "")
-        self.cursor.execute("DELETE FROM users WHERE username = ?", (username,))
-        self.conn.commit()
+        self.users.delete(username)
+        self.profiles.pop(username, None)
+
+
+    def close(self) -> None:
+        """Write pending changes to the database and close it."""
+        self.db.close()
 
 
     def list_users(self) -> list:
         """Return a list of all users and their roles (admin only)."""
-        self.cursor.execute("SELECT username, language, voice, is_admin FROM users")
-        users = self.cursor.fetchall()
-        return users
+        return [(p.username, p.language, p.voice, int(p.is_admin)) for p in self.profiles.values()]
@@ -0,0 +1,120 @@
+import os
+import json
+import time
+import threading
+from string import Formatter
+from types import MappingProxyType
+
+from config import messages_path, supported_languages, catalog_reload_interval
+from utils.logging_config import setup_logging
+from utils.singleton import singleton
+
+
+
+class MessageTemplate:
+    """Message text parsed once into literal parts and placeholders."""
+    __slots__ = ("text", "parts")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.parts = tuple(
+            (literal, field, spec, conversion)
+            for literal, field, spec, conversion in Formatter().parse(text)
+        ) if "{" in text or "}" in text else ()
+
+
+    @property
+    def fields(self) -> set:
+        return {field for _, field, _, _ in self.parts if field}
+
+
+    def render(self, **kwargs) -> str:
+        if not self.parts:
+            return self.text
+
+        chunks = []
+        for literal, field, spec, conversion in self.parts:
+            chunks.append(literal)
+            if field is None:
+                continue
+            value = kwargs[field]
+            if conversion == "r":
+                value = repr(value)
+            elif conversion == "s":
+                value = str(value)
+            chunks.append(format(value, spec or ""))
+        return "".join(chunks)
+
+
+
+@singleton
+class MessageCatalog:
+    """
+    Bot messages compiled from the JSON file into immutable per-language tables.
+
+    Every message must be translated to every supported language and use the same placeholders
+    in all of them, otherwise loading fails. The file is re-read when it changes on disk,
+    checked at most once per `reload_interval` seconds; a broken file keeps the previous catalog.
+    """
+    def __init__(self, messages_file: str = messages_path, languages: set = supported_languages, reload_interval: float = catalog_reload_interval):
+        self.messages_file = messages_file
+        self.languages = languages
+        self.reload_interval = reload_interval
+        self.logger = setup_logging('MessageCatalog')
+        self.version = 0
+        self._lock = threading.Lock()
+        self._checked_at = time.monotonic()
+        self._mtime, self._tables = self._compile()
+
+
+    def _compile(self) -> tuple:
+        if not os.path.exists(self.messages_file):
+            raise FileNotFoundError(f"Messages file '{self.messages_file}' not found.")
+
+        mtime = os.stat(self.messages_file).st_mtime
+        with open(self.messages_file, 'r', encoding='utf-8') as f:
+            messages = json.load(f)
+
+        problems = []
+        tables = {lang: {} for lang in self.languages}
+        for key, translations in messages.items():
+            missing = self.languages - translations.keys()
+            if missing:
+                problems.append(f"'{key}' has no {', '.join(sorted(missing))} translation")
+                continue
+            templates = {lang: MessageTemplate(translations[lang]) for lang in self.languages}
+            if len({frozenset(template.fields) for template in templates.values()}) > 1:
+                problems.append(f"'{key}' uses different placeholders in different languages")
+            for lang, template in templates.items():
+                tables[lang][key] = template
+        if problems:
+            raise ValueError(f"Invalid messages file '{self.messages_file}': " + "; ".join(problems))
+
+        self.version += 1
+        return mtime, MappingProxyType({lang: MappingProxyType(table) for lang, table in tables.items()})
+
+
+    def _maybe_reload(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return
+        with self._lock:
+            self._checked_at = now
+            try:
+                if os.stat(self.messages_file).st_mtime == self._mtime:
+                    return
+                self._mtime, self._tables = self._compile()
+                self.logger.info(f"Reloaded messages from {self.messages_file}.")
+            except Exception as e:
+                self.logger.error(f"Keeping previous messages, failed to reload: {e}")
+
+
+    def get(self, message_key: str, lang: str = "en", **kwargs) -> str:
+        """
+        Get a message in specified language, with placeholders filled from `kwargs` if any are given.
+        """
+        self._maybe_reload()
+        template = self._tables.get(lang, self._tables["en"]).get(message_key)
+        if template is None:
+            return f"Message '{message_key}' not found."
+        return template.render(**kwargs) if kwargs else template.text
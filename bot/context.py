@@ -0,0 +1,21 @@
+from telegram.ext import CallbackContext, ExtBot
+
+from bot.bot_manager import UserProfile
+
+
+
+class BotContext(CallbackContext[ExtBot, dict, dict, dict]):
+    """
+    Callback context with the profile of the user who sent the update.
+
+    The profile is resolved once per update by `resolve_user`, which runs before all other handlers
+    and stops updates from users outside the allowlist, so handlers can rely on it being set.
+    """
+    def __init__(self, application, chat_id: int = None, user_id: int = None):
+        super().__init__(application=application, chat_id=chat_id, user_id=user_id)
+        self.profile: UserProfile = None
+
+
+    @property
+    def lang(self) -> str:
+        return self.profile.language if self.profile else 'en'
@@ -0,0 +1,78 @@
+import asyncio
+
+from telegram import Message
+from telegram.error import BadRequest
+
+from bot.storage import FileIdRepository
+from utils.file_cache import file_sha256
+from utils.logging_config import setup_logging
+from utils.metrics import CACHE_REQUESTS, timed
+
+
+
+class FileIdRegistry:
+    """
+    Telegram file_ids of everything the bot has uploaded, keyed by content hash of the file.
+
+    A file sent again goes out by file_id, so Telegram serves it without the bot uploading it.
+    Lookups are served from memory and new file_ids are written through to the database.
+    """
+    def __init__(self, repository: FileIdRepository):
+        self.repository = repository
+        self.logger = setup_logging('FileIdRegistry')
+        self.file_ids = {file_hash: (kind, file_id) for file_hash, kind, file_id in repository.load_all()}
+
+
+    def get(self, file_hash: str, kind: str) -> str:
+        """
+        Returns:
+            file_id of a file uploaded as `kind` ('video_note', 'photo', ...), or None if it wasn't uploaded yet
+        """
+        stored = self.file_ids.get(file_hash)
+        return stored[1] if stored and stored[0] == kind else None
+
+
+    def remember(self, file_hash: str, kind: str, file_id: str) -> None:
+        self.repository.save(file_hash, kind, file_id)
+        self.file_ids[file_hash] = (kind, file_id)
+
+
+    def forget(self, file_hash: str) -> None:
+        self.repository.delete(file_hash)
+        self.file_ids.pop(file_hash, None)
+
+
+    async def send(self, message: Message, kind: str, file_path: str, file_hash: str = None, **kwargs) -> Message:
+        """
+        Replies to a message with a file, by file_id if the same content was uploaded before.
+
+        Args:
+            message: Message to reply to
+            kind: Type of media, `message.reply_<kind>` is used to send it
+            file_path: File to upload if there is no file_id, may be None if the file_id is known
+            file_hash: SHA-256 of the file, computed if not given
+            kwargs: Passed on to `reply_<kind>`
+        Returns:
+            The sent message
+        """
+        file_hash = file_hash or await asyncio.to_thread(file_sha256, file_path)
+        reply = getattr(message, f"reply_{kind}")
+
+        file_id = self.get(file_hash, kind)
+        CACHE_REQUESTS.inc(cache="file_id", result="hit" if file_id else "miss")
+        if file_id:
+            try:
+                return await reply(file_id, **kwargs)
+            except BadRequest as e:
+                self.logger.warning(f"file_id of {file_hash[:12]} was rejected, uploading the file again: {e}")
+                self.forget(file_hash)
+        if not file_path:
+            raise FileNotFoundError(f"No file_id or file to send for {file_hash[:12]}.")
+
+        with timed("upload", kind=kind), open(file_path, 'rb') as f:
+            sent = await reply(f, **kwargs)
+        media = getattr(sent, kind)
+        if isinstance(media, tuple):
+            media = media[-1]  # photos come in several sizes, the largest is last
+        self.remember(file_hash, kind, media.file_id)
+        return sent
@@ -1,33 +1,44 @@
 import os
+import json
+import time
+import uuid
+import asyncio
+from dataclasses import dataclass, field
 
-from telegram import Update
-from telegram.ext import CallbackContext, ConversationHandler
+from telegram import Message, Update
+from telegram.ext import ConversationHandler
 
 from bot.bot_manager import BotManager
-from config import uploads_path, max_duration, ADD_DRIVING_VIDEO, ADD_VOICE, cleanup_animations, custom_voice_filename
-from utils.media_utils import get_center_crop, generate_video, convert_to_wav, replace_voice_with_ffmpeg
-
-
-
-async def add_ref_image_handler(update: Update, context: CallbackContext) -> int:
+from bot.context import BotContext
+from config import (
+    uploads_path, ADD_DRIVING_VIDEO, ADD_VOICE, cleanup_animations, cleanup_user_data, custom_voice_filename, media_group_delay,
+    max_duration, max_download_size, trim_long_videos, max_resolution, max_fps, allowed_video_codecs,
+    normalize_driving_videos, driving_video_size, driving_video_fps, job_broker, batch_timeout,
+)
+from utils.file_cache import ResultCache, file_sha256
+from utils.download import stream_download
+from utils.metrics import timed
+from utils.media_utils import detect_face, save_center_crop, probe_video, trim_video, prepare_driving_video, animate, convert_to_wav
+from utils.remote_workers import RemoteWorkers
+from utils.render_scheduler import RenderScheduler
+from utils.voice_engine import VoiceConverter
+
+
+
+async def add_ref_image_handler(update: Update, context: BotContext) -> int:
     """
     Handles the user's uploaded reference image.
 
     - Accepts a photo from the user.
-    - Saves and center-crops the image.
-    - Stores the image path in user_data for future use.
+    - Downloads the image into memory, crops it around the face and saves the crop.
+    - Stores the image path and hash in user_data for future use.
 
     Returns:
         int: The next conversation state (ADD_DRIVING_VIDEO or END).
     """
     username = update.effective_user.username
     manager = BotManager()
-    lang = manager.get_user_language(username)
-
-    if not manager.is_allowed_user(username):
-        manager.logger.warning(f'{username} tried issuing a command but was not allowed.')
-        await update.message.reply_text(manager.get_message("access_denied"))
-        return ConversationHandler.END
+    lang = context.lang
 
     if update.message.photo:
         file_content = await update.message.photo[-1].get_file()
@@ -39,152 +50,628 @@ async def add_ref_image_handler(update: Update, context: CallbackContext) -> int
 
     file_path = os.path.join(uploads_path, username, file_name)
     os.makedirs(os.path.dirname(file_path), exist_ok=True)
-    
+    await end_batch(update, context)  # a new photo starts a new batch
+
     try:
-        await file_content.download_to_drive(file_path)
-        get_center_crop(file_path).save(file_path)
+        with timed("image_download", username=username):
+            image = bytes(await file_content.download_as_bytearray())
+        face = await detect_face(image)
+        image_hash = await save_center_crop(image, file_path, face)
         manager.logger.info(f'File from {username} temporarily loaded to {file_path}.')
         context.user_data["ref_img_file"] = file_path
+        context.user_data["ref_img_hash"] = image_hash
+        context.user_data["batch_updated"] = time.time()
         message = manager.get_message("got_img", lang)
         await update.message.reply_text(message)
         return ADD_DRIVING_VIDEO
 
     except Exception as e:
-        message = manager.get_message('file_failed', lang).format(e=e)
+        message = manager.get_message('file_failed', lang, e=e)
         await update.message.reply_text(message)
         manager.logger.error(f"File processing failed: {e}")
         return ConversationHandler.END
     
 
-async def add_driving_video_handler(update: Update, context: CallbackContext) -> int:
+@dataclass
+class DrivingClip:
+    """
+    Driving video ready to be rendered, the message it came with is answered with the animation.
+    Its render job is stored in the database under `job_id`, `artifacts` are files of an interrupted earlier run.
+    `broker_job` is the job broker's job rendering it, if one was submitted.
+    """
+    message: Message
+    file_path: str
+    driving_key: str
+    result_key: str
+    frames: int
+    voice: str = None
+    job_id: str = None
+    artifacts: dict = field(default_factory=dict)
+    broker_job: str = None
+
+
+@dataclass
+class MediaGroup:
+    """Driving videos of an album, collected until no more arrive for `media_group_delay` seconds."""
+    update: Update
+    context: BotContext
+    ref_img_file: str
+    clips: list = field(default_factory=list)
+    submit: asyncio.Task = None
+
+
+# Albums being collected, by media_group_id. Kept out of user_data, which is persisted.
+_media_groups = {}
+# Tasks nobody awaits, referenced until they finish so they aren't garbage collected
+_background_tasks = set()
+
+
+def _in_background(coroutine) -> asyncio.Task:
+    task = asyncio.create_task(coroutine)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+async def add_driving_video_handler(update: Update, context: BotContext) -> int:
     """
     Handles the user's uploaded video or video note to drive animation.
 
-    - Downloads the video.
-    - Runs video generation using a previously uploaded reference image.
-    - Sends the resulting animation back to the user.
+    Any number of videos can be sent for one reference image, the conversation stays in
+    ADD_DRIVING_VIDEO until /done. Videos sent together as a media group are rendered as one job.
+
+    - Checks duration and size, then streams the video to disk while hashing it.
+    - Probes the video and rejects or trims it against the configured limits.
+    - Downscales the video and caps its frame rate for rendering.
+    - Queues video generation using a previously uploaded reference image.
+    - Sends each resulting animation back to the user as soon as it's rendered.
 
     Returns:
-        int: ConversationHandler.END when processing is complete or fails.
+        int: ADD_DRIVING_VIDEO to accept more videos, or ConversationHandler.END if there is no reference image.
     """
-    username = update.effective_user.username
     manager = BotManager()
-    lang = manager.get_user_language(username)
-
-    if update.message.video:
-        file_content = await update.message.video.get_file()
-        file_name = os.path.basename(file_content.file_path)
-
-    elif update.message.video_note:
-        if update.message.video_note.duration > max_duration:
-            message = manager.get_message('long_video', lang).format(max_duration=max_duration)
-            await update.message.reply_text(message)
-            return ADD_DRIVING_VIDEO
-        file_content = await update.message.video_note.get_file()
-        file_name = os.path.basename(file_content.file_path)
+    lang = context.lang
 
-    else:
+    video = update.message.video or update.message.video_note
+    if not video:
         print(f'{update.message=}')
         message = manager.get_message("unsupported_file_type", lang)
         await update.message.reply_text(message)
         return ADD_DRIVING_VIDEO
 
+    # Checked from the message metadata, before anything is downloaded
+    if not trim_long_videos and video.duration and video.duration > max_duration:
+        message = manager.get_message('long_video', lang, max_duration=max_duration)
+        await update.message.reply_text(message)
+        return ADD_DRIVING_VIDEO
+    if video.file_size and video.file_size > max_download_size:
+        message = manager.get_message('big_video', lang, max_size=max_download_size // 1024 ** 2)
+        await update.message.reply_text(message)
+        return ADD_DRIVING_VIDEO
+
+    ref_img_file = context.user_data.get('ref_img_file', None)
+    if not ref_img_file:
+        message = manager.get_message("no_img", lang)
+        await update.message.reply_text(message)
+        return ConversationHandler.END
+
+    context.user_data['batch_updated'] = time.time()
+
+    # Handlers of one user run one at a time, so videos of an album are prepared one after another.
+    # The album is submitted once no video of it has arrived or been prepared for media_group_delay.
+    group_id = update.message.media_group_id
+    if group_id in _media_groups:
+        _media_groups[group_id].submit.cancel()
+
+    try:
+        clip = await prepare_clip(update, context, video, ref_img_file)
+    except Exception as e:
+        manager.logger.error(f"File processing failed: {e}")
+        message = manager.get_message('generation_failed', lang)
+        await update.message.reply_text(message)
+        clip = None
+
+    if not group_id:
+        if clip:
+            await submit_clips(update, context, [clip], ref_img_file)
+        return ADD_DRIVING_VIDEO
+
+    group = _media_groups.setdefault(group_id, MediaGroup(update, context, ref_img_file))
+    if clip:
+        group.clips.append(clip)
+    group.submit = _in_background(_submit_media_group(group_id))
+    return ADD_DRIVING_VIDEO
+
+
+async def _submit_media_group(group_id: str) -> None:
+    await asyncio.sleep(media_group_delay)
+    group = _media_groups.pop(group_id)
+    if group.clips:
+        await submit_clips(group.update, group.context, group.clips, group.ref_img_file)
+
+
+async def submit_media_groups(user_id: int) -> None:
+    """Submits albums of a user that are still being collected right away."""
+    for group_id, group in list(_media_groups.items()):
+        if group.update.effective_user.id != user_id:
+            continue
+        del _media_groups[group_id]
+        group.submit.cancel()
+        if group.clips:
+            await submit_clips(group.update, group.context, group.clips, group.ref_img_file)
+
+
+async def prepare_clip(update: Update, context: BotContext, video, ref_img_file: str) -> DrivingClip:
+    """
+    Downloads and prepares a driving video for rendering, answers right away if the animation is cached.
+
+    Returns:
+        DrivingClip to render, or None if the video was rejected or answered from cache and the user was notified.
+    """
+    username = update.effective_user.username
+    manager = BotManager()
+    lang = context.lang
+
+    file_content = await video.get_file()
+    file_name = os.path.basename(file_content.file_path)
+
     file_path = os.path.join(uploads_path, username, file_name)
     os.makedirs(os.path.dirname(file_path), exist_ok=True)
-    
+
+    # Other hashes of the cache key are computed while the video downloads
+    target_voice = get_target_voice(username, context.profile.voice)
+    image_hash = context.user_data.get('ref_img_hash')
+    hashes = asyncio.gather(
+        asyncio.sleep(0, image_hash) if image_hash else asyncio.to_thread(file_sha256, ref_img_file),
+        _voice_hash(target_voice),
+    )
     try:
-        await file_content.download_to_drive(file_path)
-        manager.logger.info(f'File from {username} temporarily loaded to {file_path}.')
-        message = manager.get_message("got_video", lang)
+        with timed("video_download", username=username) as stage:
+            downloaded = await stream_download(file_content, file_path)
+    except BaseException:
+        hashes.cancel()
+        hashes.add_done_callback(lambda done: done.cancelled() or done.exception())  # nobody else reads its error
+        raise
+    image_hash, voice_hash = await hashes
+    if voice_hash is None:
+        manager.logger.warning(f"Voice file {target_voice} of {username} is missing, rendering with the original voice.")
+        target_voice, voice_hash = None, "orig"
+    if downloaded.get('error'):
+        stage.fail()
+        message = manager.get_message('big_video', lang, max_size=max_download_size // 1024 ** 2)
         await update.message.reply_text(message)
+        return None
+    manager.logger.info(f'File from {username} temporarily loaded to {file_path}.')
+    message = manager.get_message("got_video", lang)
+    await update.message.reply_text(message)
 
-        ref_img_file = context.user_data.get('ref_img_file', None)
-        if not ref_img_file:
-            message = manager.get_message("no_img", lang)
+    checked = await check_driving_video(file_path)
+    if checked.get('error'):
+        manager.logger.info(f"Rejected a video from {username}: {checked['error']}.")
+        if cleanup_user_data:
+            os.remove(file_path)
+        message = manager.get_message(checked['error'], lang, **checked['params'])
+        await update.message.reply_text(message)
+        return None
+    probe = checked['probe']
+    if checked['trimmed']:
+        message = manager.get_message('video_trimmed', lang, max_duration=max_duration)
+        await update.message.reply_text(message)
+        driving_hash = await asyncio.to_thread(file_sha256, file_path)
+    else:
+        driving_hash = downloaded['sha256']
+
+    result_key = ResultCache().key(image_hash, driving_hash, voice_hash)
+    cached = ResultCache().lookup(result_key)
+    if cached and (cached.get('path') or manager.file_ids.get(cached['file_hash'], 'video_note')):
+        manager.logger.info(f'Answering {username} with a cached animation.')
+        try:
+            await manager.file_ids.send(update.message, 'video_note', cached.get('path'), cached['file_hash'])
+        except Exception as e:
+            # E.g. Telegram rejected the file_id of an animation whose file wasn't kept, it's rendered again
+            manager.logger.warning(f"Failed to send a cached animation, rendering it again: {e}")
+            await asyncio.to_thread(ResultCache().remove, result_key)
+        else:
+            if cleanup_user_data:
+                os.remove(file_path)
+            message = manager.get_message("send_video", lang)
             await update.message.reply_text(message)
-            return ConversationHandler.END
-
-        result = generate_video(ref_img_file, file_path)
-        if result.get('error'):
-            manager.logger.error(f"Generation failed: {result.get('error')}")
-            message = manager.get_message("generation_failed", lang)
+            return None
+
+    # Render from a downscaled copy at the output frame rate, full size frames are wasted on a video note
+    driving_file, driving_key, fps = file_path, driving_hash, probe['fps']
+    if normalize_driving_videos:
+        target_fps = driving_video_fps if probe['fps'] > driving_video_fps else None
+        normalized = await prepare_driving_video(file_path, driving_hash, driving_video_size, target_fps)
+        if normalized.get('error') and max(probe['width'], probe['height']) > max_resolution:
+            manager.logger.error(f"Rejected a video from {username}, too large to render without normalization: {normalized['error']}")
+            if cleanup_user_data:
+                os.remove(file_path)
+            message = manager.get_message('video_resolution', lang, max_resolution=max_resolution)
             await update.message.reply_text(message)
-            return ConversationHandler.END
+            return None
+        elif normalized.get('error'):
+            manager.logger.error(f"Rendering original video of {username}, normalization failed: {normalized['error']}")
         else:
-            animation_path = result["path"]
+            if cleanup_user_data:
+                os.remove(file_path)
+            driving_file, driving_key, fps = normalized['path'], normalized['key'], target_fps or fps
+
+    # Voice can only be converted if the driving video has speech to convert
+    return DrivingClip(
+        message=update.message,
+        file_path=driving_file,
+        driving_key=driving_key,
+        result_key=result_key,
+        frames=round(probe['duration'] * fps),
+        voice=target_voice if probe['has_audio'] else None,
+    )
+
+
+async def _voice_hash(target_voice: str) -> str:
+    """Hash of the target voice for cache keys, "orig" to keep the driving video's voice, None if its file is missing."""
+    if not target_voice:
+        return "orig"
+    try:
+        return await asyncio.to_thread(file_sha256, target_voice)
+    except FileNotFoundError:
+        return None
 
-        # Voice settings
-        cur_voice = manager.get_user_voice(username)
-        if cur_voice != "orig":
-            target_voice = os.path.join("./resources", cur_voice + ".wav") if "male" in cur_voice else os.path.join(uploads_path, username, custom_voice_filename)
-            message = manager.get_message("wait_audio_convertion", lang)
-            await update.message.reply_text(message)
-            new_video_path = replace_voice_with_ffmpeg(
-                video_path=animation_path, 
-                target_voice=target_voice, 
-                username=username
-            )
-            if not new_video_path:
-                message = manager.get_message("failed_audio_convertion", lang)
-                await update.message.reply_text(message)
-            else:
-                animation_path = new_video_path
 
+async def submit_clips(update: Update, context: BotContext, clips: list, ref_img_file: str) -> None:
+    """Queues driving videos as one render job, stores their jobs and tells the user when to expect the animations."""
+    username = update.effective_user.username
+    manager = BotManager()
+    lang = context.lang
+    user_data = context.user_data
+
+    scheduled = RenderScheduler().submit(
+        username, lambda: render_clips(ref_img_file, clips, lang, user_data), frames=sum(clip.frames for clip in clips)
+    )
+    if scheduled.get('error'):
+        for clip in clips:
+            _remove_driving_video(clip)
+        message = manager.get_message(scheduled['error'], lang)
+        await update.message.reply_text(message)
+        return
+
+    # Stored before the job can start, the database runs requests in order
+    batch = uuid.uuid4().hex
+    for clip in clips:
+        clip.job_id = uuid.uuid4().hex
+        manager.render_jobs.create({
+            'id': clip.job_id,
+            'batch': batch,
+            'username': username,
+            'user_id': update.effective_user.id,
+            'lang': lang,
+            'message': clip.message.to_json(),
+            'ref_img_file': ref_img_file,
+            'driving_file': clip.file_path,
+            'driving_key': clip.driving_key,
+            'result_key': clip.result_key,
+            'frames': clip.frames,
+            'voice': clip.voice,
+        })
+
+    if scheduled['position']:
+        message = manager.get_message("queue_position", lang, position=scheduled['position'])
+        await update.message.reply_text(message)
+    minutes, seconds = divmod(round(scheduled['estimate']), 60)
+    message = manager.get_message("render_estimate", lang, minutes=minutes, seconds=seconds)
+    await update.message.reply_text(message)
+
+
+async def render_clips(ref_img_file: str, clips: list, lang: str, user_data: dict) -> list:
+    """
+    Renders driving videos of a job one after another in the same render slot, so the worker keeps
+    the reference image prepared. Each animation is sent while the next one renders.
+    The reference image is deleted afterwards if the user is done with it and no other job needs it.
+
+    Returns:
+        list: Delivery tasks of the rendered animations.
+    """
+    manager = BotManager()
+    deliveries = []
+    for clip in clips:
+        try:
+            result = await render_animation(clip, ref_img_file, lang)
+        except Exception as e:
+            manager.logger.error(f"Generation failed: {e}")
+            message = manager.get_message("generation_failed", lang)
+            await clip.message.reply_text(message)
+            continue
+        if result:
+            deliveries.append(_in_background(deliver_animation(clip, result, lang)))
+    await _remove_if_unused(ref_img_file, user_data)
+    return deliveries
 
-        with open(animation_path, 'rb') as video:
-            await update.message.reply_video_note(video)
+
+async def deliver_animation(clip: DrivingClip, result: dict, lang: str) -> None:
+    """Sends a rendered animation in reply to its driving video and remembers it in ResultCache."""
+    manager = BotManager()
+    animation_path = result['path']
+    try:
+        animation_hash = await asyncio.to_thread(file_sha256, animation_path)
+        await manager.file_ids.send(clip.message, 'video_note', animation_path, animation_hash)
+        manager.render_jobs.update(clip.job_id, stage='delivered')
         message = manager.get_message("send_video", lang)
-        await update.message.reply_text(message)
+        await clip.message.reply_text(message)
+
+        if not result.get('partial'):
+            await asyncio.to_thread(ResultCache().store, clip.result_key, animation_path, animation_hash)
 
         if cleanup_animations:
             os.remove(animation_path)
-            os.remove(f"{os.path.splitext(animation_path)[0]}_concat.mp4")
-
-        return ConversationHandler.END
+            concat_path = f"{os.path.splitext(animation_path)[0]}_concat.mp4"
+            if os.path.exists(concat_path):
+                os.remove(concat_path)
 
     except Exception as e:
-        manager.logger.error(f"File processing failed: {e}")
+        manager.logger.error(f"Failed to send animation: {e}")
+        manager.render_jobs.update(clip.job_id, stage='failed')
         message = manager.get_message('generation_failed', lang)
-        await update.message.reply_text(message)
-        return ConversationHandler.END
+        await clip.message.reply_text(message)
+
+
+async def end_batch(update: Update, context: BotContext) -> None:
+    """Submits albums still being collected and releases the reference image of the batch."""
+    await submit_media_groups(update.effective_user.id)
+    release_ref_image(context.user_data)
+
+
+def release_ref_image(user_data: dict) -> None:
+    """Forgets the user's reference image, its file is deleted once no render job needs it."""
+    ref_img_file = user_data.pop('ref_img_file', None)
+    user_data.pop('ref_img_hash', None)
+    user_data.pop('batch_updated', None)
+    if ref_img_file:
+        _in_background(_remove_if_unused(ref_img_file, user_data))
 
 
-async def cancel_handler(update: Update, context: CallbackContext) -> int:
+async def expire_batches(application) -> None:
     """
-    Cancels the current operation and ends the conversation.
+    Conversation timeouts don't survive a restart. Releases reference images of batches that timed out
+    while the bot was down, and checks the others once they would time out.
+    """
+    now = time.time()
+    for user_data in application.user_data.values():
+        if user_data.get('ref_img_file'):
+            updated = user_data.get('batch_updated', 0)
+            application.job_queue.run_once(_expire_batch, max(updated + batch_timeout - now, 0), data=(user_data, updated))
+
+
+async def _expire_batch(context: BotContext) -> None:
+    user_data, updated = context.job.data
+    if user_data.get('ref_img_file') and user_data.get('batch_updated', 0) == updated:
+        release_ref_image(user_data)
+
+
+async def _remove_if_unused(file_path: str, user_data: dict) -> None:
+    # The same photo may have been sent again meanwhile
+    if not cleanup_user_data or user_data.get('ref_img_file') == file_path:
+        return
+    if await asyncio.wrap_future(BotManager().render_jobs.count_needing_image(file_path)):
+        return
+    if os.path.exists(file_path):
+        os.remove(file_path)
+
+
+def _clip_from_job(job: dict, bot) -> DrivingClip:
+    return DrivingClip(
+        message=Message.de_json(json.loads(job['message']), bot),
+        file_path=job['driving_file'],
+        driving_key=job['driving_key'],
+        result_key=job['result_key'],
+        frames=job['frames'],
+        voice=job['voice'],
+        job_id=job['id'],
+        artifacts={name: job[name] for name in ('animation_path', 'voice_path') if job[name]},
+        broker_job=job['broker_job'],
+    )
+
+
+async def resume_render_jobs(application) -> None:
+    """
+    Picks up render jobs interrupted by a restart, each from its last completed stage:
+    rendered animations are only sent, animations waiting for their voice aren't rendered again, and so on.
+    Jobs are queued again with their batch, without counting against the queue limits. Jobs a render worker
+    of the job broker still has are waited for instead of being submitted again.
+    """
+    manager = BotManager()
+    await asyncio.wrap_future(manager.render_jobs.delete_finished())
+    batches = {}
+    for job in await asyncio.wrap_future(manager.render_jobs.load_unfinished()):
+        batches.setdefault(job['batch'], []).append(job)
+    if batches:
+        manager.logger.info(f"Resuming {sum(map(len, batches.values()))} render job(s) interrupted by a restart.")
+
+    for jobs in batches.values():
+        first = jobs[0]
+        lang = first['lang']
+        user_data = application.user_data.get(first['user_id'], {})
+        clips = [_clip_from_job(job, application.bot) for job in jobs]
+        try:
+            message = manager.get_message('render_resumed', lang)
+            await clips[0].message.reply_text(message)
+        except Exception as e:
+            manager.logger.warning(f"Failed to notify {first['username']} about a resumed job: {e}")
+
+        pending = []
+        for job, clip in zip(jobs, clips):
+            if job['stage'] == 'rendered':
+                result = {'path': job['animation_path'], 'partial': bool(job['partial'])}
+                _in_background(deliver_animation(clip, result, lang))
+                continue
+            # Results arriving before the job's turn in the queue must not be dropped
+            if clip.broker_job and job_broker and not await RemoteWorkers().resume(clip.broker_job):
+                clip.broker_job = None
+            pending.append(clip)
+        if pending:
+            RenderScheduler().submit(
+                first['username'],
+                lambda clips=pending, ref_img_file=first['ref_img_file'], lang=lang, user_data=user_data:
+                    render_clips(ref_img_file, clips, lang, user_data),
+                frames=sum(clip.frames for clip in pending),
+                check_limits=False,
+            )
+
+
+async def check_driving_video(file_path: str) -> dict:
+    """
+    Probes a downloaded driving video and checks it against the configured limits.
+    Videos longer than `max_duration` are trimmed in place if `trim_long_videos` is set.
+    `max_resolution` only applies when videos are rendered as is, normalization downscales larger ones.
 
     Returns:
-        int: ConversationHandler.END to exit the conversation.
+        dict: {'probe': video properties, 'trimmed': bool} if the video can be rendered,
+            or {'error': message key, 'params': message placeholders} otherwise.
     """
-    username = update.effective_user.username
+    probe = await probe_video(file_path)
+    if probe.get('error'):
+        return {'error': 'video_unreadable', 'params': {}}
+    if probe['codec'] not in allowed_video_codecs:
+        return {'error': 'video_codec', 'params': {'codec': probe['codec']}}
+    if not normalize_driving_videos and max(probe['width'], probe['height']) > max_resolution:
+        return {'error': 'video_resolution', 'params': {'max_resolution': max_resolution}}
+    if probe['fps'] > max_fps:
+        return {'error': 'video_fps', 'params': {'max_fps': max_fps}}
+
+    if probe['duration'] <= max_duration:
+        return {'probe': probe, 'trimmed': False}
+    if not trim_long_videos:
+        return {'error': 'long_video', 'params': {'max_duration': max_duration}}
+    trimmed = await trim_video(file_path, max_duration)
+    if trimmed.get('error'):
+        return {'error': 'video_unreadable', 'params': {}}
+    probe['duration'] = max_duration
+    return {'probe': probe, 'trimmed': True}
+
+
+def get_target_voice(username: str, cur_voice: str) -> str:
+    """Returns path to the voice a user's animations should speak with, or None to keep the original voice."""
+    if cur_voice == "orig":
+        return None
+    return os.path.join("./resources", cur_voice + ".wav") if "male" in cur_voice else os.path.join(uploads_path, username, custom_voice_filename)
+
+
+async def render_animation(clip: DrivingClip, ref_img_file: str, lang: str) -> dict:
+    """
+    Renders an animation and applies user's voice settings. Runs inside a render slot of RenderScheduler,
+    on a render worker of the job broker if one is configured. Stages and files of the job are saved as it
+    goes, so it can resume after a restart. The driving video is deleted once the job is over,
+    the reference image is kept for other videos of the batch.
 
+    Returns:
+        dict: {'path': animation_path} with 'partial': True if the voice couldn't be replaced,
+            or None if generation failed and the user was notified.
+    """
     manager = BotManager()
-    lang = manager.get_user_language(username)
-    message = manager.get_message('cancel', lang)
+    jobs = manager.render_jobs
+
+    async def notify_voice_wait():
+        message = manager.get_message("wait_audio_convertion", lang)
+        await clip.message.reply_text(message)
+
+    async def save_stage(stage: str, **artifacts):
+        jobs.update(clip.job_id, stage=stage, **artifacts)
+
+    if not clip.artifacts.get('animation_path'):
+        jobs.update(clip.job_id, stage='rendering')
+    try:
+        if job_broker:
+            # Saved before it's submitted, so a restart waits for this job instead of rendering it twice
+            if not clip.broker_job:
+                clip.broker_job = uuid.uuid4().hex
+                jobs.update(clip.job_id, broker_job=clip.broker_job)
+            result = await RemoteWorkers().animate(
+                ref_img_file, clip.file_path, clip.driving_key, clip.voice, job_id=clip.broker_job
+            )
+        else:
+            result = await animate(
+                ref_img_file, clip.file_path, clip.driving_key, clip.voice,
+                on_voice_wait=notify_voice_wait, on_stage=save_stage, artifacts=clip.artifacts,
+            )
+    except Exception:
+        jobs.update(clip.job_id, stage='failed')
+        _remove_driving_video(clip)
+        raise
+    # Files are kept when the render is cancelled by a shutdown, the job resumes on the next start
+    _remove_driving_video(clip)
+
+    if result.get('error'):
+        jobs.update(clip.job_id, stage='failed')
+        manager.logger.error(f"Generation failed: {result.get('error')}")
+        message = manager.get_message("generation_failed", lang)
+        await clip.message.reply_text(message)
+        return None
+    jobs.update(clip.job_id, stage='rendered', animation_path=result['path'], partial=int(bool(result.get('partial'))))
+    if result.get('partial'):
+        message = manager.get_message("failed_audio_convertion", lang)
+        await clip.message.reply_text(message)
+    return result
+
+
+def _remove_driving_video(clip: DrivingClip) -> None:
+    if cleanup_user_data and os.path.exists(clip.file_path):
+        os.remove(clip.file_path)
+
+
+async def done_handler(update: Update, context: BotContext) -> int:
+    """
+    Ends a batch of driving videos. Videos already sent are still rendered and delivered.
+
+    Returns:
+        int: ConversationHandler.END to exit the conversation.
+    """
+    manager = BotManager()
+    await end_batch(update, context)
+    message = manager.get_message('batch_done', context.lang)
     await update.message.reply_text(message)
     return ConversationHandler.END
 
 
-async def ask_voice_handler(update: Update, context: CallbackContext) -> int:
-    username = update.effective_user.username
+async def batch_timeout_handler(update: Update, context: BotContext) -> None:
+    """Ends a batch after `batch_timeout` seconds without a new video, so its reference image is released."""
+    manager = BotManager()
+    await end_batch(update, context)
+    message = manager.get_message('batch_expired', context.lang)
+    await update.effective_message.reply_text(message)
+
+
+async def cancel_batch_handler(update: Update, context: BotContext) -> int:
+    """Cancels the batch of driving videos, videos already sent and the reference image are handled like on /done."""
+    await end_batch(update, context)
+    return await cancel_handler(update, context)
+
 
+async def cancel_handler(update: Update, context: BotContext) -> int:
+    """
+    Cancels the current operation and ends the conversation.
+
+    Returns:
+        int: ConversationHandler.END to exit the conversation.
+    """
     manager = BotManager()
-    lang = manager.get_user_language(username)
+    lang = context.lang
+    message = manager.get_message('cancel', lang)
+    await update.message.reply_text(message)
+    return ConversationHandler.END
 
-    if not manager.is_allowed_user(username):
-        manager.logger.warning(f'{username} tried issuing a command but was not allowed.')
-        await update.message.reply_text(manager.get_message("access_denied"))
-        return ConversationHandler.END
+
+async def ask_voice_handler(update: Update, context: BotContext) -> int:
+    manager = BotManager()
+    lang = context.lang
     
     message = manager.get_message('send_voice', lang)
     await update.message.reply_text(message)
     return ADD_VOICE
 
 
-async def add_voice_handler(update: Update, context: CallbackContext) -> int:
+async def add_voice_handler(update: Update, context: BotContext) -> int:
     username = update.effective_user.username
     manager = BotManager()
-    lang = manager.get_user_language(username)
+    lang = context.lang
 
     if update.message.voice:
         manager.logger.debug('Got voice')
@@ -209,13 +696,14 @@ async def add_voice_handler(update: Update, context: CallbackContext) -> int:
     
     try:
         await file_content.download_to_drive(file_path)
-        wav_file = convert_to_wav(file_path)
+        wav_file = await convert_to_wav(file_path)
         if wav_file.get('error', None):
             manager.logger.error(f"File {file_path} from {username} was not converted to wav.")
         else:
             manager.logger.info(f'Removing audio file {file_path}')
             os.remove(file_path)
             file_path = wav_file.get('path')
+            _in_background(_precompute_voice(file_path, username))
         
         manager.logger.info(f'File from {username} temporarily loaded to {file_path}.')
 
@@ -226,7 +714,18 @@ async def add_voice_handler(update: Update, context: CallbackContext) -> int:
         return ConversationHandler.END
 
     except Exception as e:
-        message = manager.get_message('file_failed', lang).format(e=e)
+        message = manager.get_message('file_failed', lang, e=e)
         await update.message.reply_text(message)
         manager.logger.error(f"File processing failed: {e}")
-        return ConversationHandler.END
\ No newline at end of file
+        return ConversationHandler.END
+
+
+async def _precompute_voice(file_path: str, username: str) -> None:
+    """Prepares features of an uploaded voice, conversions compute missing ones themselves until it's done."""
+    manager = BotManager()
+    try:
+        features = await (RemoteWorkers() if job_broker else VoiceConverter()).precompute(file_path)
+    except Exception as e:
+        features = {'error': str(e)}
+    if features.get('error'):
+        manager.logger.error(f"Failed to precompute custom voice of {username}: {features['error']}")
@@ -1,26 +1,17 @@
 from telegram import Update
-from telegram.ext import CallbackContext
 
 from bot.bot_manager import BotManager
+from bot.context import BotContext
 
 
 
-async def start(update: Update, context: CallbackContext) -> None:
+async def start(update: Update, context: BotContext) -> None:
     """Handles the /start command. Sends a welcome message and asks for language preference."""
-    username = update.effective_user.username
-
     manager = BotManager()
-    lang = manager.get_user_language(username)
-
-    if not manager.is_allowed_user(username):
-        manager.logger.warning(f'{username} tried issuing a command but was not allowed.')
-        await update.message.reply_text(manager.get_message("access_denied"))
-        return
+    await update.message.reply_text(manager.get_message("welcome", context.lang))
 
-    await update.message.reply_text(manager.get_message("welcome", lang))
 
-
-async def add_user(update: Update, context: CallbackContext) -> None:
+async def add_user(update: Update, context: BotContext) -> None:
     """
     Handle adding a user to the allowlist.
 
@@ -31,11 +22,11 @@ async def add_user(update: Update, context: CallbackContext) -> None:
     Otherwise, it adds the user to the allowlist and returns a 'user_added' message.
     """
     username = update.effective_user.username
+    lang = context.lang
 
     manager = BotManager()
-    lang = manager.get_user_language(username)
     
-    if not manager.is_admin(username):
+    if not context.profile.is_admin:
         message = manager.get_message('not_authorized', lang)
     elif not context.args:
         message = manager.get_message('add_user', lang)
@@ -44,16 +35,16 @@ async def add_user(update: Update, context: CallbackContext) -> None:
         new_user = new_user.replace('@', '')
 
         if manager.is_allowed_user(new_user):
-            message = manager.get_message('user_exists', lang).format(username=new_user)
+            message = manager.get_message('user_exists', lang, username=new_user)
         else:
             manager.add_user(new_user)
-            message = manager.get_message('user_added', lang).format(username=new_user)
+            message = manager.get_message('user_added', lang, username=new_user)
             manager.logger.info(f'{username} added new user {new_user}')
     
     await update.message.reply_text(message)
 
 
-async def add_admin(update: Update, context: CallbackContext) -> None:
+async def add_admin(update: Update, context: BotContext) -> None:
     """
     Handle adding admin user.
 
@@ -65,11 +56,11 @@ async def add_admin(update: Update, context: CallbackContext) -> None:
     
     """
     username = update.effective_user.username
+    lang = context.lang
 
     manager = BotManager()
-    lang = manager.get_user_language(username)
     
-    if not manager.is_admin(username):
+    if not context.profile.is_admin:
         message = manager.get_message('not_authorized', lang)
     elif not context.args:
         message = manager.get_message('add_admin', lang)
@@ -77,17 +68,17 @@ async def add_admin(update: Update, context: CallbackContext) -> None:
         new_user = context.args[0]
         new_user = new_user.replace('@', '')
 
-        if manager.is_allowed_user(new_user) and manager.is_admin(new_user):
-            message = manager.get_message('user_exists', lang).format(username=new_user)
+        if manager.is_admin(new_user):
+            message = manager.get_message('user_exists', lang, username=new_user)
         else:
             manager.add_user(new_user, is_admin=1)
-            message = manager.get_message('user_added', lang).format(username=new_user)
+            message = manager.get_message('user_added', lang, username=new_user)
             manager.logger.info(f'{username} added new user {new_user}')
     
     await update.message.reply_text(message)
 
 
-async def del_user(update: Update, context: CallbackContext) -> None:
+async def del_user(update: Update, context: BotContext) -> None:
     """
     Handle removing a user from the allowlist.
 
@@ -98,11 +89,11 @@ async def del_user(update: Update, context: CallbackContext) -> None:
     Otherwise, it removes the user from the allowlist and returns a 'user_removed' message.
     """
     username = update.effective_user.username
+    lang = context.lang
 
     manager = BotManager()
-    lang = manager.get_user_language(username)
 
-    if not manager.is_admin(username):
+    if not context.profile.is_admin:
         message = manager.get_message('not_authorized', lang)
     elif not context.args:
         message = manager.get_message('specify_username', lang)
@@ -112,15 +103,15 @@ async def del_user(update: Update, context: CallbackContext) -> None:
 
         if manager.is_allowed_user(user_to_remove):
             manager.remove_user(user_to_remove)
-            message = manager.get_message('user_removed', lang).format(username=user_to_remove)
+            message = manager.get_message('user_removed', lang, username=user_to_remove)
             manager.logger.info(f'{username} removed user {user_to_remove}')
         else:
-            message = manager.get_message('user_not_found', lang).format(username=user_to_remove)
+            message = manager.get_message('user_not_found', lang, username=user_to_remove)
     
     await update.message.reply_text(message)
 
 
-async def show_users(update: Update, context: CallbackContext) -> None:
+async def show_users(update: Update, context: BotContext) -> None:
     """
     Handle showing the current users in the allowlist.
 
@@ -128,17 +119,16 @@ async def show_users(update: Update, context: CallbackContext) -> None:
     If the user is not an admin, it returns a 'not_authorized' message.
     Otherwise, it returns a formatted list of users.
     """
-    username = update.effective_user.username
+    lang = context.lang
 
     manager = BotManager()
-    lang = manager.get_user_language(username)
 
-    if not manager.is_admin(username):
+    if not context.profile.is_admin:
         message = manager.get_message('not_authorized', lang)
     else:
         users_list = [f"{i+1}. @{e[0].replace('@', '')}, lang: {e[1]}, voice: {e[2]}, is admin: {e[3]}" for i, e in enumerate(manager.list_users())]
         users_list = sorted(users_list, key=lambda x: x[0])
         users_list = '\n'.join(users_list)
-        message = manager.get_message('show_users', lang).format(users=users_list)
+        message = manager.get_message('show_users', lang, users=users_list)
 
     await update.message.reply_text(message)
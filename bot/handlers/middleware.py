@@ -0,0 +1,29 @@
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop
+
+from bot.bot_manager import BotManager
+from bot.context import BotContext
+
+
+
+async def resolve_user(update: Update, context: BotContext) -> None:
+    """
+    Runs before all other handlers. Attaches the sender's profile to the context,
+    or answers users outside the allowlist and stops the update from reaching other handlers.
+    """
+    user = update.effective_user
+    if user is None:
+        return
+
+    manager = BotManager()
+    profile = manager.get_user_profile(user.username)
+    if profile:
+        context.profile = profile
+        return
+
+    manager.logger.warning(f'{user.username} tried issuing a command but was not allowed.')
+    if update.callback_query:
+        await update.callback_query.answer(manager.get_message("access_denied"), show_alert=True)
+    elif update.effective_message:
+        await update.effective_message.reply_text(manager.get_message("access_denied"))
+    raise ApplicationHandlerStop
@@ -0,0 +1,167 @@
+import time
+from concurrent.futures import Future
+
+from utils.database import Database
+from utils.logging_config import setup_logging
+
+
+# Expected schema of the bot's database, `Database` creates missing tables and adds missing columns on start.
+# New columns must be nullable or have a default.
+SCHEMA = {
+    "users": [
+        ("username", "TEXT PRIMARY KEY"),
+        ("language", "TEXT NOT NULL DEFAULT 'en'"),
+        ("voice", "TEXT NOT NULL DEFAULT 'orig'"),
+        ("is_admin", "INTEGER DEFAULT 0"),
+    ],
+    "telegram_files": [
+        ("file_hash", "TEXT PRIMARY KEY"),
+        ("kind", "TEXT NOT NULL"),
+        ("file_id", "TEXT NOT NULL"),
+        ("uploaded_at", "REAL"),
+    ],
+    "render_jobs": [
+        ("id", "TEXT PRIMARY KEY"),
+        ("batch", "TEXT NOT NULL"),  # jobs rendered one after another in the same render slot
+        ("username", "TEXT NOT NULL"),
+        ("user_id", "INTEGER"),
+        ("lang", "TEXT"),
+        ("message", "TEXT NOT NULL"),  # JSON of the driving video's message, answered with the animation
+        ("ref_img_file", "TEXT NOT NULL"),
+        ("driving_file", "TEXT NOT NULL"),
+        ("driving_key", "TEXT"),
+        ("result_key", "TEXT"),
+        ("frames", "INTEGER DEFAULT 0"),
+        ("voice", "TEXT"),
+        ("stage", "TEXT NOT NULL DEFAULT 'downloaded'"),
+        ("animation_path", "TEXT"),
+        ("voice_path", "TEXT"),
+        ("partial", "INTEGER DEFAULT 0"),
+        ("broker_job", "TEXT"),  # job of the job broker rendering it, waited for again after a restart
+        ("created_at", "REAL"),
+        ("updated_at", "REAL"),
+    ],
+}
+
+
+
+class Repository:
+    """Base of the classes with queries of a table, writes log their errors instead of raising them."""
+    error_message = "Failed to save data"
+
+    def __init__(self, db: Database):
+        self.db = db
+        self.logger = setup_logging(type(self).__name__)
+
+
+    def _log_errors(self, future: Future) -> Future:
+        def log_error(done: Future):
+            if done.exception():
+                self.logger.error(f"{self.error_message}: {done.exception()}")
+        future.add_done_callback(log_error)
+        return future
+
+
+
+class UserRepository(Repository):
+    """Queries of the users table."""
+    error_message = "Failed to save user data"
+
+    def load_all(self) -> list:
+        return self.db.fetchall("SELECT username, language, voice, is_admin FROM users").result()
+
+
+    def add_if_missing(self, username: str, is_admin: int = 0) -> Future:
+        return self._log_errors(self.db.execute(
+            "INSERT OR IGNORE INTO users (username, language, voice, is_admin) VALUES (?, ?, ?, ?)",
+            (username, 'en', 'orig', is_admin),
+        ))
+
+
+    def upsert(self, username: str, language: str, voice: str, is_admin: int) -> Future:
+        return self._log_errors(self.db.execute(
+            "INSERT OR REPLACE INTO users (username, language, voice, is_admin) VALUES (?, ?, ?, ?)",
+            (username, language, voice, is_admin),
+        ))
+
+
+    def set_language(self, username: str, language: str) -> Future:
+        return self._log_errors(self.db.execute("UPDATE users SET language = ? WHERE username = ?", (language, username)))
+
+
+    def set_voice(self, username: str, voice: str) -> Future:
+        return self._log_errors(self.db.execute("UPDATE users SET voice = ? WHERE username = ?", (voice, username)))
+
+
+    def delete(self, username: str) -> Future:
+        return self._log_errors(self.db.execute("DELETE FROM users WHERE username = ?", (username,)))
+
+
+
+class FileIdRepository(Repository):
+    """Queries of the telegram_files table, file_ids of uploaded files by content hash."""
+    error_message = "Failed to save file_id"
+
+    def load_all(self) -> list:
+        return self.db.fetchall("SELECT file_hash, kind, file_id FROM telegram_files").result()
+
+
+    def save(self, file_hash: str, kind: str, file_id: str) -> Future:
+        return self._log_errors(self.db.execute(
+            "INSERT OR REPLACE INTO telegram_files (file_hash, kind, file_id, uploaded_at) VALUES (?, ?, ?, ?)",
+            (file_hash, kind, file_id, time.time()),
+        ))
+
+
+    def delete(self, file_hash: str) -> Future:
+        return self._log_errors(self.db.execute("DELETE FROM telegram_files WHERE file_hash = ?", (file_hash,)))
+
+
+
+class RenderJobRepository(Repository):
+    """
+    Queries of the render_jobs table, render jobs with their stage and the files produced so far.
+
+    Stages: downloaded -> rendering -> voice -> muxing -> rendered -> delivered, or failed.
+    A job waits in 'voice' for its voice conversion and in 'muxing' for the new audio track,
+    'rendered' jobs only need to be sent.
+    """
+    finished_stages = ('delivered', 'failed')
+    columns = [name for name, _ in SCHEMA["render_jobs"]]
+    error_message = "Failed to save render job"
+
+    def create(self, job: dict) -> Future:
+        job = {**job, 'created_at': time.time(), 'updated_at': time.time()}
+        names = ", ".join(job)
+        placeholders = ", ".join("?" for _ in job)
+        return self._log_errors(self.db.execute(f"INSERT INTO render_jobs ({names}) VALUES ({placeholders})", tuple(job.values())))
+
+
+    def update(self, job_id: str, **fields) -> Future:
+        """Sets the stage and artifacts of a job, e.g. `update(job_id, stage='voice', animation_path=path)`."""
+        fields['updated_at'] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        return self._log_errors(self.db.execute(f"UPDATE render_jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id)))
+
+
+    def load_unfinished(self) -> Future:
+        """Jobs interrupted by a restart as dicts by column name, in the order they were created."""
+        placeholders = ", ".join("?" for _ in self.finished_stages)
+        return self.db.submit(lambda conn: [
+            dict(zip(self.columns, row)) for row in conn.execute(
+                f"SELECT {', '.join(self.columns)} FROM render_jobs WHERE stage NOT IN ({placeholders}) ORDER BY created_at",
+                self.finished_stages,
+            )
+        ])
+
+
+    def count_needing_image(self, ref_img_file: str) -> Future:
+        """Number of jobs that still have to render from a reference image."""
+        return self.db.submit(lambda conn: conn.execute(
+            "SELECT COUNT(*) FROM render_jobs WHERE ref_img_file = ? AND stage IN ('downloaded', 'rendering')", (ref_img_file,)
+        ).fetchone()[0])
+
+
+    def delete_finished(self) -> Future:
+        placeholders = ", ".join("?" for _ in self.finished_stages)
+        return self._log_errors(self.db.execute(f"DELETE FROM render_jobs WHERE stage IN ({placeholders})", self.finished_stages))
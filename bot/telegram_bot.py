@@ -1,32 +1,90 @@
+import os
+
+from telegram import Update
 from telegram.ext import (
     ApplicationBuilder,
     CallbackQueryHandler,
+    ContextTypes,
     ConversationHandler,
     CommandHandler,
     filters,
     MessageHandler,
+    PicklePersistence,
+    TypeHandler,
 )
 
 from bot.handlers.manage_user_file import (
     add_ref_image_handler,
     add_driving_video_handler,
     cancel_handler, 
+    cancel_batch_handler,
+    batch_timeout_handler,
+    done_handler,
     ask_voice_handler,
     add_voice_handler,
+    expire_batches,
+    resume_render_jobs,
 )
+from bot.handlers.middleware import resolve_user
 from bot.handlers.manage_users import start, add_user, add_admin, del_user, show_users
 from bot.handlers.manage_lang import set_language, language_button, set_voice, voice_button
-from config import supported_languages, supported_voices, ADD_DRIVING_VIDEO, ADD_VOICE
+from bot.bot_manager import BotManager
+from bot.context import BotContext
+from bot.update_processor import PerUserUpdateProcessor
+from utils.download import close_client as close_download_client
+from utils.face_detector import FaceDetector
+from utils.metrics import start_metrics_server
+from utils.remote_workers import RemoteWorkers
+from utils.render_worker import RenderWorkerPool
+from utils.voice_engine import VoiceConverter
+from config import (
+    supported_languages, supported_voices, metrics_host, metrics_port,
+    telegram_base_url, telegram_base_file_url, concurrent_updates, job_broker, persistence_path, batch_timeout, ADD_DRIVING_VIDEO, ADD_VOICE,
+    webhook_url, webhook_listen, webhook_port, webhook_path, webhook_secret_token, webhook_cert_path, webhook_key_path,
+)
 
 
 
 class TalkerBot:
-    def __init__(self, token: str):
-        self.app = ApplicationBuilder().token(token).build()
+    def __init__(self, token: str, base_url: str = telegram_base_url, base_file_url: str = telegram_base_file_url):
+        # Conversation states and user_data survive restarts, render jobs are resumed from the database
+        os.makedirs(os.path.dirname(persistence_path), exist_ok=True)
+        builder = (
+            ApplicationBuilder()
+            .token(token)
+            .context_types(ContextTypes(context=BotContext))
+            .persistence(PicklePersistence(filepath=persistence_path))
+            .post_init(self._post_init)
+            .post_shutdown(self._post_shutdown)
+        )
+        # Another Bot API server, e.g. a local one or the fake API of the load tests
+        if base_url:
+            builder = builder.base_url(base_url)
+        if base_file_url:
+            builder = builder.base_file_url(base_file_url)
+        if concurrent_updates > 1:
+            builder = builder.concurrent_updates(PerUserUpdateProcessor(concurrent_updates))
+        self.app = builder.build()
         self._register_handlers()
 
 
+    @staticmethod
+    async def _post_init(app) -> None:
+        await expire_batches(app)
+        await resume_render_jobs(app)
+
+
+    @staticmethod
+    async def _post_shutdown(app) -> None:
+        await close_download_client()
+        if job_broker:
+            await RemoteWorkers().close()
+
+
     def _register_handlers(self):
+        # Resolves the user's profile and rejects users outside the allowlist before any other handler
+        self.app.add_handler(TypeHandler(Update, resolve_user), group=-1)
+
         self.app.add_handler(CommandHandler("start", start))
         
         self.app.add_handler(CommandHandler("set_lang", set_language))
@@ -43,7 +101,8 @@ class TalkerBot:
                 ADD_VOICE: [MessageHandler(filters.ALL & ~filters.COMMAND, add_voice_handler)],
             },
             fallbacks=[CommandHandler('cancel', cancel_handler)],
-            name="voice_conversation"
+            name="voice_conversation",
+            persistent=True,
         )
         self.app.add_handler(voice_conv_handler)
 
@@ -51,8 +110,13 @@ class TalkerBot:
             entry_points=[MessageHandler(filters.PHOTO & ~filters.COMMAND, add_ref_image_handler)],
             states={
                 ADD_DRIVING_VIDEO: [MessageHandler((filters.VIDEO | filters.VIDEO_NOTE) & ~filters.COMMAND, add_driving_video_handler)],
+                ConversationHandler.TIMEOUT: [TypeHandler(Update, batch_timeout_handler)],
             },
-            fallbacks=[CommandHandler('cancel', cancel_handler)],
+            fallbacks=[CommandHandler('done', done_handler), CommandHandler('cancel', cancel_batch_handler)],
+            conversation_timeout=batch_timeout,  # users who just leave don't keep their photo in uploads
+            allow_reentry=True,  # a new photo starts a new batch
+            name="animation_conversation",
+            persistent=True,
         )
         self.app.add_handler(conv_handler)
 
@@ -64,4 +128,30 @@ class TalkerBot:
     
 
     def run(self):
-        self.app.run_polling()
\ No newline at end of file
+        manager = BotManager()
+        if metrics_port:
+            start_metrics_server(metrics_host, metrics_port)
+        # With a job broker, LivePortrait and the voice model run in the workers (worker.py), not in the bot.
+        # Reference images are cropped by the bot's own face detector either way.
+        workers, face_detector = RenderWorkerPool(), FaceDetector()
+        if not job_broker:
+            workers.start()
+            VoiceConverter().start()
+        face_detector.start()
+        try:
+            if webhook_url:
+                self.app.run_webhook(
+                    listen=webhook_listen,
+                    port=webhook_port,
+                    url_path=webhook_path,
+                    webhook_url=webhook_url,
+                    secret_token=webhook_secret_token,
+                    cert=webhook_cert_path,
+                    key=webhook_key_path,
+                )
+            else:
+                self.app.run_polling()
+        finally:
+            workers.shutdown()
+            face_detector.shutdown()
+            manager.close()
\ No newline at end of file
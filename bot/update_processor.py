@@ -0,0 +1,58 @@
+import asyncio
+from typing import Awaitable
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes updates of different users at the same time, but updates of one user strictly one after another.
+
+    Conversation states of a user change in the order of their messages, as with sequential processing,
+    while a slow update of one user doesn't hold up the others. An update waits for its user's turn
+    in one of the `max_concurrent_updates` slots, so keep them well above the number of updates a single
+    user sends at once.
+
+    The lock only covers work done inside the handler's callback, so handlers must stay blocking:
+    a `block=False` handler returns at once and the user's next update would run alongside it.
+    """
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._locks = {}  # user id -> [lock, number of updates holding or waiting for it]
+
+
+    @staticmethod
+    def _key(update: object):
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user:
+            return update.effective_user.id
+        return update.effective_chat.id if update.effective_chat else None
+
+
+    async def do_process_update(self, update: object, coroutine: Awaitable) -> None:
+        key = self._key(update)
+        if key is None:
+            await coroutine
+            return
+
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            # asyncio.Lock wakes waiters first come first served, i.e. in the order the updates arrived
+            async with entry[0]:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+
+    async def initialize(self) -> None:
+        pass
+
+
+    async def shutdown(self) -> None:
+        pass
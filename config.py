@@ -13,11 +13,75 @@ supported_languages = {"en", "de", "ru"}
 supported_voices = {'orig', 'male', 'female', 'custom'}
 custom_voice_filename = "custom.wav"
 messages_path = "./resources/bot_messages.json"
+catalog_reload_interval = 5  # Seconds between checks of messages file for changes
 log_file_path = "./storage/logs/tg_bot.log"
 uploads_path = "./storage/uploads/"
 db_path = "./storage/db/users_data.db"
+persistence_path = "./storage/db/conversations.pickle"  # Conversation states and user_data, kept across restarts
+motion_cache_path = "./storage/cache/motion/"
+motion_cache_max_bytes = 512 * 1024 ** 2  # Motion templates of driving videos, LRU evicted above this size
+result_cache_path = "./storage/cache/results/"
+result_cache_max_bytes = 2 * 1024 ** 3  # Finished animations reused for identical inputs
+result_cache_max_age = 7 * 24 * 3600  # Seconds since last use
+speaker_cache_path = "./storage/cache/speakers/"
+speaker_cache_max_bytes = 64 * 1024 ** 2  # Precomputed features of target voices
+driving_cache_path = "./storage/cache/driving/"
+driving_cache_max_bytes = 512 * 1024 ** 2  # Normalised driving videos
+face_cache_path = "./storage/cache/faces/"
+face_cache_max_bytes = 16 * 1024 ** 2  # Face boxes detected on reference images
+source_cache_path = "./storage/cache/sources/"
+source_cache_max_bytes = 256 * 1024 ** 2  # Crops and landmarks of reference images prepared by LivePortrait
+
+liveportrait_path = "./LivePortrait"  # LivePortrait checkout, imported by render workers
+animations_path = "./animations/"
+render_workers = 1  # Number of long-lived LivePortrait worker processes
+render_worker_max_jobs = 50  # Replace a worker after this many animations, counting renders only
+render_slots = render_workers  # Number of animations rendered at the same time, with a job broker across all workers
+max_queued_renders = 20  # Reply "queue is full" once this many jobs are waiting
+max_queued_renders_per_user = 2  # Max waiting jobs of a single user
+render_frames_per_second = 10  # Initial guess of render throughput for time estimates, refined by measurements
+face_crop_scale = 2.3  # Side of a reference image crop relative to the detected face
+face_detect_timeout = 5  # Seconds to wait for the face detector, center crop is used otherwise
+
+job_broker = None  # "sqlite" or "redis" to render in separate worker processes started with worker.py, None renders inside the bot
+job_broker_path = "./storage/db/jobs.db"  # Database of the sqlite broker, shared by the bot and workers on one host
+job_broker_url = "redis://localhost:6379/0"  # Redis or a compatible server of the redis broker
+job_lease_seconds = 60  # A job goes to another worker when its worker sends no heartbeat for this long
+job_heartbeat_interval = 10  # Seconds between heartbeats of a worker for each of its jobs
+job_max_attempts = 3  # Deliveries of a job before it fails
+job_queue_timeout = 10 * 60  # A job no worker took within this many seconds is removed and fails
+job_timeout = 60 * 60  # The bot stops waiting for a job after this many seconds, a late result is dropped
+job_poll_interval = 0.5  # Seconds between checks for new jobs and finished results
+
+voice_model_name = "voice_conversion_models/multilingual/vctk/freevc24"
+voice_use_cuda = False  # Voice conversion model stays loaded in the bot process
+stock_voice_files = ["./resources/male.wav", "./resources/female.wav"]  # Features precomputed at startup
+
+metrics_host = "127.0.0.1"
+metrics_port = 9100  # Prometheus /metrics endpoint, None to disable
+
+telegram_base_url = None  # Bot API server, e.g. "http://127.0.0.1:8081/bot" for a local one, None for api.telegram.org
+telegram_base_file_url = None  # File downloads of that server, e.g. "http://127.0.0.1:8081/file/bot"
+concurrent_updates = 32  # Updates processed at the same time, one user's updates still go one by one as long as handlers are blocking; 1 to process all sequentially
+
+webhook_url = None  # Public URL Telegram posts updates to, e.g. "https://bot.example.com/talkerbot"; None to poll getUpdates
+webhook_listen = "127.0.0.1"  # Address of the local webhook listener, usually behind a reverse proxy terminating TLS
+webhook_port = 8443
+webhook_path = "talkerbot"  # URL path the listener serves
+webhook_secret_token = os.getenv("WEBHOOK_SECRET_TOKEN")  # Telegram sends it with every update, other requests are rejected
+webhook_cert_path = None  # TLS certificate and key of the listener, when it is exposed without a proxy
+webhook_key_path = None
 
-inference_path = "./LivePortrait/inference.py"
 max_duration = 60  # Max video duration in seconds
+media_group_delay = 1  # Seconds to wait for more videos of an album before rendering them as one job
+batch_timeout = 60 * 60  # Seconds without a new video after which a batch ends and its photo is released
+max_download_size = 20 * 1024 ** 2  # Max size of a downloaded file in bytes, the Bot API limit
+trim_long_videos = True  # Cut driving videos to max_duration instead of rejecting them
+max_resolution = 1920  # Max width or height of a driving video rendered without normalization, in pixels
+max_fps = 60  # Max frame rate of a driving video
+allowed_video_codecs = {"h264", "hevc", "mpeg4", "vp8", "vp9", "av1"}  # Codecs of driving videos
+normalize_driving_videos = True  # Downscale driving videos and cap their frame rate before rendering
+driving_video_size = 512  # Shorter side of a normalised driving video in pixels, LivePortrait works at 512x512
+driving_video_fps = 25  # Frame rate of a normalised driving video, the frame rate of LivePortrait output
 cleanup_user_data = True  # Delete images and videos after processing
 cleanup_animations = False  # Delete resulting animations after sending
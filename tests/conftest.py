@@ -0,0 +1,16 @@
+"""
+Tests run in a scratch directory, so storage, caches and logs of the bot don't touch the repository.
+The directory is entered before any bot module is imported, they resolve their paths on import.
+"""
+import os
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault("TG_BOT_TOKEN", "123456:TEST")
+os.environ.setdefault("ADMIN_NICKNAME", "test_admin")
+_workdir = tempfile.mkdtemp(prefix="talkerbot-tests-")
+os.symlink(os.path.join(REPO_ROOT, "resources"), os.path.join(_workdir, "resources"))
+os.chdir(_workdir)
+sys.path.insert(0, REPO_ROOT)
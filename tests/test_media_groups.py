@@ -0,0 +1,148 @@
+import os
+import time
+import asyncio
+
+import pytest
+
+from benchmarks.fake_bot_api import FakeBotApi
+from benchmarks.media import make_photo
+from bot import telegram_bot
+from bot.bot_manager import BotManager
+from bot.handlers import manage_user_file
+from bot.handlers.manage_user_file import DrivingClip
+from bot.telegram_bot import TalkerBot
+
+TOKEN = "123456:TEST"
+DELAY = 0.3  # media_group_delay of the tests
+
+
+
+class Chat:
+    """A user sending messages to the bot, which polls them from the fake Bot API."""
+    def __init__(self, api: FakeBotApi, user_id: int):
+        self.api = api
+        self.user_id = user_id
+        self.username = f"user_{user_id}"
+
+
+    def send(self, **content) -> int:
+        return self.api.push_update({"message": {
+            "message_id": self.api.next_message_id(),
+            "date": int(time.time()),
+            "chat": {"id": self.user_id, "type": "private"},
+            "from": {"id": self.user_id, "is_bot": False, "first_name": self.username, "username": self.username},
+            **content,
+        }})
+
+
+    def send_video(self, file_id: str, media_group_id: str = None) -> int:
+        video = {"file_id": file_id, "file_unique_id": file_id, "width": 64, "height": 64, "duration": 1, "file_size": 1024}
+        return self.send(video=video, **({"media_group_id": media_group_id} if media_group_id else {}))
+
+
+    def send_command(self, command: str) -> int:
+        return self.send(text=f"/{command}", entities=[{"type": "bot_command", "offset": 0, "length": len(command) + 1}])
+
+
+    async def send_photo(self) -> None:
+        file_id = f"photo-{self.user_id}"
+        self.api.add_file(file_id, make_photo(f"{file_id}.jpg", seed=self.user_id))
+        replied = self.api.wait_for(self.user_id, "sendMessage")
+        self.send(photo=[{"file_id": file_id, "file_unique_id": file_id, "width": 720, "height": 960}])
+        await asyncio.wait_for(replied, 10)
+
+
+
+@pytest.fixture
+def bot(monkeypatch):
+    """
+    Runs the bot against the fake Bot API. Preparing a video only takes a moment and submitting
+    records the driving videos of each render job, by file_id, in `submitted`.
+    """
+    submitted = []
+
+    async def detect_face(image):
+        return None
+
+    async def prepare_clip(update, context, video, ref_img_file):
+        await asyncio.sleep(0.05)  # download, probe and normalisation
+        return DrivingClip(message=update.message, file_path=video.file_id, driving_key=video.file_id, result_key=video.file_id, frames=1)
+
+    async def submit_clips(update, context, clips, ref_img_file):
+        submitted.append([clip.file_path for clip in clips])
+
+    monkeypatch.setattr(manage_user_file, "detect_face", detect_face)
+    monkeypatch.setattr(manage_user_file, "prepare_clip", prepare_clip)
+    monkeypatch.setattr(manage_user_file, "submit_clips", submit_clips)
+    monkeypatch.setattr(manage_user_file, "media_group_delay", DELAY)
+
+    async def run(scenario):
+        api = FakeBotApi().start()
+        app = TalkerBot(TOKEN, base_url=api.base_url, base_file_url=api.base_file_url).app
+        await app.initialize()
+        await app.updater.start_polling(poll_interval=0)
+        await app.start()
+        try:
+            await scenario(api)
+        finally:
+            await app.updater.stop()
+            await app.stop()
+            await app.shutdown()
+            api.stop()
+
+    def play(scenario, user_id: int) -> list:
+        BotManager().add_user(f"user_{user_id}")
+        asyncio.run(run(lambda api: scenario(Chat(api, user_id))))
+        return submitted
+
+    return play
+
+
+async def _settle(seconds: float = DELAY * 3) -> None:
+    await asyncio.sleep(seconds)
+
+
+def test_album_is_rendered_as_one_job(bot):
+    async def scenario(chat):
+        await chat.send_photo()
+        for number in range(3):
+            chat.send_video(f"album-{number}", media_group_id="album")
+        await _settle()
+
+    assert bot(scenario, 1001) == [["album-0", "album-1", "album-2"]]
+
+
+def test_videos_sent_while_another_is_prepared_are_handled(bot):
+    async def scenario(chat):
+        await chat.send_photo()
+        chat.send_video("first")
+        chat.send_video("second")
+        await _settle()
+
+    assert bot(scenario, 1002) == [["first"], ["second"]]
+
+
+def test_done_submits_album_still_being_collected(bot):
+    async def scenario(chat):
+        await chat.send_photo()
+        for number in range(2):
+            chat.send_video(f"album-{number}", media_group_id="album")
+        chat.send_command("done")
+        await _settle()
+
+    assert bot(scenario, 1003) == [["album-0", "album-1"]]
+
+
+def test_batch_times_out_and_releases_the_photo(bot, monkeypatch):
+    monkeypatch.setattr(telegram_bot, "batch_timeout", 0.5)
+
+    async def scenario(chat):
+        await chat.send_photo()
+        photo = os.path.join(manage_user_file.uploads_path, chat.username, f"photo-{chat.user_id}")
+        assert os.path.exists(photo)
+        expired = chat.api.wait_for(chat.user_id, "sendMessage")
+        await asyncio.wait_for(expired, 5)
+        await _settle()
+        assert not os.path.exists(photo)
+
+    assert bot(scenario, 1004) == []
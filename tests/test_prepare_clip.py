@@ -0,0 +1,80 @@
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from bot.handlers import manage_user_file
+
+PROBE = {'codec': "h264", 'width': 64, 'height': 64, 'fps': 25, 'duration': 1, 'has_audio': True}
+
+
+def _video_update(username: str):
+    message = MagicMock(reply_text=AsyncMock())
+    return SimpleNamespace(effective_user=SimpleNamespace(username=username), message=message)
+
+
+def _context(voice: str):
+    return SimpleNamespace(lang="en", profile=SimpleNamespace(voice=voice), user_data={'ref_img_hash': "image"})
+
+
+def _video(file_id: str):
+    return SimpleNamespace(get_file=AsyncMock(return_value=SimpleNamespace(file_path=f"videos/{file_id}.mp4")))
+
+
+@pytest.fixture
+def downloads(monkeypatch):
+    async def stream_download(file_content, file_path):
+        open(file_path, "wb").close()
+        return {'sha256': "driving"}
+
+    async def check_driving_video(file_path):
+        return {'probe': PROBE, 'trimmed': False}
+
+    monkeypatch.setattr(manage_user_file, "stream_download", stream_download)
+    monkeypatch.setattr(manage_user_file, "check_driving_video", check_driving_video)
+    monkeypatch.setattr(manage_user_file, "normalize_driving_videos", False)
+
+
+def test_missing_custom_voice_falls_back_to_original_voice(downloads):
+    update = _video_update("no_voice_user")
+    clip = asyncio.run(manage_user_file.prepare_clip(update, _context("custom.wav"), _video("first"), "photo.jpg"))
+    assert clip.voice is None
+    assert clip.result_key == manage_user_file.ResultCache().key("image", "driving", "orig")
+
+
+def test_failed_download_leaves_no_hash_behind(downloads, monkeypatch):
+    async def stream_download(file_content, file_path):
+        raise ConnectionError("download failed")
+
+    monkeypatch.setattr(manage_user_file, "stream_download", stream_download)
+    update = _video_update("no_voice_user")
+    with pytest.raises(ConnectionError):
+        asyncio.run(manage_user_file.prepare_clip(update, _context("custom.wav"), _video("second"), "photo.jpg"))
+
+
+def test_4k_video_is_accepted_when_it_gets_normalized(monkeypatch):
+    async def probe_video(file_path):
+        return {**PROBE, 'width': 3840, 'height': 2160}
+
+    monkeypatch.setattr(manage_user_file, "probe_video", probe_video)
+    monkeypatch.setattr(manage_user_file, "normalize_driving_videos", True)
+    assert asyncio.run(manage_user_file.check_driving_video("4k.mp4"))['probe']['width'] == 3840
+    monkeypatch.setattr(manage_user_file, "normalize_driving_videos", False)
+    assert asyncio.run(manage_user_file.check_driving_video("4k.mp4"))['error'] == 'video_resolution'
+
+
+def test_4k_video_is_rejected_when_normalization_fails(downloads, monkeypatch):
+    async def check_driving_video(file_path):
+        return {'probe': {**PROBE, 'width': 3840, 'height': 2160}, 'trimmed': False}
+
+    async def prepare_driving_video(file_path, driving_hash, size, fps):
+        return {'error': "ffmpeg failed"}
+
+    monkeypatch.setattr(manage_user_file, "check_driving_video", check_driving_video)
+    monkeypatch.setattr(manage_user_file, "prepare_driving_video", prepare_driving_video)
+    monkeypatch.setattr(manage_user_file, "normalize_driving_videos", True)
+    update = _video_update("4k_user")
+    assert asyncio.run(manage_user_file.prepare_clip(update, _context("orig"), _video("4k"), "photo.jpg")) is None
+    message = manage_user_file.BotManager().get_message('video_resolution', "en", max_resolution=manage_user_file.max_resolution)
+    update.message.reply_text.assert_awaited_with(message)
@@ -0,0 +1,69 @@
+import asyncio
+
+from utils.job_broker import SqliteJobBroker
+from utils.remote_workers import RemoteWorkers
+
+
+def _remote_workers(tmp_path, **timeouts) -> RemoteWorkers:
+    broker = SqliteJobBroker(str(tmp_path / "jobs.db"))
+    return RemoteWorkers.__wrapped__(broker=broker, poll_interval=0.05, **timeouts)
+
+
+def test_job_no_worker_takes_is_removed(tmp_path):
+    async def scenario():
+        remote = _remote_workers(tmp_path, queue_timeout=0.2, timeout=5)
+        result = await remote.precompute("voice.wav")
+        assert "No worker took" in result['error']
+        assert await remote.broker.lease("worker") is None
+        await remote.close()
+
+    asyncio.run(scenario())
+
+
+def test_leased_job_fails_after_timeout(tmp_path):
+    async def scenario():
+        remote = _remote_workers(tmp_path, queue_timeout=0.2, timeout=0.5)
+        submitted = asyncio.create_task(remote.precompute("voice.wav"))
+        while (job := await remote.broker.lease("worker")) is None:
+            await asyncio.sleep(0.01)
+        result = await submitted
+        assert "didn't finish" in result['error']
+        assert await remote.broker.complete(job['id'], "worker", {'voice_path': "voice.pt"})
+        await remote.close()
+
+    asyncio.run(scenario())
+
+
+def test_result_of_leased_job_arrives_after_queue_timeout(tmp_path):
+    async def scenario():
+        remote = _remote_workers(tmp_path, queue_timeout=0.1, timeout=5)
+        submitted = asyncio.create_task(remote.precompute("voice.wav"))
+        while (job := await remote.broker.lease("worker")) is None:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.3)
+        await remote.broker.complete(job['id'], "worker", {'voice_path': "voice.pt"})
+        assert await submitted == {'voice_path': "voice.pt"}
+        await remote.close()
+
+    asyncio.run(scenario())
+
+
+def test_resumed_job_is_waited_for_instead_of_submitted_again(tmp_path):
+    async def scenario():
+        before = _remote_workers(tmp_path, queue_timeout=5, timeout=5)
+        interrupted = asyncio.create_task(before.animate("photo.jpg", "video.mp4", job_id="job-1"))
+        while (job := await before.broker.lease("worker")) is None:
+            await asyncio.sleep(0.01)
+        interrupted.cancel()  # the bot restarts while a worker renders the job
+        await before.close()
+
+        after = _remote_workers(tmp_path, queue_timeout=5, timeout=5)
+        assert await after.resume("job-1")
+        assert not await after.resume("job-2")
+        await after.broker.complete(job['id'], "worker", {'path': "animation.mp4"})
+        await asyncio.sleep(0.2)  # the result arrives before the job's turn in the render queue
+        assert await after.animate("photo.jpg", "video.mp4", job_id="job-1") == {'path': "animation.mp4"}
+        assert await after.broker.lease("worker") is None
+        await after.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,74 @@
+import asyncio
+
+from utils.metrics import ACTIVE_RENDERS, QUEUE_DEPTH
+from utils.render_scheduler import RenderScheduler
+
+
+def _scheduler(slots: int = 1) -> RenderScheduler:
+    return RenderScheduler.__wrapped__(slots=slots, max_queued=100, max_per_user=100)
+
+
+def test_positions_count_own_earlier_jobs():
+    async def scenario():
+        scheduler = _scheduler()
+        release = asyncio.Event()
+        job = lambda: release.wait()
+
+        assert scheduler.submit("a", job)['position'] == 0
+        assert scheduler.submit("a", job)['position'] == 1
+        a3 = scheduler.submit("a", job)
+        assert a3['position'] == 2
+        b1 = scheduler.submit("b", job)
+        assert b1['position'] == 2  # a2, b1, a3
+        queue = scheduler._queues
+        assert [scheduler.position(job) for job in queue["a"]] == [1, 3]
+        assert scheduler.position(queue["b"][0]) == 2
+        release.set()
+
+    asyncio.run(scenario())
+
+
+def test_positions_match_round_robin_order():
+    async def scenario():
+        scheduler = _scheduler(slots=2)
+        release = asyncio.Event()
+        started, names = [], {}
+
+        def job(name):
+            async def run():
+                started.append(name)
+                await release.wait()
+            names[run] = name
+            return run
+
+        for name in ["a1", "b1", "a2", "a3", "c1", "b2", "a4", "c2", "b3"]:
+            scheduler.submit(name[0], job(name))
+        waiting = [job for jobs in scheduler._queues.values() for job in jobs]
+        assert sorted(map(scheduler.position, waiting)) == list(range(1, len(waiting) + 1))
+        expected = [names[job.run] for job in sorted(waiting, key=scheduler.position)]
+
+        release.set()
+        while scheduler.active or scheduler.queued:
+            await asyncio.sleep(0.01)
+        assert started[:2] == ["a1", "b1"]
+        assert started[2:] == expected
+
+    asyncio.run(scenario())
+
+
+def test_gauges_follow_the_queue():
+    async def scenario():
+        scheduler = _scheduler()
+        release = asyncio.Event()
+        for name in ["a", "a", "b"]:
+            scheduler.submit(name, release.wait)
+        assert QUEUE_DEPTH.samples() == [(QUEUE_DEPTH.name, (), 2)]
+        assert ACTIVE_RENDERS.samples() == [(ACTIVE_RENDERS.name, (), 1)]
+
+        release.set()
+        while scheduler.active or scheduler.queued:
+            await asyncio.sleep(0.01)
+        assert QUEUE_DEPTH.samples() == [(QUEUE_DEPTH.name, (), 0)]
+        assert ACTIVE_RENDERS.samples() == [(ACTIVE_RENDERS.name, (), 0)]
+
+    asyncio.run(scenario())
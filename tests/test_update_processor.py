@@ -0,0 +1,31 @@
+import asyncio
+
+from telegram import Chat, Message, Update, User
+
+from bot.update_processor import PerUserUpdateProcessor
+
+
+def _update(update_id: int, user_id: int) -> Update:
+    user = User(user_id, f"user_{user_id}", is_bot=False)
+    message = Message(update_id, None, Chat(user_id, "private"), from_user=user, text="hi")
+    return Update(update_id, message=message)
+
+
+def test_updates_of_one_user_run_in_order_and_others_alongside():
+    async def scenario():
+        processor = PerUserUpdateProcessor(8)
+        handled = []
+
+        async def handle(name, seconds):
+            await asyncio.sleep(seconds)
+            handled.append(name)
+
+        await asyncio.gather(
+            processor.process_update(_update(1, 1), handle("a1", 0.2)),
+            processor.process_update(_update(2, 1), handle("a2", 0)),
+            processor.process_update(_update(3, 2), handle("b1", 0.1)),
+        )
+        assert handled == ["b1", "a1", "a2"]
+        assert not processor._locks
+
+    asyncio.run(scenario())
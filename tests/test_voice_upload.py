@@ -0,0 +1,46 @@
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+
+from telegram.ext import ConversationHandler
+
+from bot.bot_manager import BotManager
+from bot.handlers import manage_user_file
+
+
+def _voice_update(username: str):
+    voice_file = SimpleNamespace(file_path=f"voices/{username}.oga", download_to_drive=AsyncMock())
+    message = MagicMock(voice=MagicMock(get_file=AsyncMock(return_value=voice_file)), reply_text=AsyncMock())
+    return SimpleNamespace(effective_user=SimpleNamespace(username=username), message=message)
+
+
+def test_voice_is_set_before_a_queued_precompute_finishes(monkeypatch, tmp_path):
+    class SlowWorkers:
+        """Precompute job waiting in the job broker's queue behind render jobs."""
+        released = asyncio.Event()
+
+        async def precompute(self, voice_path):
+            await self.released.wait()
+            return {'error': "No worker took the precompute_voice job."}
+
+    async def convert_to_wav(file_path):
+        wav_path = tmp_path / "voice.wav"
+        wav_path.write_bytes(b"")
+        open(file_path, "wb").close()
+        return {'path': str(wav_path)}
+
+    monkeypatch.setattr(manage_user_file, "job_broker", "sqlite")
+    monkeypatch.setattr(manage_user_file, "RemoteWorkers", SlowWorkers)
+    monkeypatch.setattr(manage_user_file, "convert_to_wav", convert_to_wav)
+    BotManager().add_user("voice_user")
+
+    async def scenario():
+        update = _voice_update("voice_user")
+        state = await asyncio.wait_for(manage_user_file.add_voice_handler(update, SimpleNamespace(lang="en")), 1)
+        assert state == ConversationHandler.END
+        update.message.reply_text.assert_awaited_once_with(BotManager().get_message('voice_is_set', "en"))
+
+        SlowWorkers.released.set()
+        await asyncio.gather(*manage_user_file._background_tasks)
+
+    asyncio.run(scenario())
@@ -0,0 +1,129 @@
+import os
+import time
+import queue
+import sqlite3
+import asyncio
+import threading
+from concurrent.futures import Future
+
+from utils.logging_config import setup_logging
+
+
+
+class Database:
+    """
+    SQLite database owned by a single background thread.
+
+    Callers never touch the connection: they submit functions taking it and get a future back,
+    which async code can await without blocking the event loop. Writes arriving in a burst
+    are committed together once per `batch_window` seconds.
+
+    `schema` maps table names to (column, type) pairs, missing tables and columns are created on start.
+    """
+    def __init__(self, db_path: str, schema: dict, batch_window: float = 0.01, max_batch: int = 100):
+        self.db_path = db_path
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.logger = setup_logging('Database')
+        self._queue = queue.Queue()
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._thread = threading.Thread(target=self._serve, name="database", daemon=True)
+        self._thread.start()
+        self.submit(self._migrate, schema, write=True).result()
+
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, cached_statements=256)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+
+    def _migrate(self, conn: sqlite3.Connection, schema: dict) -> None:
+        for table, columns in schema.items():
+            definition = ", ".join(f"{name} {column_type}" for name, column_type in columns)
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({definition})")
+            existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            for name, column_type in columns:
+                if name not in existing:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+                    self.logger.info(f"Added column {name} to table {table}.")
+
+
+    def _next_batch(self, first) -> list:
+        """Collects requests arriving shortly after a write, so they share one commit."""
+        batch = [first]
+        if not first[3]:
+            return batch
+
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+
+    def _serve(self) -> None:
+        conn = self._connect()
+        while (item := self._queue.get()) is not None:
+            results = []
+            batch = self._next_batch(item)
+            for future, func, args, _ in batch:
+                try:
+                    results.append((future, func(conn, *args), None))
+                except Exception as e:
+                    results.append((future, None, e))
+
+            if any(write for *_, write in batch):
+                try:
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    results = [(future, None, e) for future, _, _ in results]
+
+            for future, result, error in results:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+        conn.close()
+
+
+    def submit(self, func, *args, write: bool = False) -> Future:
+        """
+        Runs `func(connection, *args)` on the database thread.
+
+        Returns:
+            A future with the function's result, resolved after the commit for writes
+        """
+        future = Future()
+        self._queue.put((future, func, args, write))
+        return future
+
+
+    async def run(self, func, *args, write: bool = False):
+        return await asyncio.wrap_future(self.submit(func, *args, write=write))
+
+
+    def execute(self, sql: str, params: tuple = ()) -> Future:
+        """Queues a write statement."""
+        return self.submit(lambda conn: conn.execute(sql, params).rowcount, write=True)
+
+
+    def fetchall(self, sql: str, params: tuple = ()) -> Future:
+        return self.submit(lambda conn: conn.execute(sql, params).fetchall())
+
+
+    def close(self) -> None:
+        """Finishes queued requests and closes the connection."""
+        self._queue.put(None)
+        self._thread.join()
@@ -0,0 +1,84 @@
+import os
+import asyncio
+import hashlib
+
+import httpx
+from telegram import File
+
+from config import max_download_size
+from utils.logging_config import setup_logging
+
+
+
+logger = setup_logging('Download')
+_client = None
+
+
+def _get_client() -> httpx.AsyncClient:
+    """Shared HTTP client, so downloads reuse connections to the Bot API server."""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(timeout=httpx.Timeout(30.0, read=60.0), follow_redirects=True)
+    return _client
+
+
+def _copy_local(source: str, output_path: str, max_bytes: int, chunk_size: int) -> dict:
+    digest, size = hashlib.sha256(), 0
+    with open(source, 'rb') as src, open(output_path, 'wb') as dst:
+        while chunk := src.read(chunk_size):
+            size += len(chunk)
+            if size > max_bytes:
+                return {'error': 'too_large'}
+            digest.update(chunk)
+            dst.write(chunk)
+    return {'path': output_path, 'sha256': digest.hexdigest(), 'size': size}
+
+
+async def stream_download(file: File, output_path: str, max_bytes: int = max_download_size, chunk_size: int = 256 * 1024) -> dict:
+    """
+    Downloads a Telegram file in chunks, hashing it while it is written to disk.
+
+    The declared size is checked before the download starts and the received size while it runs,
+    so an oversized file is dropped without being read to the end.
+
+    Args:
+        file: File returned by `get_file()`
+        output_path: Where to write the file
+        max_bytes: Largest accepted file size
+        chunk_size: Size of chunks read from the network
+    Returns:
+        A dictionary with {'path', 'sha256', 'size'} on success or {'error': error_message} on failure
+    """
+    if file.file_size and file.file_size > max_bytes:
+        return {'error': 'too_large'}
+
+    # With a local Bot API server file_path points to the file on disk
+    if not file.file_path.startswith(('http://', 'https://')):
+        result = await asyncio.to_thread(_copy_local, file.file_path, output_path, max_bytes, chunk_size)
+    else:
+        digest, size = hashlib.sha256(), 0
+        result = None
+        async with _get_client().stream('GET', file.file_path) as response:
+            response.raise_for_status()
+            with open(output_path, 'wb') as f:
+                async for chunk in response.aiter_bytes(chunk_size):
+                    size += len(chunk)
+                    if size > max_bytes:
+                        result = {'error': 'too_large'}
+                        break
+                    digest.update(chunk)
+                    f.write(chunk)
+        result = result or {'path': output_path, 'sha256': digest.hexdigest(), 'size': size}
+
+    if result.get('error'):
+        logger.warning(f"Dropped {file.file_unique_id}: larger than {max_bytes} bytes.")
+        if os.path.exists(output_path):
+            os.remove(output_path)
+    return result
+
+
+async def close_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
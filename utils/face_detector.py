@@ -0,0 +1,117 @@
+import os
+import sys
+import asyncio
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from config import liveportrait_path
+from utils.logging_config import setup_logging
+from utils.singleton import singleton
+
+
+# Face detector of the process, loaded once by `_init_detector`
+_face_analysis = None
+
+
+def _init_detector(liveportrait_dir: str) -> None:
+    """
+    Loads the face detector of LivePortrait cropper on CPU, without the checkpoints of the animation models.
+    Mirrors what LivePortrait/src/utils/cropper.py does.
+    """
+    global _face_analysis
+
+    sys.path.insert(0, os.path.abspath(liveportrait_dir))
+    from src.config.crop_config import CropConfig
+    from src.utils.face_analysis_diy import FaceAnalysisDIY
+
+    crop_cfg = CropConfig()
+    _face_analysis = FaceAnalysisDIY(name="buffalo_l", root=crop_cfg.insightface_root, providers=["CPUExecutionProvider"])
+    _face_analysis.prepare(ctx_id=-1, det_size=(512, 512), det_thresh=crop_cfg.det_thresh)
+    _face_analysis.warmup()
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _detect_face(image: bytes) -> dict:
+    """Finds the largest face on an image."""
+    try:
+        import cv2
+        import numpy as np
+
+        img_bgr = cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+        faces = _face_analysis.get(img_bgr, flag_do_landmark_2d_106=False, direction='large-small')
+    except Exception:
+        return {'error': traceback.format_exc()}
+    if not faces:
+        return {'bbox': None}
+    return {'bbox': [float(v) for v in faces[0].bbox[:4]]}
+
+
+
+@singleton
+class FaceDetector:
+    """
+    Process with only the face detector of LivePortrait loaded, for cropping reference images.
+
+    It's separate from the render workers, so a photo doesn't wait for a render slot, and small
+    enough to run in the bot when rendering is done by workers of a job broker.
+    """
+    def __init__(self):
+        self.logger = setup_logging('FaceDetector')
+        self._executor = None
+
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_detector,
+                initargs=(liveportrait_path,),
+            )
+        return self._executor
+
+
+    def _restart(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        self.logger.warning("Face detector crashed, restarting it.")
+
+
+    def start(self) -> None:
+        """Spawns the detector process, which loads insightface in its initializer."""
+        self._get_executor().submit(_ping)
+        self.logger.info("Started the face detector.")
+
+
+    async def detect(self, image: bytes) -> dict:
+        """
+        Detects the largest face on an image.
+
+        Args:
+            image: Content of the image file
+        Returns:
+            A dictionary with {'bbox': [left, top, right, bottom]} or {'bbox': None} if there is no face,
+            or {'error': error_message} on failure
+        """
+        try:
+            try:
+                future = self._get_executor().submit(_detect_face, image)
+            except BrokenProcessPool:
+                self._restart()
+                future = self._get_executor().submit(_detect_face, image)
+            return await asyncio.wrap_future(future)
+        except BrokenProcessPool as e:
+            self._restart()
+            return {'error': f"Face detector died: {e}"}
+
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,231 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+
+from config import (
+    motion_cache_path, motion_cache_max_bytes,
+    result_cache_path, result_cache_max_bytes, result_cache_max_age, cleanup_animations,
+    speaker_cache_path, speaker_cache_max_bytes,
+    driving_cache_path, driving_cache_max_bytes,
+    face_cache_path, face_cache_max_bytes, source_cache_path, source_cache_max_bytes,
+)
+from utils.logging_config import setup_logging
+from utils.metrics import CACHE_REQUESTS
+from utils.singleton import singleton
+
+
+
+def file_sha256(file_path: str, chunk_size: int = 1 << 20) -> str:
+    """Returns hex SHA-256 of a file's content."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+
+class FileCache:
+    """
+    Directory of files named after a content hash.
+
+    Files sharing a key (`<key>.pkl`, `<key>.json`, ...) are treated as one entry. Entries are evicted
+    least recently used first once the directory exceeds `max_bytes`, or once older than `max_age` seconds.
+    """
+    def __init__(self, name: str, path: str, max_bytes: int, max_age: float = None):
+        self.name = name
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.logger = setup_logging(f'{name.title()}Cache')
+        os.makedirs(path, exist_ok=True)
+
+
+    def _file(self, key: str, suffix: str) -> str:
+        return os.path.join(self.path, key + suffix)
+
+
+    def _count(self, key: str, hit: bool) -> None:
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        CACHE_REQUESTS.inc(cache=self.name, result="hit" if hit else "miss")
+        self.logger.info(f"{self.name} cache {'hit' if hit else 'miss'} for {key[:12]} (hits={self.hits}, misses={self.misses}).")
+
+
+    def get(self, key: str, suffix: str) -> str:
+        """
+        Looks up a cached file.
+
+        Args:
+            key: Content hash the file was stored under
+            suffix: File extension, e.g. '.pkl'
+        Returns:
+            Path to the cached file, or None on a miss
+        """
+        file_path = self._file(key, suffix)
+        if os.path.exists(file_path):
+            os.utime(file_path)  # mark as recently used
+            self._count(key, hit=True)
+            return file_path
+
+        self._count(key, hit=False)
+        return None
+
+
+    def put(self, key: str, file_path: str, suffix: str = None, move: bool = True) -> str:
+        """
+        Stores a file in the cache and evicts old entries if the cache grew too big.
+
+        Args:
+            key: Content hash to store the file under
+            file_path: File to store
+            suffix: File extension, the one of `file_path` by default
+            move: Move the file into the cache instead of copying it
+        Returns:
+            Path to the cached file
+        """
+        cached_path = self._file(key, suffix or os.path.splitext(file_path)[1])
+        tmp_path = cached_path + '.tmp'
+        if move:
+            shutil.move(file_path, tmp_path)
+        else:
+            shutil.copyfile(file_path, tmp_path)
+        os.replace(tmp_path, cached_path)
+        self.evict()
+        return cached_path
+
+
+    def remove(self, key: str) -> None:
+        """Removes all files of an entry."""
+        for entry in os.scandir(self.path):
+            if entry.name.split('.', 1)[0] == key:
+                os.remove(entry.path)
+
+
+    def evict(self) -> None:
+        """Removes least recently used entries until the cache fits into its limits."""
+        entries = {}
+        for entry in os.scandir(self.path):
+            if not entry.is_file() or entry.name.endswith('.tmp'):
+                continue
+            key = entry.name.split('.', 1)[0]
+            stat = entry.stat()
+            last_used, size, files = entries.get(key, (0, 0, []))
+            entries[key] = (max(last_used, stat.st_mtime), size + stat.st_size, files + [entry.path])
+
+        total = sum(size for _, size, _ in entries.values())
+        now = time.time()
+        for key, (last_used, size, files) in sorted(entries.items(), key=lambda e: e[1][0]):
+            expired = self.max_age is not None and now - last_used > self.max_age
+            if total <= self.max_bytes and not expired:
+                break
+            for file_path in files:
+                os.remove(file_path)
+            total -= size
+            self.logger.debug(f"Evicted {key[:12]} from {self.name} cache.")
+
+
+
+@singleton
+class MotionTemplateCache(FileCache):
+    """Motion templates (.pkl) extracted by LivePortrait from driving videos, keyed by video hash."""
+    def __init__(self):
+        super().__init__('motion', motion_cache_path, motion_cache_max_bytes)
+
+
+
+@singleton
+class SpeakerCache(FileCache):
+    """Target voice features (.npy) computed by the voice conversion model, keyed by voice file hash."""
+    def __init__(self):
+        super().__init__('speaker', speaker_cache_path, speaker_cache_max_bytes)
+
+
+
+@singleton
+class FaceCache(FileCache):
+    """Face boxes (.json) detected on reference images, keyed by hash of the uploaded image."""
+    def __init__(self):
+        super().__init__('face', face_cache_path, face_cache_max_bytes)
+
+
+
+@singleton
+class SourceCache(FileCache):
+    """Crops and landmarks (.pkl) LivePortrait prepares from a reference image, keyed by hash of its pixels."""
+    def __init__(self):
+        super().__init__('source', source_cache_path, source_cache_max_bytes)
+
+
+
+@singleton
+class DrivingVideoCache(FileCache):
+    """Driving videos downscaled and resampled for rendering, keyed by video hash and normalisation settings."""
+    def __init__(self):
+        super().__init__('driving', driving_cache_path, driving_cache_max_bytes)
+
+
+    @staticmethod
+    def key(driving_hash: str, size: int, fps: int) -> str:
+        return hashlib.sha256(f"{driving_hash}:{size}:{fps}".encode()).hexdigest()
+
+
+
+@singleton
+class ResultCache(FileCache):
+    """
+    Finished animations keyed by hashes of their inputs.
+
+    An entry holds the animation (`<key>.mp4`) and its content hash (`<key>.json`), under which
+    the bot remembers Telegram file_id of the animation, so a repeated request can be answered
+    without rendering or uploading anything. With `cleanup_animations` only the hash is kept.
+    """
+    def __init__(self):
+        super().__init__('result', result_cache_path, result_cache_max_bytes, result_cache_max_age)
+
+
+    @staticmethod
+    def key(image_hash: str, driving_hash: str, voice_hash: str) -> str:
+        """Builds a cache key from hashes of the cropped reference image, driving video and target voice."""
+        return hashlib.sha256(f"{image_hash}:{driving_hash}:{voice_hash}".encode()).hexdigest()
+
+
+    def lookup(self, key: str) -> dict:
+        """
+        Returns:
+            A dictionary with 'file_hash' and, if the file is kept, 'path' of a cached animation, or None on a miss
+        """
+        meta_path = self._file(key, '.json')
+        result = None
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                result = json.load(f)
+        if not result or 'file_hash' not in result:
+            self._count(key, hit=False)
+            return None
+
+        os.utime(meta_path)  # mark as recently used
+        animation_path = self._file(key, '.mp4')
+        if os.path.exists(animation_path):
+            result['path'] = animation_path
+
+        self._count(key, hit=True)
+        return result
+
+
+    def store(self, key: str, animation_path: str, file_hash: str) -> None:
+        """Remembers a delivered animation, the file itself is copied unless `cleanup_animations` is set."""
+        if not cleanup_animations:
+            self.put(key, animation_path, '.mp4', move=False)
+
+        meta_path = self._file(key, '.json')
+        with open(meta_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'file_hash': file_hash}, f)
+        os.replace(meta_path + '.tmp', meta_path)
+        self.evict()
@@ -0,0 +1,311 @@
+import json
+import time
+import asyncio
+from abc import ABC, abstractmethod
+
+from config import job_broker, job_broker_path, job_broker_url, job_lease_seconds, job_max_attempts
+from utils.database import Database
+
+
+BROKER_SCHEMA = {
+    "broker_jobs": [
+        ("id", "TEXT PRIMARY KEY"),
+        ("kind", "TEXT NOT NULL"),
+        ("payload", "TEXT NOT NULL"),
+        ("status", "TEXT NOT NULL DEFAULT 'queued'"),  # queued -> leased -> done, results are deleted once taken
+        ("worker", "TEXT"),
+        ("lease_until", "REAL"),
+        ("attempts", "INTEGER NOT NULL DEFAULT 0"),
+        ("result", "TEXT"),
+        ("created_at", "REAL"),
+    ],
+}
+
+
+def _abandoned(attempts: int) -> dict:
+    return {'error': f"Job was abandoned by its worker {attempts} time(s)."}
+
+
+
+class JobBroker(ABC):
+    """
+    Queue of jobs shared by the bot and render workers, which may run in other processes or on other hosts.
+
+    A worker leases a job for `lease_seconds` and extends the lease with heartbeats while it works on it.
+    A job whose lease ran out, because its worker died or hung, is handed to the next worker, and fails
+    after `max_attempts` deliveries. Results are kept until the bot takes them. A job still waiting
+    for a worker can be cancelled.
+    """
+    def __init__(self, lease_seconds: float = job_lease_seconds, max_attempts: int = job_max_attempts):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+
+    @abstractmethod
+    async def enqueue(self, job_id: str, kind: str, payload: dict) -> None:
+        """Adds a job, `kind` tells workers what to do with the payload."""
+
+
+    @abstractmethod
+    async def lease(self, worker: str) -> dict:
+        """
+        Hands the oldest waiting job to a worker.
+
+        Returns:
+            A dictionary with {'id', 'kind', 'payload', 'attempts'}, or None if there is no job
+        """
+
+
+    @abstractmethod
+    async def heartbeat(self, job_id: str, worker: str) -> bool:
+        """Extends the lease of a job. Returns False if the worker lost the job to another one."""
+
+
+    @abstractmethod
+    async def complete(self, job_id: str, worker: str, result: dict) -> bool:
+        """Stores the result of a job. Returns False if the worker lost the job and the result is dropped."""
+
+
+    @abstractmethod
+    async def take_results(self) -> list:
+        """Returns results of finished jobs as (job_id, result) pairs and removes them from the broker."""
+
+
+    @abstractmethod
+    async def exists(self, job_id: str) -> bool:
+        """Whether the broker still has a job, waiting, running or with a result the bot hasn't taken."""
+
+
+    @abstractmethod
+    async def cancel(self, job_id: str) -> bool:
+        """Removes a job no worker has taken yet. Returns False if a worker has it or it's finished."""
+
+
+    async def close(self) -> None:
+        pass
+
+
+
+class SqliteJobBroker(JobBroker):
+    """
+    Broker in an SQLite database, for the bot and workers on a single host.
+    Every statement that changes the owner of a job is a single UPDATE, so processes can't take the same job.
+    """
+    def __init__(self, db_path: str = job_broker_path, **kwargs):
+        super().__init__(**kwargs)
+        self.db = Database(db_path, schema=BROKER_SCHEMA)
+
+
+    def _requeue_expired(self, conn, now: float) -> None:
+        abandoned = conn.execute(
+            "SELECT id, attempts FROM broker_jobs WHERE status = 'leased' AND lease_until < ? AND attempts >= ?",
+            (now, self.max_attempts),
+        ).fetchall()
+        for job_id, attempts in abandoned:
+            conn.execute(
+                "UPDATE broker_jobs SET status = 'done', worker = NULL, result = ? WHERE id = ?",
+                (json.dumps(_abandoned(attempts)), job_id),
+            )
+        conn.execute(
+            "UPDATE broker_jobs SET status = 'queued', worker = NULL WHERE status = 'leased' AND lease_until < ?", (now,)
+        )
+
+
+    def _lease(self, conn, worker: str) -> tuple:
+        now = time.time()
+        self._requeue_expired(conn, now)
+        return conn.execute(
+            """
+            UPDATE broker_jobs SET status = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1
+            WHERE id = (SELECT id FROM broker_jobs WHERE status = 'queued' ORDER BY rowid LIMIT 1) AND status = 'queued'
+            RETURNING id, kind, payload, attempts
+            """,
+            (worker, now + self.lease_seconds),
+        ).fetchone()
+
+
+    async def enqueue(self, job_id: str, kind: str, payload: dict) -> None:
+        await asyncio.wrap_future(self.db.execute(
+            "INSERT INTO broker_jobs (id, kind, payload, created_at) VALUES (?, ?, ?, ?)",
+            (job_id, kind, json.dumps(payload), time.time()),
+        ))
+
+
+    async def lease(self, worker: str) -> dict:
+        row = await self.db.run(self._lease, worker, write=True)
+        if row is None:
+            return None
+        job_id, kind, payload, attempts = row
+        return {'id': job_id, 'kind': kind, 'payload': json.loads(payload), 'attempts': attempts}
+
+
+    async def heartbeat(self, job_id: str, worker: str) -> bool:
+        updated = await asyncio.wrap_future(self.db.execute(
+            "UPDATE broker_jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+            (time.time() + self.lease_seconds, job_id, worker),
+        ))
+        return updated > 0
+
+
+    async def complete(self, job_id: str, worker: str, result: dict) -> bool:
+        updated = await asyncio.wrap_future(self.db.execute(
+            "UPDATE broker_jobs SET status = 'done', worker = NULL, result = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+            (json.dumps(result), job_id, worker),
+        ))
+        return updated > 0
+
+
+    async def take_results(self) -> list:
+        rows = await self.db.run(
+            lambda conn: conn.execute("DELETE FROM broker_jobs WHERE status = 'done' RETURNING id, result").fetchall(),
+            write=True,
+        )
+        return [(job_id, json.loads(result)) for job_id, result in rows]
+
+
+    async def exists(self, job_id: str) -> bool:
+        rows = await asyncio.wrap_future(self.db.fetchall("SELECT 1 FROM broker_jobs WHERE id = ?", (job_id,)))
+        return bool(rows)
+
+
+    async def cancel(self, job_id: str) -> bool:
+        deleted = await asyncio.wrap_future(self.db.execute(
+            "DELETE FROM broker_jobs WHERE id = ? AND status = 'queued'", (job_id,)
+        ))
+        return deleted > 0
+
+
+    async def close(self) -> None:
+        await asyncio.to_thread(self.db.close)
+
+
+
+class RedisJobBroker(JobBroker):
+    """
+    Broker in Redis or a compatible server (Valkey, KeyDB, ...), for workers on several hosts.
+
+    Waiting job ids are a list, leases a sorted set by expiry time, results a list and every job a hash,
+    kept until the bot takes its result. Changes of a job's owner run as Lua scripts, so they are atomic on the server.
+    """
+    _lease_script = """
+        local job_id = redis.call('RPOP', KEYS[1])
+        if not job_id then return nil end
+        local job = ARGV[3] .. job_id
+        redis.call('HSET', job, 'worker', ARGV[1])
+        local attempts = redis.call('HINCRBY', job, 'attempts', 1)
+        redis.call('ZADD', KEYS[2], ARGV[2], job_id)
+        return {job_id, redis.call('HGET', job, 'kind'), redis.call('HGET', job, 'payload'), attempts}
+    """
+    _requeue_script = """
+        local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+        for _, job_id in ipairs(expired) do
+            redis.call('ZREM', KEYS[1], job_id)
+            local job = ARGV[3] .. job_id
+            local attempts = tonumber(redis.call('HGET', job, 'attempts'))
+            redis.call('HDEL', job, 'worker')
+            if attempts >= tonumber(ARGV[2]) then
+                redis.call('RPUSH', KEYS[3], cjson.encode({id = job_id, result = {error = 'Job was abandoned by its worker ' .. attempts .. ' time(s).'}}))
+            else
+                redis.call('RPUSH', KEYS[2], job_id)
+            end
+        end
+        return #expired
+    """
+    _heartbeat_script = """
+        if redis.call('HGET', ARGV[3] .. ARGV[1], 'worker') ~= ARGV[2] or not redis.call('ZSCORE', KEYS[1], ARGV[1]) then
+            return 0
+        end
+        redis.call('ZADD', KEYS[1], ARGV[4], ARGV[1])
+        return 1
+    """
+    _complete_script = """
+        if redis.call('HGET', ARGV[3] .. ARGV[1], 'worker') ~= ARGV[2] then return 0 end
+        redis.call('ZREM', KEYS[1], ARGV[1])
+        redis.call('HDEL', ARGV[3] .. ARGV[1], 'worker')
+        redis.call('RPUSH', KEYS[2], ARGV[4])
+        return 1
+    """
+    _cancel_script = """
+        if redis.call('LREM', KEYS[1], 1, ARGV[1]) == 0 then return 0 end
+        redis.call('DEL', ARGV[2] .. ARGV[1])
+        return 1
+    """
+
+    def __init__(self, url: str = job_broker_url, prefix: str = "talkerbot:jobs:", **kwargs):
+        super().__init__(**kwargs)
+        import redis.asyncio as redis
+
+        self.redis = redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self.queue_key, self.leases_key, self.results_key = prefix + "queue", prefix + "leases", prefix + "results"
+        self.job_prefix = prefix + "job:"
+        self._lease = self.redis.register_script(self._lease_script)
+        self._requeue = self.redis.register_script(self._requeue_script)
+        self._heartbeat = self.redis.register_script(self._heartbeat_script)
+        self._complete = self.redis.register_script(self._complete_script)
+        self._cancel = self.redis.register_script(self._cancel_script)
+
+
+    async def enqueue(self, job_id: str, kind: str, payload: dict) -> None:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self.job_prefix + job_id, mapping={'kind': kind, 'payload': json.dumps(payload), 'attempts': 0})
+            pipe.lpush(self.queue_key, job_id)
+            await pipe.execute()
+
+
+    async def lease(self, worker: str) -> dict:
+        now = time.time()
+        await self._requeue(
+            keys=[self.leases_key, self.queue_key, self.results_key], args=[now, self.max_attempts, self.job_prefix]
+        )
+        job = await self._lease(keys=[self.queue_key, self.leases_key], args=[worker, now + self.lease_seconds, self.job_prefix])
+        if not job:
+            return None
+        job_id, kind, payload, attempts = job
+        return {'id': job_id, 'kind': kind, 'payload': json.loads(payload), 'attempts': int(attempts)}
+
+
+    async def heartbeat(self, job_id: str, worker: str) -> bool:
+        extended = await self._heartbeat(
+            keys=[self.leases_key], args=[job_id, worker, self.job_prefix, time.time() + self.lease_seconds]
+        )
+        return bool(extended)
+
+
+    async def complete(self, job_id: str, worker: str, result: dict) -> bool:
+        stored = await self._complete(
+            keys=[self.leases_key, self.results_key],
+            args=[job_id, worker, self.job_prefix, json.dumps({'id': job_id, 'result': result})],
+        )
+        return bool(stored)
+
+
+    async def take_results(self) -> list:
+        entries = await self.redis.lpop(self.results_key, 100) or []
+        results = [(entry['id'], entry['result']) for entry in map(json.loads, entries)]
+        if results:
+            await self.redis.delete(*(self.job_prefix + job_id for job_id, _ in results))
+        return results
+
+
+    async def exists(self, job_id: str) -> bool:
+        return bool(await self.redis.exists(self.job_prefix + job_id))
+
+
+    async def cancel(self, job_id: str) -> bool:
+        removed = await self._cancel(keys=[self.queue_key], args=[job_id, self.job_prefix])
+        return bool(removed)
+
+
+    async def close(self) -> None:
+        await self.redis.aclose()
+
+
+def create_broker(kind: str = job_broker) -> JobBroker:
+    """Broker configured in `job_broker`, 'sqlite' or 'redis'."""
+    if kind == "sqlite":
+        return SqliteJobBroker()
+    if kind == "redis":
+        return RedisJobBroker()
+    raise ValueError(f"Unknown job broker {kind!r}, expected 'sqlite' or 'redis'.")
+
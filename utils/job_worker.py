@@ -0,0 +1,106 @@
+import os
+import socket
+import asyncio
+
+from config import render_workers, job_heartbeat_interval, job_poll_interval
+from utils.job_broker import JobBroker
+from utils.logging_config import setup_logging
+from utils.media_utils import animate
+from utils.render_worker import RenderWorkerPool
+from utils.voice_engine import VoiceConverter
+
+
+
+class JobWorker:
+    """
+    Render worker of the job broker: leases jobs, runs them on the local LivePortrait processes and voice model
+    and publishes the results for the bot. Sends a heartbeat for each running job, so the job goes to another
+    worker if this one dies.
+    """
+    def __init__(self, broker: JobBroker, concurrency: int = render_workers,
+                 heartbeat_interval: float = job_heartbeat_interval, poll_interval: float = job_poll_interval):
+        self.broker = broker
+        self.concurrency = concurrency
+        self.heartbeat_interval = heartbeat_interval
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        self.logger = setup_logging('JobWorker')
+        self._stopping = asyncio.Event()
+
+
+    def stop(self) -> None:
+        """Stops taking new jobs, running jobs are finished."""
+        self._stopping.set()
+
+
+    async def run(self) -> None:
+        workers = RenderWorkerPool()
+        workers.start()
+        VoiceConverter().start()
+        self.logger.info(f"Worker {self.worker_id} is taking jobs, {self.concurrency} at a time.")
+
+        slots = asyncio.Semaphore(self.concurrency)
+        running = set()
+        try:
+            while not self._stopping.is_set():
+                await slots.acquire()
+                try:
+                    job = await self.broker.lease(self.worker_id)
+                except Exception as e:
+                    self.logger.error(f"Failed to lease a job: {e}")
+                    job = None
+                if job is None:
+                    slots.release()
+                    try:
+                        await asyncio.wait_for(self._stopping.wait(), self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                task = asyncio.create_task(self._process(job))
+                running.add(task)
+                task.add_done_callback(running.discard)
+                task.add_done_callback(lambda _: slots.release())
+
+            if running:
+                await asyncio.wait(running)
+        finally:
+            workers.shutdown()
+            await self.broker.close()
+
+
+    async def _process(self, job: dict) -> None:
+        self.logger.info(f"Running {job['kind']} job {job['id']}, attempt {job['attempts']}.")
+        heartbeat = asyncio.create_task(self._heartbeat(job['id']))
+        try:
+            result = await self._execute(job['kind'], job['payload'])
+        except Exception as e:
+            self.logger.error(f"Job {job['id']} failed: {e}")
+            result = {'error': f"{type(e).__name__}: {e}"}
+        finally:
+            heartbeat.cancel()
+
+        try:
+            if not await self.broker.complete(job['id'], self.worker_id, result):
+                self.logger.warning(f"Job {job['id']} was handed to another worker, its result is dropped.")
+        except Exception as e:
+            self.logger.error(f"Failed to publish result of job {job['id']}: {e}")
+
+
+    async def _heartbeat(self, job_id: str) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                if not await self.broker.heartbeat(job_id, self.worker_id):
+                    self.logger.warning(f"Lost the lease of job {job_id}.")
+                    return
+            except Exception as e:
+                self.logger.error(f"Heartbeat of job {job_id} failed: {e}")
+
+
+    async def _execute(self, kind: str, payload: dict) -> dict:
+        if kind == 'animate':
+            return await animate(**payload)
+        if kind == 'precompute_voice':
+            return await VoiceConverter().precompute(payload['voice_path'])
+        return {'error': f"Unknown job kind {kind!r}."}
@@ -1,152 +1,506 @@
+import io
 import os
-import sys
+import json
+import asyncio
+import shutil
+import hashlib
 import subprocess
+import numpy as np
+from typing import Union
 from PIL import Image
 from pydub import AudioSegment
 
-from config import cleanup_user_data, inference_path, custom_voice_filename
+from config import cleanup_user_data, animations_path, custom_voice_filename, face_crop_scale, face_detect_timeout
+from utils.face_detector import FaceDetector
+from utils.file_cache import DrivingVideoCache, FaceCache, MotionTemplateCache, file_sha256
+from utils.logging_config import setup_logging
+from utils.metrics import timed
+from utils.render_worker import RenderWorkerPool
+from utils.voice_engine import VoiceConverter
 
 
+logger = setup_logging('MediaUtils')
 
-def get_center_crop(image_path: str) -> Image:
+
+
+async def run_process(*command: str, input: bytes = None, text: bool = True) -> subprocess.CompletedProcess:
+    """
+    Runs a command as an asyncio subprocess, so the event loop keeps serving other users meanwhile.
+
+    Args:
+        command: Program and its arguments
+        input: Bytes written to the process' stdin
+        text: Decode stdout and stderr, otherwise they are returned as bytes
+    Returns:
+        subprocess.CompletedProcess with stdout and stderr of the process
+    """
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdin=asyncio.subprocess.PIPE if input is not None else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    stdout, stderr = await process.communicate(input)
+    if text:
+        stdout, stderr = stdout.decode(errors="replace"), stderr.decode(errors="replace")
+    return subprocess.CompletedProcess(list(command), process.returncode, stdout, stderr)
+
+
+def _square_box(width: int, height: int, face: list = None) -> tuple:
+    """Square crop box around a face box, or in the center of the image if there is no face."""
+    if face is None:
+        side = min(width, height)
+        left, top = (width - side) // 2, (height - side) // 2
+        return left, top, left + side, top + side
+
+    face_left, face_top, face_right, face_bottom = face
+    side = int(min(max(face_right - face_left, face_bottom - face_top) * face_crop_scale, width, height))
+    center_x, center_y = (face_left + face_right) / 2, (face_top + face_bottom) / 2
+    left = int(min(max(center_x - side / 2, 0), width - side))
+    top = int(min(max(center_y - side / 2, 0), height - side))
+    return left, top, left + side, top + side
+
+
+def _center_crop(image: Union[str, bytes], face: list = None) -> Image:
+    with Image.open(io.BytesIO(image) if isinstance(image, (bytes, bytearray)) else image) as img:
+        return img.crop(_square_box(*img.size, face)).resize((480, 480))
+
+
+async def detect_face(image: bytes) -> list:
+    """
+    Finds the face on a reference image, the result is kept in FaceCache by hash of the image.
+
+    Args:
+        image: Content of the image file
+    Returns:
+        Face box [left, top, right, bottom], or None if there is no face or it couldn't be detected in time
+    """
+    cache = FaceCache()
+    key = hashlib.sha256(image).hexdigest()
+    cached = cache.get(key, '.json')
+    if cached:
+        with open(cached, 'r', encoding='utf-8') as f:
+            return json.load(f)['bbox']
+
+    with timed("face_detection") as stage:
+        try:
+            result = await asyncio.wait_for(FaceDetector().detect(image), face_detect_timeout)
+        except asyncio.TimeoutError:
+            result = {'error': f"Face detector didn't answer within {face_detect_timeout} sec."}
+        if result.get('error'):
+            stage.fail()
+            logger.warning(f"Face detection failed, using center crop: {result['error']}")
+            return None
+
+    meta_path = os.path.join(cache.path, key + '.json.tmp')
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump(result, f)
+    await asyncio.to_thread(cache.put, key, meta_path, '.json')
+    return result['bbox']
+
+
+def _save_center_crop(image: bytes, output_path: str, face: list = None) -> str:
+    cropped = _center_crop(image, face)
+    buffer = io.BytesIO()
+    cropped.save(buffer, format=Image.registered_extensions().get(os.path.splitext(output_path)[1].lower(), "JPEG"))
+    with open(output_path, 'wb') as f:
+        f.write(buffer.getbuffer())
+    return hashlib.sha256(buffer.getbuffer()).hexdigest()
+
+
+async def save_center_crop(image: bytes, output_path: str, face: list = None) -> str:
     """
-    Opens an image from the given path and returns a centered square crop.
-    
+    Decodes an image from memory, crops it to a square and writes it to disk in one go.
+
     Args:
-        Path to the image file
+        image: Content of the image file
+        output_path: Where to save the cropped image, format is taken from the extension
+        face: Face box [left, top, right, bottom] to center the crop on, the image center is used if None
     Returns:
-        A PIL Image object with the centered square crop
+        SHA-256 of the saved file
     """
-    with Image.open(image_path) as img:
-        width, height = img.size
-        min_dim = min(width, height)
+    with timed("crop"):
+        return await asyncio.to_thread(_save_center_crop, image, output_path, face)
+
 
-        left = (width - min_dim) // 2
-        top = (height - min_dim) // 2
-        right = left + min_dim
-        bottom = top + min_dim
+def _parse_rate(rate: str) -> float:
+    num, _, den = (rate or "0/1").partition("/")
+    try:
+        return float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return 0.0
 
-        return img.crop((left, top, right, bottom)).resize((480, 480))
-    
 
-def generate_video(source: str, driving: str) -> dict:
+async def probe_video(video_path: str) -> dict:
     """
-    Generates an animation by running LivePortrait inference script with the provided source and driving videos.
+    Reads properties of a video with ffprobe, without decoding it.
+
+    Args:
+        video_path: Path to the video file
+    Returns:
+        A dictionary with {'duration', 'width', 'height', 'fps', 'codec', 'has_audio'} on success
+        or {'error': error_message} on failure
+    """
+    with timed("probe") as stage:
+        result = await run_process(
+            "ffprobe", "-v", "error",
+            "-show_entries", "format=duration:stream=codec_type,codec_name,width,height,avg_frame_rate,r_frame_rate,duration",
+            "-of", "json", video_path
+        )
+    try:
+        if result.returncode != 0:
+            raise ValueError(result.stderr.strip())
+        info = json.loads(result.stdout)
+        streams = info.get("streams", [])
+        video = next(stream for stream in streams if stream.get("codec_type") == "video")
+        return {
+            'duration': float(info.get("format", {}).get("duration") or video.get("duration") or 0),
+            'width': int(video.get("width", 0)),
+            'height': int(video.get("height", 0)),
+            'fps': _parse_rate(video.get("avg_frame_rate")) or _parse_rate(video.get("r_frame_rate")),
+            'codec': video.get("codec_name", ""),
+            'has_audio': any(stream.get("codec_type") == "audio" for stream in streams),
+        }
+    except StopIteration:
+        stage.fail()
+        return {'error': "File has no video stream."}
+    except Exception as e:
+        stage.fail()
+        return {'error': "Failed to probe video. Error:\n" + str(e)}
+
+
+async def trim_video(video_path: str, duration: float) -> dict:
+    """
+    Cuts a video to its first `duration` seconds in place, streams are copied without re-encoding.
+
+    Returns:
+        A dictionary with either {'path': video_path} on success or {'error': error_message} on failure
+    """
+    tmp_path = f"{os.path.splitext(video_path)[0]}_trimmed{os.path.splitext(video_path)[1]}"
+    with timed("trim") as stage:
+        result = await run_process(
+            "ffmpeg", "-y", "-v", "error", "-i", video_path,
+            "-t", str(duration),
+            "-map", "0", "-c", "copy",
+            tmp_path
+        )
+    if result.returncode != 0:
+        stage.fail()
+        return {'error': "Failed to trim video. Error:\n" + result.stderr}
+
+    os.replace(tmp_path, video_path)
+    return {'path': video_path}
+
+
+async def normalize_video(video_path: str, output_path: str, size: int, fps: float = None) -> dict:
+    """
+    Transcodes a video in one fast ffmpeg pass, so its shorter side is at most `size` pixels
+    and its frame rate at most `fps`. Smaller videos are not upscaled, audio is copied as is.
+
+    Returns:
+        A dictionary with either {'path': output_path} on success or {'error': error_message} on failure
+    """
+    # Sides rounded down to even numbers, yuv420p can't encode odd ones
+    scale = f"scale='if(lte(iw,ih),trunc(min(iw,{size})/2)*2,-2)':'if(lte(iw,ih),-2,trunc(min(ih,{size})/2)*2)'"
+    filters = f"{scale},fps=fps={fps}" if fps else scale
+    with timed("normalize") as stage:
+        result = await run_process(
+            "ffmpeg", "-y", "-v", "error", "-i", video_path,
+            "-vf", filters,
+            "-c:v", "libx264", "-preset", "veryfast", "-crf", "18", "-pix_fmt", "yuv420p",
+            "-c:a", "copy",
+            output_path
+        )
+    if result.returncode != 0:
+        stage.fail()
+        return {'error': "Failed to normalize video. Error:\n" + result.stderr}
+
+    return {'path': output_path}
+
+
+async def prepare_driving_video(driving: str, driving_hash: str, size: int, fps: float = None) -> dict:
+    """
+    Normalises a driving video for rendering, reusing the result from DrivingVideoCache for the same clip.
+
+    Args:
+        driving: Path to the driving video
+        driving_hash: SHA-256 of the driving video
+        size: Max shorter side of the normalised video
+        fps: Max frame rate of the normalised video, None to keep the frame rate
+    Returns:
+        A dictionary with {'path': normalised_video, 'key': cache_key} on success or {'error': error_message} on failure,
+        the key identifies the normalised video in place of its content hash
+    """
+    cache = DrivingVideoCache()
+    key = cache.key(driving_hash, size, fps or 0)
+    output_path = f"{os.path.splitext(driving)[0]}_normalized.mp4"
+
+    cached = cache.get(key, '.mp4')
+    if cached:
+        await asyncio.to_thread(shutil.copyfile, cached, output_path)
+        return {'path': output_path, 'key': key}
+
+    result = await normalize_video(driving, output_path, size, fps)
+    if result.get('error'):
+        return result
+    await asyncio.to_thread(cache.put, key, output_path, '.mp4', False)
+    return {'path': output_path, 'key': key}
+
+
+async def generate_video(source: str, driving: str, driving_hash: str = None, cleanup: bool = cleanup_user_data) -> dict:
+    """
+    Generates an animation by submitting the provided source and driving videos to a LivePortrait worker.
+    Motion of a driving video is extracted once and reused from MotionTemplateCache for the same clip.
 
     Args:
         source: Path to the reference image
         driving: Path to the driving video
+        driving_hash: Key of the driving video in MotionTemplateCache, its SHA-256 computed if not given
+        cleanup: Delete source and driving files afterwards
     Returns:
         A dictionary with either {'path': animation_path} on success or {'error': error_message} on failure
     """
-    result = subprocess.run(
-        [sys.executable, inference_path, "--source", source, "--driving", driving, "--flag_crop_driving_video"],
-        capture_output=True, text=True
-    )
-    if result.returncode != 0:
-        return {'error': "Failed to generate animation. Error:\n" + result.stderr}
+    motion_cache = MotionTemplateCache()
+    driving_hash = driving_hash or await asyncio.to_thread(file_sha256, driving)
+    template = motion_cache.get(driving_hash, '.pkl')
+
+    with timed("render", template=bool(template)) as stage:
+        result = await RenderWorkerPool().render(source, template or driving, animations_path)
+    if result.get('error'):
+        stage.fail()
+        return {'error': "Failed to generate animation. Error:\n" + result['error']}
 
-    p1 = os.path.splitext(os.path.basename(source))[0]
-    p2 = os.path.splitext(os.path.basename(driving))[0]
-    animation_path = f'./animations/{p1}--{p2}.mp4'
+    animation_path = result['path']
     if not os.path.exists(animation_path):
         return {'error': "Animation output not found. Something went wrong."}
-    
-    if cleanup_user_data:
+
+    if template:
+        # Animations driven by a template have no sound, take it from the driving video
+        with_audio = await copy_audio(animation_path, driving)
+        if with_audio.get('error'):
+            return with_audio
+    else:
+        template = f"{os.path.splitext(driving)[0]}.pkl"
+        if os.path.exists(template):
+            await asyncio.to_thread(motion_cache.put, driving_hash, template)
+
+    if cleanup:
         os.remove(source)
         os.remove(driving)
-        os.remove(f"{os.path.splitext(driving)[0]}.pkl")
 
     return {'path': animation_path}
 
 
-def convert_voice_tts(source: str, driving: str) -> dict:
+async def _ignore_stage(stage: str, **artifacts) -> None:
+    pass
+
+
+def _save_voice(converted: dict, output_path: str) -> str:
+    np.savez(output_path, audio=converted['audio'], sample_rate=converted['sample_rate'])
+    return output_path
+
+
+def _load_voice(voice_path: str) -> dict:
+    with np.load(voice_path) as data:
+        return {'audio': data['audio'], 'sample_rate': int(data['sample_rate'])}
+
+
+async def animate(source: str, driving: str, driving_key: str = None, voice: str = None,
+                  on_voice_wait=None, on_stage=None, artifacts: dict = None) -> dict:
     """
-    Generates an audio by running TTS inference script with the provided source and driving audios.
+    Renders an animation and gives it the target voice. The voice is converted from the driving video's
+    audio while LivePortrait renders. Source and driving files are kept.
 
     Args:
-        source: Path to the reference audio
-        driving: Path to the driving audio
+        source: Path to the reference image
+        driving: Path to the driving video
+        driving_key: Key of the driving video in MotionTemplateCache, its SHA-256 computed if not given
+        voice: Path to a sample of the target voice, None keeps the voice of the driving video
+        on_voice_wait: Coroutine function awaited when the animation is ready before the voice
+        on_stage: Coroutine function awaited as `on_stage(stage, **artifacts)` when the animation is rendered
+            ('voice', animation_path=...) and when the voice is converted ('muxing', voice_path=...)
+        artifacts: Artifacts of an interrupted earlier run with the same arguments, stages they belong to are skipped
+    Returns:
+        A dictionary with {'path': animation_path}, plus 'partial': True if the voice couldn't be replaced,
+        or {'error': error_message} on failure
+    """
+    artifacts = artifacts or {}
+    on_stage = on_stage or _ignore_stage
+    animation_path, voice_path = artifacts.get('animation_path'), artifacts.get('voice_path')
+    animation_path = animation_path if animation_path and os.path.exists(animation_path) else None
+    voice_path = voice_path if voice_path and os.path.exists(voice_path) else None
+
+    voice_task = asyncio.create_task(convert_voice(driving, voice)) if voice and not voice_path else None
+    try:
+        if not animation_path:
+            result = await generate_video(source, driving, driving_key, cleanup=False)
+            if result.get('error') or not voice:
+                return result
+            animation_path = result['path']
+            await on_stage('voice', animation_path=animation_path)
+        elif not voice:
+            return {'path': animation_path}
+
+        if voice_task:
+            if not voice_task.done() and on_voice_wait:
+                await on_voice_wait()
+            converted = await voice_task
+            if converted.get('error'):
+                print(f'Failed to convert voice: {converted["error"]}')
+                return {'path': animation_path, 'partial': True}
+            voice_path = await asyncio.to_thread(_save_voice, converted, f"{os.path.splitext(animation_path)[0]}_voice.npz")
+            await on_stage('muxing', voice_path=voice_path)
+        else:
+            converted = await asyncio.to_thread(_load_voice, voice_path)
+
+        new_video_path = await replace_voice_with_ffmpeg(animation_path, converted)
+        if not new_video_path:
+            return {'path': animation_path, 'partial': True}
+        os.remove(voice_path)
+        return {'path': new_video_path}
+
+    finally:
+        if voice_task and not voice_task.done():
+            voice_task.cancel()
+
+
+async def copy_audio(video_path: str, audio_source: str) -> dict:
+    """
+    Adds the audio track of `audio_source` to a video in place, the video stream is copied as is.
+    A video is left unchanged if `audio_source` has no audio.
+
     Returns:
-        A dictionary with either {'path': voice_path} on success or {'error': error_message} on failure
-    """
-    p1 = os.path.splitext(os.path.basename(source))[0]
-    p2 = os.path.splitext(os.path.basename(driving))[0]
-    voice_path = f"./animations/{p1}-to-{p2}.wav"
-
-    command = [
-        "tts",
-        "--out_path", voice_path,
-        "--model_name", "voice_conversion_models/multilingual/vctk/freevc24",
-        "--source_wav", source,
-        "--target_wav", driving,
-        "--use_cuda", "False"
-    ]
-    
-    result = subprocess.run(command, capture_output=True, text=True)
+        A dictionary with either {'path': video_path} on success or {'error': error_message} on failure
+    """
+    tmp_path = f"{os.path.splitext(video_path)[0]}_with_audio.mp4"
+    result = await run_process(
+        "ffmpeg", "-y", "-i", video_path, "-i", audio_source,
+        "-map", "0:v:0", "-map", "1:a:0?",
+        "-c:v", "copy", "-c:a", "aac",
+        "-shortest",
+        tmp_path
+    )
     if result.returncode != 0:
-        return {'error': "Failed to convert voice. Error:\n" + result.stderr}
+        return {'error': "Failed to add audio to animation. Error:\n" + result.stderr}
+
+    os.replace(tmp_path, video_path)
+    return {'path': video_path}
 
-    return {'path': voice_path}
 
+def _export_wav(input_file: str, output_file: str) -> None:
+    audio = AudioSegment.from_file(input_file)
+    audio.export(output_file, format="wav")
 
-def convert_to_wav(input_file) -> dict:
+
+async def convert_to_wav(input_file) -> dict:
     output_file = os.path.join(os.path.dirname(input_file), custom_voice_filename)
     try:
-        audio = AudioSegment.from_file(input_file)
-        audio.export(output_file, format="wav")
+        await asyncio.to_thread(_export_wav, input_file, output_file)
         return {'path': output_file}
     except Exception as e:
-        return {'error': "Failed to convert audio to wav format. Error:\n" + e}
-    
+        return {'error': "Failed to convert audio to wav format. Error:\n" + str(e)}
+
 
 
-def replace_voice_with_ffmpeg(video_path: str, target_voice: str, username: str) -> str:
+async def extract_audio(video_path: str, sample_rate: int) -> dict:
     """
-    Replace the audio in a video with a converted voice.
-    
+    Decodes the audio track of a video straight into memory through an ffmpeg pipe.
+
     Args:
-        video_path: Path to the input video file
-        target_voice: Target voice style for conversion
-        username: Username for file naming
-        
+        video_path: Path to the video file
+        sample_rate: Sample rate of the decoded audio
     Returns:
-        Path to the new video file with replaced audio
+        A dictionary with either {'audio': mono float32 samples} on success or {'error': error_message} on failure
     """
-    orig_audio_path = os.path.join("./animations", f"{username}_orig_video_audio.wav")
-
-    try:
-        # Extract audio from video
-        subprocess.run([
-            "ffmpeg", "-y", "-i", video_path,
+    with timed("audio_extraction") as stage:
+        result = await run_process(
+            "ffmpeg", "-v", "error", "-i", video_path,
             "-vn",  # no video
-            "-acodec", "pcm_s16le",
-            orig_audio_path
-        ], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-        # Convert voice
-        converted = convert_voice_tts(orig_audio_path, target_voice)
-        if converted.get("error"):
-            print(f'Failed to convert voice: {converted.get("error", "Unknown error")}')
-            return
-
-        new_video_path = os.path.join(os.path.dirname(video_path), "new_" + os.path.basename(video_path))
-        # Replace audio in video
-        subprocess.run([
-            "ffmpeg", "-y", "-i", video_path,
-            "-i", converted["path"],
+            "-ac", "1", "-ar", str(sample_rate),
+            "-f", "f32le", "pipe:1",
+            text=False
+        )
+    if result.returncode != 0:
+        stage.fail()
+        return {'error': "Failed to extract audio. Error:\n" + result.stderr.decode(errors="replace")}
+    if not result.stdout:
+        return {'error': "Video has no audio."}
+
+    return {'audio': np.frombuffer(result.stdout, dtype=np.float32).copy()}
+
+
+async def mux_audio(video_path: str, audio: np.ndarray, sample_rate: int, output_path: str) -> dict:
+    """
+    Writes a copy of a video with its audio replaced by `audio`, which is piped into ffmpeg from memory.
+
+    Returns:
+        A dictionary with either {'path': output_path} on success or {'error': error_message} on failure
+    """
+    with timed("remux") as stage:
+        result = await run_process(
+            "ffmpeg", "-y", "-v", "error", "-i", video_path,
+            "-f", "f32le", "-ac", "1", "-ar", str(sample_rate), "-i", "pipe:0",
             "-c:v", "copy",  # copy video stream
             "-map", "0:v:0",  # use original video
             "-map", "1:a:0",  # use new audio
+            "-c:a", "aac",
             "-shortest",  # trim output to shortest stream (prevent silence at end)
-            new_video_path
-        ], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            output_path,
+            input=audio.astype(np.float32).tobytes()
+        )
+    if result.returncode != 0:
+        stage.fail()
+        return {'error': "Failed to replace audio. Error:\n" + result.stderr}
 
-        return new_video_path
-    
-    except subprocess.CalledProcessError as e:
-        print(f"FFmpeg process error: {e.stderr.decode() if e.stderr else str(e)}")
-        return None
+    return {'path': output_path}
+
+
+async def convert_voice(video_path: str, target_voice: str) -> dict:
+    """
+    Converts speech from a video's audio track to the target voice, in memory.
+
+    Args:
+        video_path: Path to the video with the speech, e.g. a driving video
+        target_voice: Path to a sample of the target voice
+    Returns:
+        A dictionary with either {'audio': samples, 'sample_rate': rate} on success or {'error': error_message} on failure
+    """
+    converter = VoiceConverter()
+    try:
+        await converter.ready()
     except Exception as e:
-        print(f"Error replacing voice: {str(e)}")
-        return None
\ No newline at end of file
+        return {'error': f"Voice conversion model is not available: {str(e)}"}
+
+    orig_audio = await extract_audio(video_path, converter.input_sample_rate)
+    if orig_audio.get("error"):
+        return orig_audio
+
+    with timed("voice_conversion") as stage:
+        converted = await converter.convert(orig_audio["audio"], target_voice)
+    if converted.get("error"):
+        stage.fail()
+    return converted
+
+
+async def replace_voice_with_ffmpeg(video_path: str, converted: dict) -> str:
+    """
+    Replace the audio in a video with a converted voice.
+
+    Args:
+        video_path: Path to the input video file
+        converted: Result of `convert_voice`
+
+    Returns:
+        Path to the new video file with replaced audio
+    """
+    if converted.get("error"):
+        print(f'Failed to convert voice: {converted["error"]}')
+        return None
+
+    new_video_path = os.path.join(os.path.dirname(video_path), "new_" + os.path.basename(video_path))
+    result = await mux_audio(video_path, converted["audio"], converted["sample_rate"], new_video_path)
+    if result.get("error"):
+        print(f'FFmpeg process error: {result["error"]}')
+        return None
+
+    return new_video_path
@@ -0,0 +1,178 @@
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+from utils.logging_config import setup_logging
+
+
+logger = setup_logging('Metrics')
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+
+class Metric:
+    """Base of a metric exported in Prometheus text format, values are kept per label set."""
+    type = None
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+
+    def samples(self) -> list:
+        with self._lock:
+            return [(self.name, labels, value) for labels, value in sorted(self._values.items())]
+
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines += [f"{name}{_format_labels(labels)} {value}" for name, labels, value in self.samples()]
+        return "\n".join(lines)
+
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = buckets
+        self._listeners = []
+
+
+    def add_listener(self, listener: Callable[..., None]) -> None:
+        """Calls `listener(value, **labels)` on every observation, e.g. to collect raw samples in benchmarks."""
+        self._listeners.append(listener)
+
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts, total, count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            counts = [c + (value <= bound) for c, bound in zip(counts, self.buckets)]
+            self._values[key] = (counts, total + value, count + 1)
+        for listener in self._listeners:
+            listener(value, **labels)
+
+
+    def samples(self) -> list:
+        samples = []
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    samples.append((f"{self.name}_bucket", labels + (("le", bound),), bucket_count))
+                samples.append((f"{self.name}_bucket", labels + (("le", "+Inf"),), count))
+                samples.append((f"{self.name}_sum", labels, total))
+                samples.append((f"{self.name}_count", labels, count))
+        return samples
+
+
+REGISTRY: list[Metric] = []
+
+STAGE_SECONDS = Histogram("talkerbot_stage_seconds", "Duration of request processing stages.")
+STAGE_FAILURES = Counter("talkerbot_stage_failures_total", "Failed request processing stages.")
+CACHE_REQUESTS = Counter("talkerbot_cache_requests_total", "Cache lookups by cache and result.")
+QUEUE_DEPTH = Gauge("talkerbot_render_queue_depth", "Render jobs waiting for a slot.")
+ACTIVE_RENDERS = Gauge("talkerbot_active_renders", "Render jobs being processed.")
+
+
+def render_metrics() -> str:
+    """Returns all metrics in Prometheus text exposition format."""
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+
+class StageTimer:
+    """
+    Context manager timing a processing stage.
+
+    The duration goes to STAGE_SECONDS and to the log as structured fields. A stage counts as failed
+    if it raised or if `fail()` was called, e.g. for functions reporting errors as {'error': ...}.
+    """
+    def __init__(self, stage: str, **fields):
+        self.stage = stage
+        self.fields = fields
+        self.failed = False
+
+
+    def fail(self) -> None:
+        self.failed = True
+
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self._start
+        failed = self.failed or exc_type is not None
+        STAGE_SECONDS.observe(duration, stage=self.stage)
+        if failed:
+            STAGE_FAILURES.inc(stage=self.stage)
+
+        fields = {'stage': self.stage, 'duration': f"{duration:.3f}", 'status': "failed" if failed else "ok", **self.fields}
+        logger.info(" ".join(f"{key}={value}" for key, value in fields.items()))
+        return False
+
+
+def timed(stage: str, **fields) -> StageTimer:
+    """Times a stage: `with timed('render', username=username) as stage: ...`"""
+    return StageTimer(stage, **fields)
+
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(host: str, port: int) -> ThreadingHTTPServer:
+    """Serves /metrics from a background thread."""
+    server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
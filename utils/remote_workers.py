@@ -0,0 +1,121 @@
+import uuid
+import asyncio
+
+from config import job_poll_interval, job_queue_timeout, job_timeout
+from utils.job_broker import JobBroker, create_broker
+from utils.logging_config import setup_logging
+from utils.singleton import singleton
+
+
+
+@singleton
+class RemoteWorkers:
+    """
+    Bot side of the job broker: work of the render workers is submitted as jobs and awaited like local calls.
+
+    Results are collected by a single polling task, which runs only while there are jobs to wait for.
+    Files are passed by path, so the bot and the workers must share `storage/` and `animations/`.
+    A job fails if no worker takes it within `queue_timeout` seconds or it isn't finished within `timeout`.
+    """
+    def __init__(self, broker: JobBroker = None, poll_interval: float = job_poll_interval,
+                 queue_timeout: float = job_queue_timeout, timeout: float = job_timeout):
+        self.broker = broker or create_broker()
+        self.poll_interval = poll_interval
+        self.queue_timeout = queue_timeout
+        self.timeout = timeout
+        self.logger = setup_logging('RemoteWorkers')
+        self._pending = {}  # job id -> future
+        self._poller = None
+
+
+    def _start_polling(self) -> None:
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.create_task(self._poll())
+
+
+    async def _submit(self, kind: str, payload: dict, job_id: str = None) -> dict:
+        job_id = job_id or uuid.uuid4().hex
+        future = self._pending.get(job_id)  # a job resumed after a restart is already in the broker
+        try:
+            if future is None:
+                future = asyncio.get_running_loop().create_future()
+                self._pending[job_id] = future  # before enqueueing, a fast worker may finish it before we get control back
+                await self.broker.enqueue(job_id, kind, payload)
+                self._start_polling()
+            return await self._wait(job_id, kind, future)
+        except Exception as e:
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            return {'error': f"Failed to submit a {kind} job: {e}"}
+        finally:
+            self._pending.pop(job_id, None)
+
+
+    async def _wait(self, job_id: str, kind: str, future: asyncio.Future) -> dict:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            # Removing it fails if a worker took it meanwhile, then it still gets until the deadline
+            if await self.broker.cancel(job_id):
+                self.logger.warning(f"No worker took {kind} job {job_id} within {self.queue_timeout} seconds.")
+                return {'error': f"No worker took the {kind} job within {self.queue_timeout} seconds."}
+        try:
+            return await asyncio.wait_for(future, deadline - loop.time())
+        except asyncio.TimeoutError:
+            self.logger.warning(f"{kind} job {job_id} didn't finish within {self.timeout} seconds.")
+            return {'error': f"The {kind} job didn't finish within {self.timeout} seconds."}
+
+
+    async def _poll(self) -> None:
+        while not all(future.done() for future in self._pending.values()):
+            try:
+                results = await self.broker.take_results()
+            except Exception as e:
+                self.logger.error(f"Failed to fetch job results: {e}")
+                results = []
+            for job_id, result in results:
+                future = self._pending.get(job_id)  # removed by whoever awaits it, a resumed job may not be awaited yet
+                if future is None:
+                    self.logger.info(f"Dropped result of job {job_id}, nobody waits for it anymore.")
+                elif not future.done():
+                    future.set_result(result)
+            await asyncio.sleep(self.poll_interval)
+
+
+    async def resume(self, job_id: str) -> bool:
+        """
+        Collects the result of a job submitted before a restart, until it's awaited by submitting it again with `job_id`.
+
+        Returns:
+            False if the broker doesn't have the job anymore and it has to be submitted anew
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending[job_id] = future  # before checking, the result may be taken meanwhile
+        self._start_polling()
+        try:
+            exists = await self.broker.exists(job_id)
+        except Exception as e:
+            self.logger.error(f"Failed to look up job {job_id}: {e}")
+            exists = False
+        if not exists and not future.done():
+            del self._pending[job_id]
+            return False
+        return True
+
+
+    async def animate(self, source: str, driving: str, driving_key: str = None, voice: str = None, job_id: str = None) -> dict:
+        """Same as `media_utils.animate`, run by a worker. `job_id` names the job, e.g. to wait for it again after a restart."""
+        return await self._submit(
+            'animate', {'source': source, 'driving': driving, 'driving_key': driving_key, 'voice': voice}, job_id
+        )
+
+
+    async def precompute(self, voice_path: str) -> dict:
+        """Same as `VoiceConverter.precompute`, run by a worker."""
+        return await self._submit('precompute_voice', {'voice_path': voice_path})
+
+
+    async def close(self) -> None:
+        await self.broker.close()
@@ -0,0 +1,158 @@
+import math
+import time
+import asyncio
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable
+
+from config import render_slots, max_queued_renders, max_queued_renders_per_user, render_frames_per_second
+from utils.logging_config import setup_logging
+from utils.metrics import ACTIVE_RENDERS, QUEUE_DEPTH, STAGE_SECONDS
+from utils.singleton import singleton
+
+
+
+class RenderJob:
+    def __init__(self, username: str, run: Callable[[], Awaitable], frames: int = 0):
+        self.username = username
+        self.run = run
+        self.frames = frames
+        self.submitted = time.perf_counter()
+
+
+
+@singleton
+class RenderScheduler:
+    """
+    Bounded render queue shared by all users.
+
+    At most `slots` jobs run at once. Waiting jobs are kept per user and served round-robin,
+    so a user with many uploads doesn't starve the others. Render throughput in frames per second
+    and job duration are tracked as moving averages of finished jobs to estimate waiting times.
+    """
+    smoothing = 0.3  # Weight of the latest job in the moving averages
+
+    def __init__(self, slots: int = render_slots, max_queued: int = max_queued_renders, max_per_user: int = max_queued_renders_per_user):
+        self.slots = slots
+        self.max_queued = max_queued
+        self.max_per_user = max_per_user
+        self.logger = setup_logging('RenderScheduler')
+        self._queues: OrderedDict[str, deque[RenderJob]] = OrderedDict()
+        self._queued = 0
+        self._active = 0
+        self._running = set()  # tasks of the active jobs, referenced until they finish
+        self.frames_per_second = render_frames_per_second
+        self.job_seconds = None
+        self._update_gauges()
+
+
+    def _update_gauges(self) -> None:
+        # Set on the event loop, the metrics server thread must not read the queues while they change
+        QUEUE_DEPTH.set(self._queued)
+        ACTIVE_RENDERS.set(self._active)
+
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+
+    def submit(self, username: str, run: Callable[[], Awaitable], frames: int = 0, check_limits: bool = True) -> dict:
+        """
+        Puts a render job in the queue.
+
+        Args:
+            username: Owner of the job, used for fairness and per-user limits
+            run: Coroutine function doing the actual work
+            frames: Number of frames the job renders, used for time estimates
+            check_limits: Reject the job when the queue is full, off for jobs accepted before a restart
+        Returns:
+            A dictionary with {'position': position, 'estimate': seconds} on success, where
+            position is 0 when the job started right away and estimate is the expected time until it's done,
+            or {'error': 'queue_full' | 'too_many_jobs'} when the job was rejected
+        """
+        user_jobs = self._queues.get(username, ())
+        if check_limits and len(user_jobs) >= self.max_per_user:
+            return {'error': 'too_many_jobs'}
+        if check_limits and self.queued >= self.max_queued:
+            self.logger.warning(f"Render queue is full, rejected a job from {username}.")
+            return {'error': 'queue_full'}
+
+        job = RenderJob(username, run, frames)
+        self._queues.setdefault(username, deque()).append(job)
+        self._queued += 1
+        self._dispatch()
+        position = self.position(job)
+        return {'position': position, 'estimate': self.estimate(frames, position)}
+
+
+    def estimate(self, frames: int, position: int = 0) -> float:
+        """Expected seconds until a job of `frames` frames at `position` in the queue is rendered."""
+        render = frames / self.frames_per_second
+        if not position:
+            return render
+        wait = math.ceil(position / self.slots) * (self.job_seconds or render)
+        return wait + render
+
+
+    def _observe(self, job: RenderJob, seconds: float) -> None:
+        if job.frames and seconds > 0:
+            self.frames_per_second += self.smoothing * (job.frames / seconds - self.frames_per_second)
+        self.job_seconds = seconds if self.job_seconds is None else self.job_seconds + self.smoothing * (seconds - self.job_seconds)
+
+
+    def position(self, job: RenderJob) -> int:
+        """Returns 1-based position of a waiting job in round-robin order, 0 if it's not waiting."""
+        user_jobs = self._queues.get(job.username)
+        if not user_jobs or job not in user_jobs:
+            return 0
+
+        index = user_jobs.index(job)
+        position = 1 + index  # the user's own earlier jobs go first
+        for username, jobs in self._queues.items():
+            if username == job.username:
+                break
+            position += min(len(jobs), index + 1)
+        for username, jobs in reversed(self._queues.items()):
+            if username == job.username:
+                break
+            position += min(len(jobs), index)
+        return position
+
+
+    def _next_job(self) -> RenderJob:
+        username, jobs = next(iter(self._queues.items()))
+        job = jobs.popleft()
+        self._queued -= 1
+        del self._queues[username]
+        if jobs:
+            self._queues[username] = jobs  # move user to the end of the rotation
+        return job
+
+
+    def _dispatch(self) -> None:
+        while self._active < self.slots and self._queues:
+            job = self._next_job()
+            self._active += 1
+            task = asyncio.create_task(self._run(job))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+        self._update_gauges()
+
+
+    async def _run(self, job: RenderJob) -> None:
+        STAGE_SECONDS.observe(time.perf_counter() - job.submitted, stage="queue_wait")
+        started = time.perf_counter()
+        try:
+            result = await job.run()
+            if result:
+                self._observe(job, time.perf_counter() - started)
+        except Exception as e:
+            self.logger.error(f"Render job of {job.username} failed: {e}")
+        finally:
+            self._active -= 1
+            self._dispatch()
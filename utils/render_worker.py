@@ -0,0 +1,191 @@
+import os
+import sys
+import pickle
+import asyncio
+import hashlib
+import traceback
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from config import liveportrait_path, render_workers, render_worker_max_jobs
+from utils.file_cache import SourceCache
+from utils.logging_config import setup_logging
+from utils.singleton import singleton
+
+
+# State of a single worker process, filled once by `_init_worker`
+_pipeline = None
+_argument_config = None
+_source_crops = OrderedDict()  # Recently prepared reference images of this worker
+_source_crops_size = 16
+
+
+def _partial_fields(target_class, kwargs: dict):
+    return target_class(**{k: v for k, v in kwargs.items() if hasattr(target_class, k)})
+
+
+def _init_worker(liveportrait_dir: str) -> None:
+    """
+    Loads LivePortrait pipeline with its checkpoints once per worker process.
+    Mirrors what LivePortrait/inference.py does before rendering.
+    """
+    global _pipeline, _argument_config
+
+    sys.path.insert(0, os.path.abspath(liveportrait_dir))
+    from src.config.argument_config import ArgumentConfig
+    from src.config.crop_config import CropConfig
+    from src.config.inference_config import InferenceConfig
+    from src.live_portrait_pipeline import LivePortraitPipeline
+
+    args = ArgumentConfig(flag_crop_driving_video=True)
+    _pipeline = LivePortraitPipeline(
+        inference_cfg=_partial_fields(InferenceConfig, args.__dict__),
+        crop_cfg=_partial_fields(CropConfig, args.__dict__),
+    )
+    _argument_config = ArgumentConfig
+    _pipeline.cropper.crop_source_image = _memoize_source_crop(_pipeline.cropper.crop_source_image)
+
+
+def _memoize_source_crop(crop_source_image):
+    """
+    Wraps the cropper, so face detection and landmarks of a reference image are computed once.
+    Results are kept in the worker's memory and in SourceCache, which outlives worker restarts.
+    """
+    def crop(img_rgb, crop_cfg):
+        key = hashlib.sha256(img_rgb.tobytes()).hexdigest()
+        if key in _source_crops:
+            _source_crops.move_to_end(key)
+            return _source_crops[key]
+
+        cache = SourceCache()
+        cached = cache.get(key, '.pkl')
+        if cached:
+            with open(cached, 'rb') as f:
+                crop_info = pickle.load(f)
+        else:
+            crop_info = crop_source_image(img_rgb, crop_cfg)
+            if crop_info is None:
+                return None
+            tmp_path = os.path.join(cache.path, f"{key}.{os.getpid()}.tmp")
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(crop_info, f)
+            cache.put(key, tmp_path, '.pkl')
+
+        _source_crops[key] = crop_info
+        if len(_source_crops) > _source_crops_size:
+            _source_crops.popitem(last=False)
+        return crop_info
+    return crop
+
+
+def _ping() -> int:
+    """No-op job used to spawn workers and load the pipeline ahead of the first request."""
+    return os.getpid()
+
+
+def _render(source: str, driving: str, output_dir: str) -> dict:
+    """Runs one animation inside the worker process."""
+    args = _argument_config(source=source, driving=driving, output_dir=output_dir, flag_crop_driving_video=True)
+    try:
+        animation_path, _ = _pipeline.execute(args)
+    except Exception:
+        return {'error': traceback.format_exc()}
+    return {'path': animation_path}
+
+
+
+class _Worker:
+    """A LivePortrait process in an executor of its own, so its animations can be counted."""
+    def __init__(self):
+        self.executor = None
+        self.renders = 0  # animations since the process started
+        self.running = 0
+
+
+
+@singleton
+class RenderWorkerPool:
+    """
+    Pool of long-lived processes with LivePortrait pipeline loaded in memory.
+
+    Jobs are sent to the workers over the executor's pipes, so interpreter start, torch import
+    and checkpoint loading are paid once per worker instead of once per animation.
+    Each worker runs in an executor of its own and gets jobs when it has the fewest running.
+    A worker is replaced once idle after `max_jobs` animations, warm-up jobs don't count,
+    and a crashed worker is replaced on its next job.
+    """
+    def __init__(self, workers: int = render_workers, max_jobs: int = render_worker_max_jobs):
+        self.workers = workers
+        self.max_jobs = max_jobs
+        self.logger = setup_logging('RenderWorkerPool')
+        self._workers = [_Worker() for _ in range(workers)]
+
+
+    def _get_executor(self, worker: _Worker) -> ProcessPoolExecutor:
+        if worker.executor is None:
+            worker.executor = ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(liveportrait_path,),
+            )
+            worker.renders = 0
+            # The initializer only runs with the first task, a ping starts loading the pipeline now
+            worker.executor.submit(_ping)
+        return worker.executor
+
+
+    def _replace(self, worker: _Worker) -> None:
+        """Drops the worker's executor and starts a fresh one."""
+        if worker.executor is not None:
+            worker.executor.shutdown(wait=False, cancel_futures=True)
+            worker.executor = None
+        self._get_executor(worker)
+
+
+    def start(self) -> None:
+        """Spawns every worker process, each loads its LivePortrait pipeline in the background."""
+        for worker in self._workers:
+            self._get_executor(worker)
+        self.logger.info(f"Started {self.workers} LivePortrait worker(s).")
+
+
+    def _submit(self, worker: _Worker, func, *args) -> Future:
+        try:
+            return self._get_executor(worker).submit(func, *args)
+        except BrokenProcessPool:
+            self.logger.warning("LivePortrait worker crashed, restarting it.")
+            self._replace(worker)
+            return worker.executor.submit(func, *args)
+
+
+    async def _run(self, func, *args, render: bool = False) -> dict:
+        worker = min(self._workers, key=lambda w: w.running)
+        worker.running += 1
+        try:
+            result = await asyncio.wrap_future(self._submit(worker, func, *args))
+            worker.renders += render
+            return result
+        except BrokenProcessPool as e:
+            self.logger.warning("LivePortrait worker crashed, restarting it.")
+            self._replace(worker)
+            return {'error': f"LivePortrait worker died: {e}"}
+        finally:
+            worker.running -= 1
+            if worker.renders >= self.max_jobs and not worker.running and worker.executor is not None:
+                self.logger.info(f"Replacing a LivePortrait worker after {worker.renders} animations.")
+                self._replace(worker)
+
+
+    async def render(self, source: str, driving: str, output_dir: str) -> dict:
+        """Submits an animation job and awaits its result without blocking the event loop."""
+        return await self._run(_render, source, driving, output_dir, render=True)
+
+
+    def shutdown(self) -> None:
+        for worker in self._workers:
+            if worker.executor is not None:
+                worker.executor.shutdown(wait=True, cancel_futures=True)
+                worker.executor = None
@@ -4,4 +4,5 @@ def singleton(cls):
         if cls not in instances:
             instances[cls] = cls(*args, **kwargs)
         return instances[cls]
+    get_instance.__wrapped__ = cls  # the class itself, e.g. for separate instances in tests
     return get_instance
\ No newline at end of file
@@ -0,0 +1,173 @@
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union
+
+import numpy as np
+
+from config import voice_model_name, voice_use_cuda, stock_voice_files
+from utils.file_cache import SpeakerCache, file_sha256
+from utils.logging_config import setup_logging
+from utils.singleton import singleton
+
+
+Audio = Union[str, np.ndarray]
+
+
+
+@singleton
+class VoiceConverter:
+    """
+    FreeVC voice conversion model kept in memory for the life of the process.
+
+    All model calls run one at a time on a dedicated thread, so the event loop is never blocked
+    and the model isn't used concurrently. Audio is accepted as a path or as a mono float32 array
+    sampled at `input_sample_rate`.
+
+    Features of target voices are computed once per voice file and kept in SpeakerCache,
+    so a conversion only has to process the source speech.
+    """
+    def __init__(self, model_name: str = voice_model_name, use_cuda: bool = voice_use_cuda):
+        self.model_name = model_name
+        self.use_cuda = use_cuda
+        self.logger = setup_logging('VoiceConverter')
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='voice-converter')
+        self._tts = None
+        self._speakers = {}  # voice path -> (mtime, size, features)
+
+
+    def _load(self):
+        if self._tts is None:
+            from TTS.api import TTS
+
+            self.logger.info(f"Loading voice conversion model {self.model_name}.")
+            self._tts = TTS(model_name=self.model_name, progress_bar=False).to("cuda" if self.use_cuda else "cpu")
+        return self._tts
+
+
+    @property
+    def model(self):
+        return self._load().voice_converter.vc_model
+
+
+    @property
+    def input_sample_rate(self) -> int:
+        return self.model.config.audio.input_sample_rate
+
+
+    @property
+    def output_sample_rate(self) -> int:
+        return self.model.config.audio.output_sample_rate
+
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+
+    def _warmup(self) -> None:
+        self._load()
+        for voice_path in stock_voice_files:
+            self._voice_features(voice_path)
+
+
+    def start(self) -> None:
+        """Queues loading of the model and stock voice features on the converter thread."""
+        self._executor.submit(self._warmup)
+
+
+    async def ready(self) -> None:
+        """Waits until the model is loaded, after that its properties can be read from the event loop."""
+        await self._run(self._load)
+
+
+    def _speaker_features(self, target: Audio) -> np.ndarray:
+        """Mirrors the target voice part of FreeVC.voice_conversion."""
+        import librosa
+        import torch
+
+        model = self.model
+        wav = model.load_audio(target).cpu().numpy()
+        wav, _ = librosa.effects.trim(wav, top_db=20)
+        if model.config.model_args.use_spk:
+            return model.enc_spk_ex.embed_utterance(wav)
+
+        from TTS.vc.modules.freevc.mel_processing import mel_spectrogram_torch
+
+        audio = model.config.audio
+        wav = torch.from_numpy(wav).unsqueeze(0).to(model.device)
+        mel = mel_spectrogram_torch(
+            wav, audio.filter_length, audio.n_mel_channels, audio.input_sample_rate,
+            audio.hop_length, audio.win_length, audio.mel_fmin, audio.mel_fmax,
+        )
+        return mel.cpu().numpy()
+
+
+    def _voice_features(self, voice_path: str) -> np.ndarray:
+        """Returns features of a voice file, computing them only if the file is new or has changed."""
+        stat = os.stat(voice_path)
+        mtime, size, features = self._speakers.get(voice_path, (None, None, None))
+        if (mtime, size) == (stat.st_mtime, stat.st_size):
+            return features
+
+        cache = SpeakerCache()
+        voice_hash = file_sha256(voice_path)
+        cached_path = cache.get(voice_hash, '.npy')
+        if cached_path:
+            features = np.load(cached_path)
+        else:
+            features = self._speaker_features(voice_path)
+            tmp_path = os.path.join(cache.path, f"{voice_hash}.new.npy")
+            np.save(tmp_path, features)
+            cache.put(voice_hash, tmp_path, '.npy')
+
+        self._speakers[voice_path] = (stat.st_mtime, stat.st_size, features)
+        return features
+
+
+    def _convert(self, source: Audio, target: Audio) -> np.ndarray:
+        """Mirrors the source part of FreeVC.voice_conversion with precomputed target features."""
+        import torch
+
+        features = self._voice_features(target) if isinstance(target, str) else self._speaker_features(target)
+        model = self.model
+        with torch.no_grad():
+            wav = model.load_audio(source)
+            content = model.extract_wavlm_features(wav[None, :])
+            features = torch.from_numpy(features).to(model.device)
+            if model.config.model_args.use_spk:
+                audio = model.inference(content, g=features[None, :, None])
+            else:
+                audio = model.inference(content, mel=features.transpose(1, 2))
+        return audio[0][0].data.cpu().float().numpy()
+
+
+    async def precompute(self, voice_path: str) -> dict:
+        """
+        Computes and stores features of a target voice ahead of conversions.
+
+        Returns:
+            A dictionary with either {'path': voice_path} on success or {'error': error_message} on failure
+        """
+        try:
+            await self._run(self._voice_features, voice_path)
+        except Exception as e:
+            return {'error': f"{type(e).__name__}: {e}"}
+        return {'path': voice_path}
+
+
+    async def convert(self, source: Audio, target: Audio) -> dict:
+        """
+        Converts speech in `source` to the voice of `target`.
+
+        Args:
+            source: Speech to convert
+            target: Sample of the target voice
+        Returns:
+            A dictionary with either {'audio': samples, 'sample_rate': rate} on success or {'error': error_message} on failure
+        """
+        try:
+            audio = await self._run(self._convert, source, target)
+        except Exception as e:
+            return {'error': f"{type(e).__name__}: {e}"}
+        return {'audio': audio, 'sample_rate': self.output_sample_rate}
+
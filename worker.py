@@ -0,0 +1,18 @@
+import signal
+import asyncio
+
+from utils.job_broker import create_broker
+from utils.job_worker import JobWorker
+
+async def run():
+    worker = JobWorker(create_broker())
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.stop)
+    await worker.run()
+
+def main():
+    asyncio.run(run())
+
+if __name__ == "__main__":
+    main()